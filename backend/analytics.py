@@ -0,0 +1,400 @@
+"""
+Dashboard analytics computed from the aggregate cube
+
+Each function takes an AggregateCube, or any source with the same totals()
+and rollup() queries such as DuckDBQueries (or None before any data is
+loaded), and returns the JSON payload for one dashboard endpoint. They are
+plain synchronous functions so the API can run them on a worker pool.
+
+The *_approx functions answer the same endpoints from an ApproxIndex, with
+a confidence interval per rate; groups with too few sampled events get a
+None rate, which fill_exact() replaces with the exact answer.
+"""
+import numpy as np
+
+import metrics
+
+def kpis(cube):
+    """Dashboard KPIs"""
+    if cube is None:
+        return {
+            "overall_failure_rate": 0,
+            "highest_risk_district": "N/A",
+            "worst_device": "N/A",
+            "elderly_failure_delta": 0,
+            "seasonal_spike": 0
+        }
+    
+    total, failures = cube.totals()
+    failure_rate = (failures / total * 100) if total > 0 else 0
+    
+    # Highest risk district
+    district_failures = cube.rollup(['district'])
+    district_failures = district_failures[district_failures['failures'] > 0]
+    highest_risk_district = district_failures['district'].iloc[district_failures['failures'].to_numpy().argmax()] if len(district_failures) > 0 else "N/A"
+    
+    # Worst device
+    device_failures = cube.rollup(['device_model'])
+    device_failures = device_failures[device_failures['failures'] > 0]
+    worst_device = device_failures['device_model'].iloc[device_failures['failures'].to_numpy().argmax()] if len(device_failures) > 0 else "N/A"
+    
+    # Elderly failure delta
+    elderly_total, elderly_failures = cube.totals({'age_group': 'elderly'})
+    non_elderly_total, non_elderly_failures = total - elderly_total, failures - elderly_failures
+    elderly_failure_rate = (elderly_failures / elderly_total * 100) if elderly_total > 0 else 0
+    non_elderly_failure_rate = (non_elderly_failures / non_elderly_total * 100) if non_elderly_total > 0 else 0
+    elderly_delta = elderly_failure_rate - non_elderly_failure_rate
+    
+    # Seasonal spike
+    monthly_failures = cube.rollup(['month_of_year'])['failures'].to_numpy()
+    monthly_failures = monthly_failures[monthly_failures > 0]
+    avg_monthly = monthly_failures.mean() if len(monthly_failures) > 0 else 0
+    peak_month = monthly_failures.max() if len(monthly_failures) > 0 else 0
+    seasonal_spike = ((peak_month - avg_monthly) / avg_monthly * 100) if avg_monthly > 0 else 0
+    
+    return {
+        "overall_failure_rate": round(failure_rate, 2),
+        "highest_risk_district": highest_risk_district,
+        "worst_device": worst_device,
+        "elderly_failure_delta": round(elderly_delta, 2),
+        "seasonal_spike": round(seasonal_spike, 2)
+    }
+
+def risk_zones(cube, biometric_type=None, age_group=None, device_model=None, gender=None,
+               start_date=None, end_date=None, state=None):
+    """
+    Risk zone data for map visualization
+
+    Zones are states, or the districts of `state` when one is given, in
+    order of their first event matching the filters other than dates.
+    `start_date`/`end_date` (inclusive) need a source that indexes days,
+    such as RiskIndex or DuckDBQueries.
+    """
+    if cube is None:
+        return {"zones": []}
+    
+    where = {}
+    if biometric_type:
+        where['biometric_type'] = biometric_type
+    if age_group:
+        where['age_group'] = age_group
+    if device_model:
+        where['device_model'] = device_model
+    if gender:
+        where['gender'] = gender
+    if start_date or end_date:
+        where['date'] = (start_date, end_date)
+    by = ['state']
+    if state:
+        where['state'] = state
+        by = ['state', 'district']
+    
+    # Calculate failure rates by zone, in order of first appearance, then by label
+    zones = cube.rollup(by, where).sort_values(['first_seen', *by], ignore_index=True)
+    with metrics.span("format"):
+        risk_data = []
+        for row in zip(*(zones[name] for name in by), zones['total'], zones['failures']):
+            *labels, total, failures = row
+            failure_rate = (failures / total * 100) if total > 0 else 0
+        
+            risk_data.append({
+                **dict(zip(by, labels)),
+                "failure_rate": round(failure_rate, 2),
+                "total_attempts": int(total),
+                "failures": int(failures)
+            })
+    
+    return {"zones": risk_data}
+
+def feature_importance(cube):
+    """Feature importance derived from per-category failure rates"""
+    if cube is None:
+        return {"features": []}
+    
+    # Simplified feature importance based on correlation
+    features = []
+    has_failures = cube.totals()[1] > 0
+    
+    for name, dimension in [("Age Group", 'age_group'), ("Biometric Type", 'biometric_type'), ("Device Model", 'device_model')]:
+        groups = cube.rollup([dimension])
+        if has_failures:
+            importance = (groups['failures'] / groups['total']).max()
+            features.append({"name": name, "importance": float(importance * 100)})
+    
+    # Sort by importance
+    features.sort(key=lambda x: x['importance'], reverse=True)
+    
+    return {"features": features}
+
+@metrics.timed("format")
+def _group_failure_rates(groups, dimension, key):
+    """Format a cube rollup as a list of {key: label, failure_rate: pct} rows"""
+    rows = []
+    for label, total, failures in zip(groups[dimension], groups['total'].to_numpy(), groups['failures'].to_numpy()):
+        rows.append({
+            key: label,
+            "failure_rate": round((failures / total * 100) if total > 0 else 0, 2)
+        })
+    return rows
+
+def trends(cube):
+    """Time-series and demographic trends"""
+    if cube is None:
+        return {"monthly": [], "age_groups": [], "devices": []}
+    
+    return {
+        "monthly": _group_failure_rates(cube.rollup(['month']), 'month', "month"),
+        "age_groups": _group_failure_rates(cube.rollup(['age_group']), 'age_group', "age_group"),
+        "devices": _group_failure_rates(cube.rollup(['device_model']), 'device_model', "device")
+    }
+
+def _approx_rate(row, min_samples):
+    """
+    Failure percentage, its confidence interval and whether it is exact, for
+    a row of ApproxIndex.estimate(); the rate is None when the group holds
+    fewer than `min_samples` sampled events and needs an exact answer
+    """
+    if not row.exact and row.samples < min_samples:
+        return {"failure_rate": None, "failure_rate_ci": None, "exact": False}
+    return {
+        "failure_rate": round(float(row.rate) * 100, 2),
+        "failure_rate_ci": [round(float(row.low) * 100, 2), round(float(row.high) * 100, 2)],
+        "exact": bool(row.exact)
+    }
+
+def kpis_approx(index, min_samples):
+    """
+    Dashboard KPIs from an ApproxIndex
+
+    The overall rate and the elderly delta are estimated from the samples,
+    with confidence intervals; the district, device and seasonal rankings
+    come from the count sketch.
+    """
+    if index is None:
+        return {**kpis(None), "overall_failure_rate_ci": [0, 0], "elderly_failure_delta_ci": [0, 0],
+                "approximate": True}
+    
+    overall = _approx_rate(next(index.estimate().itertuples()), min_samples)
+    
+    # Highest risk district and worst device by sketched failures
+    rankings = {}
+    for dim in ('district', 'device_model'):
+        labels, _, failures = index.counts(dim)
+        rankings[dim] = labels[int(failures.argmax())] if len(labels) and failures.max() > 0 else "N/A"
+    
+    # Elderly failure delta; the two groups are disjoint, so their variances add
+    others = [label for label in index.vocab['age_group'] if label != 'elderly']
+    elderly = next(index.estimate((), {'age_group': 'elderly'}).itertuples())
+    non_elderly = next(index.estimate((), {'age_group': others}).itertuples())
+    elderly_delta = None
+    elderly_delta_ci = None
+    if all(row.exact or row.samples >= min_samples for row in (elderly, non_elderly)):
+        delta = float(elderly.rate - non_elderly.rate) * 100 if elderly.total > 0 and non_elderly.total > 0 else 0
+        half = float(np.hypot(elderly.high - elderly.low, non_elderly.high - non_elderly.low)) / 2 * 100
+        elderly_delta = round(delta, 2)
+        elderly_delta_ci = [round(delta - half, 2), round(delta + half, 2)]
+    
+    # Seasonal spike
+    _, _, monthly_failures = index.counts('month_of_year')
+    monthly_failures = monthly_failures[monthly_failures > 0]
+    avg_monthly = monthly_failures.mean() if len(monthly_failures) > 0 else 0
+    peak_month = monthly_failures.max() if len(monthly_failures) > 0 else 0
+    seasonal_spike = ((peak_month - avg_monthly) / avg_monthly * 100) if avg_monthly > 0 else 0
+    
+    return {
+        "overall_failure_rate": overall["failure_rate"],
+        "overall_failure_rate_ci": overall["failure_rate_ci"],
+        "highest_risk_district": rankings['district'],
+        "worst_device": rankings['device_model'],
+        "elderly_failure_delta": elderly_delta,
+        "elderly_failure_delta_ci": elderly_delta_ci,
+        "seasonal_spike": round(float(seasonal_spike), 2),
+        "approximate": True
+    }
+
+def risk_zones_approx(index, min_samples, biometric_type=None, age_group=None, device_model=None, gender=None,
+                      start_date=None, end_date=None, state=None):
+    """
+    Risk zones (see risk_zones()) estimated from an ApproxIndex
+
+    Zones come in order of first appearance in the dataset; each has a
+    confidence interval and estimated attempt and failure counts.
+    """
+    if index is None:
+        return {"zones": [], "approximate": True}
+    
+    where = {dim: value for dim, value in [('biometric_type', biometric_type), ('age_group', age_group),
+                                           ('device_model', device_model), ('gender', gender)] if value}
+    if start_date or end_date:
+        where['date'] = (start_date, end_date)
+    by = ['state']
+    if state:
+        where['state'] = state
+        by = ['state', 'district']
+    
+    zones = index.estimate(by, where).sort_values(['first_seen', *by], ignore_index=True)
+    with metrics.span("format"):
+        risk_data = []
+        for row in zones.itertuples():
+            # Groups known to hold no matching events are left out, as in risk_zones()
+            if row.exact and row.total == 0:
+                continue
+            risk_data.append({
+                **{name: getattr(row, name) for name in by},
+                **_approx_rate(row, min_samples),
+                "total_attempts": int(row.total),
+                "failures": int(row.failures)
+            })
+    
+    return {"zones": risk_data, "approximate": True}
+
+@metrics.timed("format")
+def _approx_group_rates(groups, dimension, key, min_samples):
+    """Format an ApproxIndex estimate as a list of {key: label, failure_rate: pct, ...} rows"""
+    return [{key: getattr(row, dimension), **_approx_rate(row, min_samples)} for row in groups.itertuples()]
+
+def trends_approx(index, min_samples):
+    """Time-series and demographic trends (see trends()) estimated from an ApproxIndex"""
+    if index is None:
+        return {"monthly": [], "age_groups": [], "devices": [], "approximate": True}
+    
+    return {
+        "monthly": _approx_group_rates(index.estimate(['month']), 'month', "month", min_samples),
+        "age_groups": _approx_group_rates(index.estimate(['age_group']), 'age_group', "age_group", min_samples),
+        "devices": _approx_group_rates(index.estimate(['device_model']), 'device_model', "device", min_samples),
+        "approximate": True
+    }
+
+def needs_exact(payload):
+    """Whether an approximate payload has groups too small to estimate"""
+    for value in payload.values():
+        if value is None or (isinstance(value, list) and any(row.get("failure_rate", 0) is None
+                                                              for row in value if isinstance(row, dict))):
+            return True
+    return False
+
+def _labels(row):
+    return tuple((key, value) for key, value in row.items() if isinstance(value, str))
+
+def fill_exact(payload, exact):
+    """
+    Replace the groups of an approximate payload that were too small to
+    estimate with their answers from the exact `payload`, marked exact
+    """
+    filled = dict(payload)
+    for key, value in payload.items():
+        if value is None and key in exact:
+            filled[key] = exact[key]
+            if f"{key}_ci" in payload:
+                filled[f"{key}_ci"] = [exact[key], exact[key]]
+        elif isinstance(value, list) and key in exact:
+            exact_rows = {_labels(row): row for row in exact[key]}
+            rows = []
+            for row in value:
+                if row.get("failure_rate", 0) is None:
+                    match = exact_rows.get(_labels(row))
+                    # No matching events at all
+                    if match is None:
+                        continue
+                    row = {**row, **match, "failure_rate_ci": [match["failure_rate"]] * 2, "exact": True}
+                rows.append(row)
+            filled[key] = rows
+    return filled
+
+def _rates(failures, total):
+    """Failure percentages for parallel lists of counts; None where there were no attempts"""
+    return [round(f / t * 100, 2) if t > 0 else None for f, t in zip(failures, total)]
+
+def timeseries(store, granularity="day", start_date=None, end_date=None, by=None, windows=(),
+               state=None, device_model=None, age_group=None, biometric_type=None):
+    """
+    Failure-rate series at a granularity over an optional date range
+
+    Splits into one series per value of `by` (a SERIES_DIMENSIONS name) and
+    adds a rolling failure rate over each of `windows` days, ending at each
+    bucket's end.
+    """
+    if store is None:
+        return {"granularity": granularity, "series": []}
+    
+    where = {dim: value for dim, value in [('state', state), ('device_model', device_model),
+                                           ('age_group', age_group), ('biometric_type', biometric_type)] if value}
+    labels, edges = store.buckets(granularity, start_date, end_date)
+    total, failures = store.counts(edges, by, where)
+    rolling = {days: store.rolling(edges[1:], days * 24, by, where) for days in windows}
+    
+    with metrics.span("format"):
+        series = []
+        for g, key in enumerate(store.groups(by, where)):
+            # Plain Python lists per column; indexing numpy arrays per point is far slower
+            group_total = total[:, g].tolist()
+            group_failures = failures[:, g].tolist()
+            columns = {
+                "bucket": labels,
+                "total_attempts": group_total,
+                "failures": group_failures,
+                "failure_rate": _rates(group_failures, group_total)
+            }
+            for days, (window_total, window_failures) in rolling.items():
+                columns[f"rolling_{days}d"] = _rates(window_failures[:, g].tolist(), window_total[:, g].tolist())
+            points = [dict(zip(columns, values)) for values in zip(*columns.values())]
+            series.append({"key": key, "points": points})
+    
+    return {"granularity": granularity, "series": series}
+
+def insights(cube):
+    """Actionable insights"""
+    if cube is None:
+        return {"insights": []}
+    
+    insights = []
+    
+    # Elderly fingerprint failures in winter
+    winter_months = [11, 12, 1, 2]
+    elderly_winter_total, elderly_winter_failures = cube.totals({
+        'age_group': 'elderly',
+        'biometric_type': 'fingerprint',
+        'month_of_year': winter_months
+    })
+    if elderly_winter_total > 0:
+        elderly_winter_failure_rate = elderly_winter_failures / elderly_winter_total * 100
+        if elderly_winter_failure_rate > 20:
+            insights.append({
+                "type": "warning",
+                "title": "Elderly Fingerprint Failures High in Winter",
+                "description": f"Elderly users experience {elderly_winter_failure_rate:.1f}% failure rate during winter months. Consider promoting iris authentication or device upgrades.",
+                "priority": "High"
+            })
+    
+    # Device model analysis
+    total, failures = cube.totals()
+    avg_failure_rate = failures / total * 100
+    device_failures = cube.rollup(['device_model'])
+    with metrics.span("insights.devices"):
+        for device, total, failures in zip(device_failures['device_model'], device_failures['total'].to_numpy(), device_failures['failures'].to_numpy()):
+            failure_rate = (failures / total * 100) if total > 0 else 0
+        
+            if failure_rate > avg_failure_rate * 1.5:
+                multiplier = failure_rate / avg_failure_rate if avg_failure_rate > 0 else 0
+                insights.append({
+                    "type": "critical",
+                    "title": f"Device Model {device} Underperforming",
+                    "description": f"Device model {device} shows {multiplier:.1f}x higher failure rate ({failure_rate:.1f}% vs {avg_failure_rate:.1f}%). Recommend replacement or firmware update.",
+                    "priority": "High"
+                })
+    
+    # Regional risk
+    state_failures = cube.rollup(['state'])
+    with metrics.span("insights.states"):
+        for state, total, failures in zip(state_failures['state'], state_failures['total'].to_numpy(), state_failures['failures'].to_numpy()):
+            failure_rate = (failures / total * 100) if total > 0 else 0
+        
+            if failure_rate > 25:
+                insights.append({
+                    "type": "warning",
+                    "title": f"High Risk Zone: {state}",
+                    "description": f"{state} shows {failure_rate:.1f}% failure rate. Investigate environmental factors, device quality, or user demographics.",
+                    "priority": "Medium"
+                })
+    
+    return {"insights": insights[:10]}  # Return top 10 insights
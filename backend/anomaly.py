@@ -0,0 +1,190 @@
+"""
+Streaming detector for failure-rate spikes
+
+Every (device_model, district, biometric_type) combination keeps a few
+numbers of state: a slow EWMA of its failure rate as the baseline, a fast
+EWMA as the recent rate, and a Bernoulli CUSUM statistic testing whether
+failures have shifted from the baseline to `shift` times it. Each event
+updates its combination's state in O(1), so the detector follows ingested
+batches as they arrive and memory is bounded by the number of combinations,
+not events.
+
+A combination is flagged when its CUSUM crosses `threshold`, and cleared
+once its recent rate falls back to halfway between the baseline and the
+shifted rate. The baseline is frozen while flagged so a long spike is not
+absorbed into it.
+"""
+import math
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+KEY_DIMENSIONS = ['device_model', 'district', 'biometric_type']
+
+class AnomalyDetector:
+    """Per-combination EWMA/CUSUM state over a stream of authentication events"""
+
+    def __init__(self, shift=2.0, threshold=10.0, baseline_alpha=0.005, recent_alpha=0.05,
+                 warmup=200, min_rate=0.01, max_history=200):
+        self.shift = shift
+        self.threshold = threshold
+        self.baseline_alpha = baseline_alpha
+        self.recent_alpha = recent_alpha
+        self.warmup = warmup
+        self.min_rate = min_rate
+        # Baseline rates are capped so the shifted rate stays a probability
+        self.max_rate = 0.95 / shift
+        # Log-likelihood ratio of a failure is constant for a multiplicative shift
+        self._failure_llr = math.log(shift)
+
+        # Per-slot state, one slot per observed key
+        self.slots = {}
+        self.keys = []
+        self.count = []
+        self.baseline = []
+        self.recent = []
+        self.cusum = []
+        # slot -> alert for keys currently flagged
+        self.active = {}
+        self.history = deque(maxlen=max_history)
+        self.events = 0
+        self.detected = 0
+
+    def state(self):
+        """JSON-serializable state from which from_state() rebuilds the detector"""
+        params = {"shift": self.shift, "threshold": self.threshold, "baseline_alpha": self.baseline_alpha,
+                  "recent_alpha": self.recent_alpha, "warmup": self.warmup, "min_rate": self.min_rate,
+                  "max_history": self.history.maxlen}
+        return {"params": params, "keys": self.keys, "count": self.count, "baseline": self.baseline,
+                "recent": self.recent, "cusum": self.cusum, "active": list(self.active.items()),
+                "history": list(self.history), "events": self.events, "detected": self.detected}
+
+    @classmethod
+    def from_state(cls, state):
+        detector = cls(**state["params"])
+        detector.keys = [tuple(key) for key in state["keys"]]
+        detector.slots = {key: slot for slot, key in enumerate(detector.keys)}
+        detector.count = list(state["count"])
+        detector.baseline = list(state["baseline"])
+        detector.recent = list(state["recent"])
+        detector.cusum = list(state["cusum"])
+        detector.active = {slot: alert for slot, alert in state["active"]}
+        detector.history.extend(state["history"])
+        detector.events = state["events"]
+        detector.detected = state["detected"]
+        return detector
+
+    def _slots_for(self, batch):
+        """Slot of each row's key, adding slots for keys not seen before"""
+        codes = []
+        labels = []
+        for dim in KEY_DIMENSIONS:
+            dim_codes, dim_labels = pd.factorize(batch[dim])
+            codes.append(dim_codes)
+            labels.append(dim_labels)
+        shape = tuple(max(len(dim_labels), 1) for dim_labels in labels)
+        combined, inverse = np.unique(np.ravel_multi_index(codes, shape), return_inverse=True)
+
+        key_slots = []
+        for code in zip(*np.unravel_index(combined, shape)):
+            key = tuple(str(dim_labels[i]) for dim_labels, i in zip(labels, code))
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self.slots[key] = len(self.keys)
+                self.keys.append(key)
+                self.count.append(0)
+                self.baseline.append(0.0)
+                self.recent.append(0.0)
+                self.cusum.append(0.0)
+            key_slots.append(slot)
+        return np.asarray(key_slots, dtype=np.int64)[inverse]
+
+    def update(self, batch):
+        """
+        Fold a batch of events into the detector, in timestamp order
+
+        Returns the changes as ("anomaly", alert) when a key is flagged and
+        ("resolved", alert) when it clears.
+        """
+        if not len(batch):
+            return []
+        order = np.argsort(batch['auth_timestamp'].to_numpy(), kind='stable')
+        slots = self._slots_for(batch)[order].tolist()
+        if 'is_failure' in batch:
+            failed = batch['is_failure'].to_numpy()[order].astype(bool).tolist()
+        else:
+            failed = (batch['auth_result'] == 'failure').to_numpy()[order].tolist()
+        timestamps = batch['auth_timestamp'].to_numpy()[order]
+
+        count, baseline, recent, cusum = self.count, self.baseline, self.recent, self.cusum
+        active = self.active
+        baseline_alpha, recent_alpha = self.baseline_alpha, self.recent_alpha
+        min_rate, max_rate, shift = self.min_rate, self.max_rate, self.shift
+        failure_llr, threshold, warmup = self._failure_llr, self.threshold, self.warmup
+        changes = []
+        for i, (slot, failure) in enumerate(zip(slots, failed)):
+            n = count[slot] + 1
+            count[slot] = n
+            r = recent[slot] + recent_alpha * (failure - recent[slot])
+            recent[slot] = r
+            p = baseline[slot]
+
+            if slot in active:
+                if r <= min(max(p, min_rate), max_rate) * (1 + shift) / 2:
+                    changes.append(("resolved", self._resolve(slot, timestamps[i])))
+                continue
+
+            # Running mean until the EWMA's effective window has filled
+            p += max(baseline_alpha, 1 / n) * (failure - p)
+            baseline[slot] = p
+            if n <= warmup:
+                continue
+
+            p = min(max(p, min_rate), max_rate)
+            s = cusum[slot] + (failure_llr if failure else math.log((1 - shift * p) / (1 - p)))
+            if s > threshold:
+                cusum[slot] = 0.0
+                changes.append(("anomaly", self._flag(slot, timestamps[i])))
+            else:
+                cusum[slot] = s if s > 0 else 0.0
+
+        self.events += len(slots)
+        return changes
+
+    def _flag(self, slot, timestamp):
+        device_model, district, biometric_type = self.keys[slot]
+        baseline = self.baseline[slot] * 100
+        recent = self.recent[slot] * 100
+        alert = {
+            "type": "critical",
+            "title": f"Failure Spike: {device_model} in {district}",
+            "description": f"{biometric_type.title()} failures on {device_model} in {district} are running at "
+                           f"{recent:.1f}% against a {baseline:.1f}% baseline. Check device health and "
+                           f"operator conditions at the affected centres.",
+            "priority": "High",
+            "device_model": device_model,
+            "district": district,
+            "biometric_type": biometric_type,
+            "baseline_rate": round(baseline, 2),
+            "failure_rate": round(recent, 2),
+            "detected_at": str(np.datetime64(timestamp, 's')),
+        }
+        self.active[slot] = alert
+        self.history.append(alert)
+        self.detected += 1
+        return alert
+
+    def _resolve(self, slot, timestamp):
+        alert = self.active.pop(slot)
+        self.cusum[slot] = 0.0
+        return {**alert, "type": "info", "priority": "Low", "failure_rate": round(self.recent[slot] * 100, 2),
+                "resolved_at": str(np.datetime64(timestamp, 's'))}
+
+    def alerts(self):
+        """Alerts for keys currently flagged, most recently detected first"""
+        return sorted(self.active.values(), key=lambda alert: alert["detected_at"], reverse=True)
+
+    def stats(self):
+        return {"events": self.events, "keys": len(self.keys), "active": len(self.active),
+                "detected": self.detected}
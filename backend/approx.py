@@ -0,0 +1,388 @@
+"""
+Stratified samples and count sketches behind the approximate analytics mode
+
+An ApproxIndex answers failure-rate queries from a bounded summary of the
+events rather than from every event:
+
+- a uniform sample of up to `sample_size` events per (state, device model)
+  stratum, kept as a bottom-k reservoir: each event draws a random priority
+  and a stratum keeps its `sample_size` lowest, so two samples merge into
+  the sample of the combined events (ingested batches fold in without
+  revisiting old events);
+- the exact number of events per stratum, which weights each stratum's
+  sample (stratified ratio estimation);
+- a Count-Min sketch of attempts and failures per dimension label, for the
+  volume rankings (highest-risk district, worst device, seasonal spike).
+
+Rates come with a normal-approximation confidence interval computed from
+the within-stratum variance of the sample. A stratum holding all of its
+events contributes no error, so small datasets are answered exactly. The
+index's size depends on the number of strata, not on the number of events.
+"""
+import functools
+import hashlib
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from event_store import DIMENSIONS, _code_dtype
+
+# Events kept per (state, device model) stratum
+DEFAULT_SAMPLE_SIZE = 8192
+
+STRATA = ('state', 'device_model')
+
+# z-score of the reported confidence intervals (95%)
+Z = 1.96
+
+NEVER_SEEN = np.iinfo(np.int64).max
+
+# Count-Min sketch shape: estimates exceed the true count by at most
+# e/width of all events with probability 1 - exp(-depth)
+SKETCH_DEPTH = 4
+SKETCH_WIDTH = 1 << 14
+
+# Labels counted in the sketch besides DIMENSIONS
+SKETCH_DIMENSIONS = DIMENSIONS + ['month', 'month_of_year']
+
+def _month_label(month):
+    return str(np.datetime64(int(month), 'M'))
+
+def _bottom_k(strata, priority, k):
+    """Positions of the `k` lowest-priority rows of each stratum, in row order"""
+    # Priorities are in [0, 1), so one sort of stratum + priority orders by both
+    order = np.argsort(strata + priority)
+    ordered = strata[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(ordered)) + 1]
+    lengths = np.diff(np.r_[starts, len(ordered)])
+    rank = np.arange(len(ordered)) - np.repeat(starts, lengths)
+    return np.sort(order[rank < k])
+
+class CountMinSketch:
+    """Count-Min sketch of attempt and failure counts keyed by (dimension, label)"""
+
+    def __init__(self, attempts=None, failures=None):
+        shape = (SKETCH_DEPTH, SKETCH_WIDTH)
+        self.attempts = np.zeros(shape, dtype=np.int64) if attempts is None else attempts
+        self.failures = np.zeros(shape, dtype=np.int64) if failures is None else failures
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _cells(dim, label):
+        """One column per row of the sketch, from a hash that is stable across processes"""
+        digest = hashlib.blake2b(f"{dim}={label}".encode(), digest_size=8 * SKETCH_DEPTH).digest()
+        return np.frombuffer(digest, dtype=np.uint64) % SKETCH_WIDTH
+
+    def add(self, dim, labels, attempts, failures):
+        """Add per-label counts of one dimension"""
+        for label, label_attempts, label_failures in zip(labels, attempts, failures):
+            if label_attempts:
+                cells = self._cells(dim, label)
+                self.attempts[np.arange(SKETCH_DEPTH), cells] += label_attempts
+                self.failures[np.arange(SKETCH_DEPTH), cells] += label_failures
+
+    def query(self, dim, labels):
+        """(attempts, failures) estimates of each label of `dim`"""
+        cells = np.array([self._cells(dim, label) for label in labels]).reshape(len(labels), SKETCH_DEPTH)
+        rows = np.arange(SKETCH_DEPTH)
+        return self.attempts[rows, cells].min(axis=1), self.failures[rows, cells].min(axis=1)
+
+    def merge(self, other):
+        return CountMinSketch(self.attempts + other.attempts, self.failures + other.failures)
+
+class ApproxIndex:
+    """Stratified bottom-k samples, stratum sizes and a count sketch of the events"""
+
+    def __init__(self, vocab, months, sample_size, sample, population, first_seen, sketch):
+        arrays = [*sample.values(), population, first_seen, sketch.attempts, sketch.failures]
+        for array in arrays:
+            array.setflags(write=False)
+        self.vocab = vocab
+        # Months (since the epoch) with events, for the month groups
+        self.months = months
+        self.sample_size = sample_size
+        # Sample rows: codes per dimension, day and month since the epoch, success, priority
+        self.sample = sample
+        # Events per (state, device model)
+        self.population = population
+        # First row position per (state, district), to order zones as the exact sources do
+        self.first_seen = first_seen
+        self.sketch = sketch
+        strata = sample['state'].astype(np.int64) * population.shape[1] + sample['device_model']
+        self.stratum_samples = np.bincount(strata, minlength=population.size)
+        # Queries read sampled events as units with a count and a failure
+        # count; without a date filter, from the sample pre-aggregated into
+        # cells of identical labels and month, which are far fewer than events
+        self._rows = {**{dim: sample[dim] for dim in DIMENSIONS}, 'month': sample['month'], 'day': sample['day'],
+                      'strata': strata, 'count': np.ones(len(strata)),
+                      'failed': (~sample['success']).astype(np.float64)}
+        self._cells = self._aggregate(self._rows)
+
+    def _aggregate(self, rows):
+        month_codes = np.searchsorted(self.months, rows['month'])
+        shape = tuple(max(len(self.vocab[dim]), 1) for dim in DIMENSIONS) + (max(len(self.months), 1),)
+        keys = np.ravel_multi_index([rows[dim] for dim in DIMENSIONS] + [month_codes], shape)
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        cells = {key: rows[key][first] for key in DIMENSIONS + ['month', 'strata']}
+        cells['count'] = np.bincount(inverse, minlength=len(first)).astype(np.float64)
+        cells['failed'] = np.bincount(inverse, weights=rows['failed'], minlength=len(first))
+        return cells
+
+    def shared_arrays(self):
+        """(arrays, metadata) from which from_shared_arrays() rebuilds the index"""
+        arrays = {f"sample.{key}": array for key, array in self.sample.items()}
+        arrays.update(population=self.population, first_seen=self.first_seen,
+                      sketch_attempts=self.sketch.attempts, sketch_failures=self.sketch.failures)
+        return arrays, (self.vocab, self.months, self.sample_size)
+
+    @classmethod
+    def from_shared_arrays(cls, arrays, meta):
+        vocab, months, sample_size = meta
+        sample = {key.split(".", 1)[1]: array for key, array in arrays.items() if key.startswith("sample.")}
+        return cls(vocab, months, sample_size, sample, arrays["population"], arrays["first_seen"],
+                   CountMinSketch(arrays["sketch_attempts"], arrays["sketch_failures"]))
+
+    @classmethod
+    def from_events(cls, events, offset=0, sample_size=DEFAULT_SAMPLE_SIZE, seed=0):
+        """
+        Build the index from an EventChunk
+
+        `offset` is the position of the chunk's first event in the full
+        dataset; it seeds the priorities, so each chunk draws its own.
+        """
+        vocab = {dim: list(events.vocab[dim]) for dim in DIMENSIONS}
+        codes = {dim: events.codes[dim] for dim in DIMENSIONS}
+        shape = tuple(max(len(vocab[dim]), 1) for dim in STRATA)
+        strata = codes['state'].astype(np.int64) * shape[1] + codes['device_model']
+        population = np.bincount(strata, minlength=shape[0] * shape[1])
+
+        # Only rows whose priority falls well inside their stratum's quota are sorted
+        priority = np.random.default_rng([seed, offset]).random(len(events))
+        quota = np.minimum(1.0, 1.5 * (sample_size + 10) / np.maximum(population, 1))
+        candidates = np.flatnonzero(priority < quota[strata])
+        if (np.bincount(strata[candidates], minlength=len(population)) < np.minimum(population, sample_size)).any():
+            candidates = np.arange(len(events))
+        rows = candidates[_bottom_k(strata[candidates], priority[candidates], sample_size)]
+
+        days = events.timestamps('D').astype(np.int64)
+        months = events.timestamps('M').astype(np.int64)
+        success = events.is_success()
+        sample = {dim: codes[dim][rows] for dim in DIMENSIONS}
+        sample.update(day=days[rows].astype(np.int32), month=months[rows].astype(np.int32),
+                      success=success[rows], priority=priority[rows])
+
+        pair_shape = (max(len(vocab['state']), 1), max(len(vocab['district']), 1))
+        pairs, first_rows = np.unique(codes['state'].astype(np.int64) * pair_shape[1] + codes['district'],
+                                      return_index=True)
+        first_seen = np.full(pair_shape[0] * pair_shape[1], NEVER_SEEN, dtype=np.int64)
+        first_seen[pairs] = first_rows + offset
+
+        sketch = CountMinSketch()
+        failure = ~success
+        month_codes, month_labels = events.periods()
+        for dim, dim_codes, labels in [*((dim, codes[dim], vocab[dim]) for dim in DIMENSIONS),
+                                       ('month', month_codes, month_labels)]:
+            sketch.add(dim, labels, np.bincount(dim_codes, minlength=len(labels)),
+                       np.bincount(dim_codes[failure], minlength=len(labels)))
+        of_year = months % 12
+        sketch.add('month_of_year', list(range(1, 13)), np.bincount(of_year, minlength=12),
+                   np.bincount(of_year[failure], minlength=12))
+
+        return cls(vocab, sorted(set(np.unique(months).tolist())), sample_size, sample,
+                   population.reshape(shape), first_seen.reshape(pair_shape), sketch)
+
+    @classmethod
+    def from_chunks(cls, chunks, sample_size=DEFAULT_SAMPLE_SIZE):
+        """Build the index from EventChunks read one at a time (see EventChunk.read)"""
+        index = None
+        offset = 0
+        for chunk in chunks:
+            if len(chunk):
+                chunk_index = cls.from_events(chunk, offset, sample_size)
+                index = chunk_index if index is None else index.merge(chunk_index)
+                offset += len(chunk)
+        return index
+
+    def merge(self, other):
+        """Return a new index over the events of this index and `other`"""
+        vocab = {dim: sorted(set(self.vocab[dim]) | set(other.vocab[dim])) for dim in DIMENSIONS}
+        shape = tuple(max(len(vocab[dim]), 1) for dim in STRATA)
+        pair_shape = (max(len(vocab['state']), 1), max(len(vocab['district']), 1))
+        population = np.zeros(shape, dtype=np.int64)
+        first_seen = np.full(pair_shape, NEVER_SEEN, dtype=np.int64)
+        parts = []
+        for index in (self, other):
+            lookups = {}
+            for dim in DIMENSIONS:
+                position = {label: i for i, label in enumerate(vocab[dim])}
+                lookups[dim] = np.array([position[label] for label in index.vocab[dim]], dtype=np.int64)
+            population[np.ix_(lookups['state'], lookups['device_model'])] += index.population
+            embedded = first_seen[np.ix_(lookups['state'], lookups['district'])]
+            first_seen[np.ix_(lookups['state'], lookups['district'])] = np.minimum(embedded, index.first_seen)
+            part = {dim: lookups[dim][index.sample[dim]].astype(_code_dtype(len(vocab[dim]))) for dim in DIMENSIONS}
+            part.update({key: index.sample[key] for key in ('day', 'month', 'success', 'priority')})
+            parts.append(part)
+        sample = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        strata = sample['state'].astype(np.int64) * shape[1] + sample['device_model']
+        sample_size = min(self.sample_size, other.sample_size)
+        rows = _bottom_k(strata, sample['priority'], sample_size)
+        sample = {key: array[rows] for key, array in sample.items()}
+        return ApproxIndex(vocab, sorted(set(self.months) | set(other.months)), sample_size, sample, population,
+                           first_seen, self.sketch.merge(other.sketch))
+
+    def __len__(self):
+        return int(self.population.sum())
+
+    @property
+    def nbytes(self):
+        arrays, _ = self.shared_arrays()
+        return sum(array.nbytes for array in arrays.values())
+
+    def _mask(self, units, where):
+        """Units matching `where` (labels or label lists per dimension, 'date' and 'month_of_year')"""
+        mask = np.ones(len(units['strata']), dtype=bool)
+        for dim, value in where.items():
+            if dim == 'date':
+                start, end = value
+                if start is not None:
+                    mask &= units['day'] >= np.datetime64(start, 'D').astype(np.int64)
+                if end is not None:
+                    mask &= units['day'] <= np.datetime64(end, 'D').astype(np.int64)
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            if dim == 'month_of_year':
+                allowed = np.isin(np.arange(13), list(values))
+                mask &= allowed[units['month'] % 12 + 1]
+            else:
+                allowed = np.zeros(max(len(self.vocab[dim]), 1), dtype=bool)
+                allowed[[self.vocab[dim].index(label) for label in values if label in self.vocab[dim]]] = True
+                mask &= allowed[units[dim]]
+        return mask
+
+    def _groups(self, units, by, where):
+        """(group labels, per-unit group index or -1) for the groups of `by` allowed by `where`"""
+        if not by:
+            return [()], np.zeros(len(units['strata']), dtype=np.int64)
+        if by == ['state', 'district']:
+            states, districts = np.nonzero(self.first_seen != NEVER_SEEN)
+            allowed = [(s, d) for s, d in zip(states, districts)
+                       if where.get('state') in (None, self.vocab['state'][s])]
+            lookup = np.full(self.first_seen.shape, -1, dtype=np.int64)
+            for i, (s, d) in enumerate(allowed):
+                lookup[s, d] = i
+            labels = [(self.vocab['state'][s], self.vocab['district'][d]) for s, d in allowed]
+            return labels, lookup[units['state'], units['district']]
+        domains = []
+        row_codes = []
+        for dim in by:
+            if dim == 'month':
+                labels = [_month_label(month) for month in self.months]
+                codes = np.searchsorted(self.months, units['month'])
+            else:
+                labels = self.vocab[dim]
+                codes = units[dim].astype(np.int64)
+            allowed = where.get(dim)
+            if allowed is not None and not isinstance(allowed, (list, tuple, set)):
+                allowed = [allowed]
+            keep = [i for i, label in enumerate(labels) if allowed is None or label in allowed]
+            lookup = np.full(len(labels), -1, dtype=np.int64)
+            lookup[keep] = np.arange(len(keep))
+            domains.append([labels[i] for i in keep])
+            row_codes.append(lookup[codes])
+        if len(by) == 1:
+            return [(label,) for label in domains[0]], row_codes[0]
+        shape = tuple(len(domain) for domain in domains)
+        valid = np.all([codes >= 0 for codes in row_codes], axis=0)
+        group = np.full(len(units['strata']), -1, dtype=np.int64)
+        if all(shape):
+            group[valid] = np.ravel_multi_index([codes[valid] for codes in row_codes], shape)
+        return list(itertools.product(*domains)), group
+
+    def _open_strata(self, labels, by, where):
+        """Whether each group spans a stratum whose sample holds only part of its events"""
+        partial = self.population > self.stratum_samples.reshape(self.population.shape)
+        positions = {dim: {label: i for i, label in enumerate(self.vocab[dim])} for dim in STRATA}
+        result = []
+        for group in labels:
+            selection = partial
+            for axis, dim in enumerate(STRATA):
+                value = dict(zip(by, group)).get(dim, where.get(dim))
+                if value is not None:
+                    values = value if isinstance(value, (list, tuple, set)) else [value]
+                    selection = np.take(selection, [positions[dim][label] for label in values
+                                                    if label in positions[dim]], axis=axis)
+            result.append(bool(selection.any()))
+        return np.array(result, dtype=bool)
+
+    @metrics.timed("approx.estimate")
+    def estimate(self, by=(), where=None):
+        """
+        Estimated attempts, failures and failure rate per group of `by`
+
+        Returns a frame with the `by` columns, `total` and `failures`
+        (estimated counts), `rate` with its confidence interval `low` and
+        `high` (fractions), `samples` (sampled events in the group) and
+        `exact` (no part of the group was left out of the sample). Groups
+        are every label (or (state, district) pair) of the index allowed by
+        `where`, including those no sampled event falls in.
+        """
+        by = list(by)
+        where = dict(where or {})
+        units = self._rows if 'date' in where else self._cells
+        labels, group = self._groups(units, by, where)
+        n_groups = len(labels)
+        n_strata = self.population.size
+        # Units outside the filters or groups go to one extra bin, dropped below
+        bins = n_groups * n_strata
+        keys = np.where(self._mask(units, where) & (group >= 0), group * n_strata + units['strata'], bins)
+        matched = np.bincount(keys, weights=units['count'], minlength=bins + 1)[:bins].reshape(n_groups, n_strata)
+        failed = np.bincount(keys, weights=units['failed'], minlength=bins + 1)[:bins].reshape(n_groups, n_strata)
+
+        population = self.population.ravel().astype(np.float64)
+        samples = self.stratum_samples.astype(np.float64)
+        weight = np.divide(population, samples, out=np.zeros_like(population), where=samples > 0)
+        total = matched @ weight
+        failures = failed @ weight
+        rate = np.divide(failures, total, out=np.zeros_like(total), where=total > 0)
+
+        # Linearized variance of the ratio estimator: z = failed - rate * matched per sampled event
+        r = rate[:, None]
+        sum_z = failed - r * matched
+        sum_z2 = failed * (1 - 2 * r) + r * r * matched
+        variance = np.divide(sum_z2 - sum_z * sum_z / np.maximum(samples, 1), samples - 1,
+                             out=np.zeros_like(sum_z), where=samples > 1)
+        fpc = np.divide(population - samples, population, out=np.zeros_like(population), where=population > 0)
+        variance = (variance * (population * population * fpc / np.maximum(samples, 1))).sum(axis=1)
+        half = Z * np.sqrt(np.maximum(variance, 0)) / np.where(total > 0, total, 1)
+
+        frame = pd.DataFrame(labels, columns=by) if by else pd.DataFrame(index=[0])
+        frame['total'] = np.rint(total).astype(np.int64)
+        frame['failures'] = np.rint(failures).astype(np.int64)
+        frame['rate'] = rate
+        frame['low'] = np.clip(rate - half, 0, 1)
+        frame['high'] = np.clip(rate + half, 0, 1)
+        frame['samples'] = np.rint(matched.sum(axis=1)).astype(np.int64)
+        frame['exact'] = ~self._open_strata(labels, by, where)
+        if 'state' in by:
+            state_first = self.first_seen.min(axis=1)
+            if 'district' in by:
+                pair = {(self.vocab['state'][s], self.vocab['district'][d]): self.first_seen[s, d]
+                        for s, d in zip(*np.nonzero(self.first_seen != NEVER_SEEN))}
+                frame['first_seen'] = [pair[(state, district)] for state, district in labels]
+            else:
+                position = {label: i for i, label in enumerate(self.vocab['state'])}
+                frame['first_seen'] = [state_first[position[state]] for state, *_ in labels]
+        return frame
+
+    def counts(self, dim):
+        """Sketched (labels, attempts, failures) of every label of `dim` (including 'month' and 'month_of_year')"""
+        if dim == 'month':
+            labels = [_month_label(month) for month in self.months]
+        elif dim == 'month_of_year':
+            labels = sorted({month % 12 + 1 for month in self.months})
+        else:
+            labels = self.vocab[dim]
+        attempts, failures = self.sketch.query(dim, labels)
+        return labels, attempts, failures
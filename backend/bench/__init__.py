@@ -0,0 +1,5 @@
+"""
+Benchmarks for the UIDAI biometric dashboard backend
+
+Run modules from the backend directory, e.g. `python -m bench.bench_generate`.
+"""
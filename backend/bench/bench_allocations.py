@@ -0,0 +1,70 @@
+"""
+Measure per-request memory allocation of the dashboard handlers
+
+For each dataset size the handlers are called against a cube built from
+generated events and the peak traced allocation of one request is reported.
+The per-request work the handlers used to do on the shared frame (assigning
+a month column and copying the frame for risk zones) is measured alongside
+for reference.
+"""
+import argparse
+import asyncio
+import tracemalloc
+
+from starlette.requests import Request
+
+import main as api
+from cube import AggregateCube
+from event_store import EventChunk, EventStore
+from generate_data import generate_sample_data
+from storage import add_derived_columns
+
+# A bare GET request; handlers take it for ETag handling
+REQUEST = Request({"type": "http", "method": "GET", "headers": []})
+
+HANDLERS = {
+    "kpis": lambda: api.get_kpis(REQUEST),
+    "risk-zones": lambda: api.get_risk_zones(REQUEST, biometric_type="fingerprint", age_group="elderly"),
+    "trends": lambda: api.get_trends(REQUEST),
+    "insights": lambda: api.get_insights(REQUEST),
+    "feature-importance": lambda: api.get_feature_importance(REQUEST),
+}
+
+def peak_kb(fn):
+    """Peak traced allocation in KB while running fn()"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+def legacy_per_request(frame):
+    """The column assignment and copy the old handlers performed on every request"""
+    frame['month'] = frame['auth_timestamp'].dt.month
+    frame.copy()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    print(f"{'rows':>10}  {'handler':<20}{'peak KB/request':>16}")
+    for size in args.sizes:
+        frame = add_derived_columns(generate_sample_data(size, seed=0))
+        chunk = EventChunk.from_frame(frame)
+        api.events = EventStore([chunk])
+        api.cube = AggregateCube.from_events(chunk)
+        api.analytics_executor.publish(api.cube)
+        api.response_cache.bump()
+
+        for name, handler in HANDLERS.items():
+            loop.run_until_complete(handler())  # warm up
+            print(f"{size:>10,}  {name:<20}{peak_kb(lambda: loop.run_until_complete(handler())):>16,.1f}")
+        legacy = peak_kb(lambda: legacy_per_request(frame.copy(deep=False)))
+        print(f"{size:>10,}  {'(legacy mutation)':<20}{legacy:>16,.1f}")
+    loop.close()
+
+if __name__ == "__main__":
+    main()
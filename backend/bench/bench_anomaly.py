@@ -0,0 +1,68 @@
+"""
+Benchmark the streaming anomaly detector
+
+Generates a dataset, injects a failure spike into one (device_model,
+district, biometric_type) combination from a point in time onwards, and
+streams the events through AnomalyDetector in ingest-sized batches.
+Reports throughput in events/sec, how many of the spiked combination's
+events it took to flag it, and how many other combinations were flagged.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from anomaly import KEY_DIMENSIONS, AnomalyDetector
+from generate_data import generate_sample_data
+from storage import add_derived_columns
+
+def inject_spike(frame, rng, start_fraction, extra_rate):
+    """Turn successes into failures for the busiest key after a cut-off; returns (key, cut-off)"""
+    key = frame.groupby(KEY_DIMENSIONS, observed=True).size().idxmax()
+    start = frame['auth_timestamp'].quantile(start_fraction)
+    mask = (frame['auth_timestamp'] >= start).to_numpy()
+    for dim, value in zip(KEY_DIMENSIONS, key):
+        mask &= (frame[dim] == value).to_numpy()
+    flip = mask & ~frame['is_failure'].to_numpy().astype(bool) & (rng.random(len(frame)) < extra_rate)
+    frame.loc[flip, 'is_failure'] = 1
+    frame.loc[flip, 'auth_result'] = 'failure'
+    return tuple(str(value) for value in key), start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 5_000_000])
+    parser.add_argument("--batch", type=int, default=10_000, help="Events per update() call")
+    parser.add_argument("--spike-start", type=float, default=0.8, help="Quantile of time the spike starts at")
+    parser.add_argument("--spike-rate", type=float, default=0.3, help="Fraction of successes turned into failures")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>10}{'keys':>8}{'events/s':>12}{'detect after':>14}{'other flagged':>15}")
+    for size in args.sizes:
+        frame = add_derived_columns(generate_sample_data(size, seed=0))
+        frame = frame.sort_values('auth_timestamp', ignore_index=True)
+        key, start = inject_spike(frame, rng, args.spike_start, args.spike_rate)
+
+        detector = AnomalyDetector()
+        changes = []
+        started = time.perf_counter()
+        for offset in range(0, len(frame), args.batch):
+            changes += detector.update(frame.iloc[offset:offset + args.batch])
+        elapsed = time.perf_counter() - started
+
+        flagged = [alert for kind, alert in changes if kind == "anomaly"]
+        spike_alerts = [alert for alert in flagged
+                        if tuple(alert[dim] for dim in KEY_DIMENSIONS) == key and alert['detected_at'] >= str(start)]
+        if spike_alerts:
+            detected = np.datetime64(spike_alerts[0]['detected_at'])
+            mask = (frame['auth_timestamp'] >= start) & (frame['auth_timestamp'] <= detected)
+            for dim, value in zip(KEY_DIMENSIONS, key):
+                mask &= frame[dim] == value
+            delay = f"{int(mask.sum())} events"
+        else:
+            delay = "missed"
+        others = len({tuple(alert[dim] for dim in KEY_DIMENSIONS) for alert in flagged} - {key})
+        print(f"{size:>10,}{detector.stats()['keys']:>8}{size / elapsed:>12,.0f}{delay:>14}{others:>15}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark the approximate analytics mode against the exact answers
+
+For each dataset (generated, or an existing Parquet dataset with
+--parquet), times the kpis, risk-zones and trends payloads computed exactly,
+by the cube (AggregateCube and RiskIndex over the loaded events) and by
+DuckDB over the files, and from an ApproxIndex as ?approx=true serves them,
+including the exact fallback for groups with too few sampled events.
+
+Also reports, per payload, the largest error of an estimated rate against
+the exact one (percentage points), the widest 95% confidence interval
+(half-width, percentage points), the share of exact rates inside their
+interval and the groups answered by the fallback.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import analytics
+from approx import DEFAULT_SAMPLE_SIZE, ApproxIndex
+from cube import AggregateCube
+from duckdb_queries import DuckDBQueries
+from event_store import EventChunk
+from generate_data import write_sample_data
+from risk_index import RiskIndex
+from storage import convert_csv
+
+# (payload, exact function, approximate function, source key, params)
+PAYLOADS = [
+    ("kpis", analytics.kpis, analytics.kpis_approx, "queries", ()),
+    ("trends", analytics.trends, analytics.trends_approx, "queries", ()),
+    ("risk-zones", analytics.risk_zones, analytics.risk_zones_approx, "zones", ()),
+    ("risk-zones iris/elderly", analytics.risk_zones, analytics.risk_zones_approx, "zones",
+     ("iris", "elderly")),
+    ("risk-zones state/female", analytics.risk_zones, analytics.risk_zones_approx, "zones",
+     (None, None, None, "female", None, None, "Bihar")),
+]
+
+def timed(fn, repeat):
+    """(result, median milliseconds) of `repeat` calls of fn()"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(times)
+
+def approx_payload(index, approx_fn, exact_fn, source, params, min_samples):
+    """The payload as /api/...?approx=true computes it"""
+    payload = approx_fn(index, min_samples, *params)
+    if analytics.needs_exact(payload):
+        payload = analytics.fill_exact(payload, exact_fn(source, *params))
+    return payload
+
+def _labels(row):
+    return tuple((key, value) for key, value in row.items() if isinstance(value, str))
+
+def _rate_pairs(approx, exact):
+    """(estimate, (low, high), exact rate, fallback) of every rate in the two payloads"""
+    pairs = []
+    for key, value in approx.items():
+        if key.endswith("_ci") and key[:-3] in exact:
+            pairs.append((approx[key[:-3]], value, exact[key[:-3]], False))
+        elif isinstance(value, list):
+            exact_rows = {_labels(row): row for row in exact[key]}
+            for row in value:
+                match = exact_rows.get(_labels(row))
+                if match is not None:
+                    pairs.append((row["failure_rate"], row["failure_rate_ci"], match["failure_rate"],
+                                  row["failure_rate_ci"][0] == row["failure_rate_ci"][1] and row["exact"]))
+    return pairs
+
+def accuracy(approx, exact):
+    """(max error, max half-width, coverage, fallback groups) of an approximate payload"""
+    pairs = _rate_pairs(approx, exact)
+    if not pairs:
+        return 0.0, 0.0, 1.0, 0
+    error = max(abs(estimate - rate) for estimate, _, rate, _ in pairs)
+    half = max((high - low) / 2 for _, (low, high), _, _ in pairs)
+    # Interval ends are rounded to 2 decimals like the rates
+    covered = sum(low - 0.005 <= rate <= high + 0.005 for _, (low, high), rate, _ in pairs)
+    return error, half, covered / len(pairs), sum(fallback for *_, fallback in pairs)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000],
+                        help="Records to generate when --parquet is not given")
+    parser.add_argument("--parquet", default=None, help="Existing Parquet dataset to benchmark")
+    parser.add_argument("--sample-size", type=int, default=DEFAULT_SAMPLE_SIZE)
+    parser.add_argument("--min-samples", type=int, default=100)
+    parser.add_argument("--backends", nargs="+", choices=["cube", "duckdb"], default=["cube", "duckdb"])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        datasets = [args.parquet] if args.parquet else []
+        for size in ([] if args.parquet else args.sizes):
+            csv_file = os.path.join(workdir, f"events_{size}.csv")
+            write_sample_data(csv_file, size, seed=0)
+            datasets.append(os.path.join(workdir, f"parquet_{size}"))
+            convert_csv(csv_file, datasets[-1])
+            os.remove(csv_file)
+
+        for path in datasets:
+            events = EventChunk.load(path)
+            started = time.perf_counter()
+            index = ApproxIndex.from_events(events, sample_size=args.sample_size)
+            build = time.perf_counter() - started
+            print(f"{len(events):,} events: approx index built in {build:.2f}s, "
+                  f"{index.nbytes / 2 ** 20:.1f} MB, {len(index.sample['day']):,} sampled")
+            backends = {}
+            if "cube" in args.backends:
+                backends["cube"] = {"queries": AggregateCube.from_events(events), "zones": RiskIndex.from_events(events)}
+            if "duckdb" in args.backends:
+                duckdb_queries = DuckDBQueries(path)
+                backends["duckdb"] = {"queries": duckdb_queries, "zones": duckdb_queries}
+            del events
+
+            print(f"{'backend':<8}{'payload':<26}{'exact ms':>10}{'approx ms':>11}{'max err pp':>12}"
+                  f"{'max ±pp':>9}{'coverage':>10}{'fallback':>10}")
+            for backend, sources in backends.items():
+                for name, exact_fn, approx_fn, key, params in PAYLOADS:
+                    source = sources[key]
+                    exact, exact_ms = timed(lambda: exact_fn(source, *params), args.repeat)
+                    approx, approx_ms = timed(lambda: approx_payload(index, approx_fn, exact_fn, source, params,
+                                                                     args.min_samples), args.repeat)
+                    error, half, coverage, fallback = accuracy(approx, exact)
+                    print(f"{backend:<8}{name:<26}{exact_ms:>10.1f}{approx_ms:>11.1f}{error:>12.2f}"
+                          f"{half:>9.2f}{coverage:>10.2f}{fallback:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark the cube and DuckDB query backends across dataset sizes
+
+For each size a dataset is generated and written as CSV and Parquet. Each
+backend then runs in a fresh interpreter that reports its startup time
+(loading events and building the cube, or nothing for DuckDB), the latency
+of every analytics payload on first call and the peak RSS.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import analytics
+from cube import AggregateCube
+from duckdb_queries import DuckDBQueries
+from generate_data import write_sample_data
+from storage import add_derived_columns, convert_csv, load_events
+
+API_COLUMNS = ['auth_timestamp', 'state', 'district', 'age_group', 'gender',
+               'biometric_type', 'device_model', 'auth_result']
+
+PAYLOADS = {
+    "kpis": lambda source: analytics.kpis(source),
+    "risk-zones": lambda source: analytics.risk_zones(source, "fingerprint", "elderly"),
+    "trends": lambda source: analytics.trends(source),
+    "insights": lambda source: analytics.insights(source),
+}
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def measure(backend, path):
+    """Start `backend` over `path` and time each payload; returns a dict"""
+    started = time.perf_counter()
+    if backend == "cube":
+        source = AggregateCube.from_frame(add_derived_columns(load_events(path, API_COLUMNS)))
+    else:
+        source = DuckDBQueries(path)
+    result = {"startup_s": time.perf_counter() - started}
+    for name, payload in PAYLOADS.items():
+        started = time.perf_counter()
+        payload(source)
+        result[name] = (time.perf_counter() - started) * 1000
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 5_000_000])
+    parser.add_argument("--json", default=None, help="Also write results to this JSON file")
+    parser.add_argument("--child", nargs=2, metavar=("BACKEND", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(*args.child)))
+        return
+
+    results = []
+    print(f"{'rows':>10}  {'backend':<16}{'startup s':>10}" + "".join(f"{name + ' ms':>16}" for name in PAYLOADS)
+          + f"{'peak RSS MB':>13}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            csv_file = os.path.join(workdir, "events.csv")
+            parquet_dir = os.path.join(workdir, "parquet")
+            write_sample_data(csv_file, size, seed=0)
+            convert_csv(csv_file, parquet_dir)
+
+            for backend in ["cube", "duckdb"]:
+                for fmt, path in [("csv", csv_file), ("parquet", parquet_dir)]:
+                    output = subprocess.run(
+                        [sys.executable, "-m", "bench.bench_backends", "--child", backend, path],
+                        check=True, capture_output=True, text=True
+                    ).stdout
+                    result = json.loads(output)
+                    results.append({"rows": size, "backend": backend, "format": fmt, **result})
+                    print(f"{size:>10,}  {backend + ' / ' + fmt:<16}{result['startup_s']:>10.2f}"
+                          + "".join(f"{result[name]:>16.1f}" for name in PAYLOADS)
+                          + f"{result['peak_rss_mb']:>13.0f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+In-process microbenchmark of every API endpoint
+
+Starts the app against the data/ and models/ of the current directory and
+calls each endpoint through Starlette's TestClient, so no network or server
+is involved. Endpoints served through the response cache are timed cold
+(cache invalidated before every call, so the analytics are recomputed) and
+warm. Every route of main.app must have a case below, so new endpoints are
+not silently left out; /api/insights/stream is a long-lived event stream and
+is exercised by the HTTP load test in bench.suite instead.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+# Ingested batches stay in memory and the model is only loaded at startup
+os.environ.setdefault("INGEST_PERSIST", "0")
+os.environ.setdefault("MODEL_RELOAD_INTERVAL", "0")
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+
+import main
+from generate_data import generate_sample_data
+
+PREDICTION = {"age_group": "adult", "biometric_type": "fingerprint", "device_model": "UIDAI_Device_A",
+              "state": "Maharashtra", "gender": "female", "month": 6, "day_of_week": 2, "hour": 10}
+
+def _ingest_body(rows=100):
+    events = generate_sample_data(rows, seed=1)
+    events['auth_timestamp'] = events['auth_timestamp'].astype(str)
+    return json.loads(events.to_json(orient="records"))
+
+def _batch_body(rows=1000):
+    rng = np.random.default_rng(0)
+    return {"rows": [{**PREDICTION, "month": int(rng.integers(1, 13)), "hour": int(rng.integers(0, 24))}
+                     for _ in range(rows)]}
+
+# (method, path, request kwargs, timed cold and warm through the response cache, calls relative to --repeat)
+CASES = [
+    ("GET", "/", {}, False, 1),
+    ("GET", "/api/health", {}, False, 1),
+    ("GET", "/api/model", {}, False, 1),
+    ("POST", "/api/model/reload", {}, False, 1),
+    ("GET", "/api/cache/stats", {}, False, 1),
+    ("GET", "/metrics", {}, False, 1),
+    ("GET", "/api/profiler", {}, False, 1),
+    ("POST", "/api/profiler", {"json": {"enabled": False}}, False, 1),
+    ("GET", "/api/kpis", {}, True, 1),
+    ("GET", "/api/risk-zones", {}, True, 1),
+    ("GET", "/api/risk-zones", {"params": {"biometric_type": "iris", "age_group": "elderly"}}, True, 1),
+    ("GET", "/api/trends", {}, True, 1),
+    ("GET", "/api/kpis", {"params": {"approx": True}}, True, 1),
+    ("GET", "/api/risk-zones", {"params": {"approx": True, "biometric_type": "iris", "age_group": "elderly"}}, True, 1),
+    ("GET", "/api/trends", {"params": {"approx": True}}, True, 1),
+    ("GET", "/api/trends/timeseries", {"params": {"granularity": "day", "windows": [7]}}, True, 1),
+    ("GET", "/api/trends/timeseries", {"params": {"granularity": "hour", "by": "device_model"}}, True, 0.2),
+    ("GET", "/api/feature-importance", {}, True, 1),
+    ("GET", "/api/insights", {}, True, 1),
+    ("GET", "/api/anomalies", {}, False, 1),
+    ("POST", "/api/predict", {"json": PREDICTION}, False, 1),
+    ("POST", "/api/predict/batch", {"json": _batch_body}, False, 0.2),
+    ("POST", "/api/ingest", {"json": _ingest_body}, False, 0.2),
+    ("POST", "/api/refresh", {}, False, 0.05),
+]
+
+UNTIMED = {("GET", "/api/insights/stream")}
+
+def check_coverage():
+    """Routes of main.app without a benchmark case"""
+    routes = {(method, route.path) for route in main.app.routes if isinstance(route, APIRoute)
+              for method in route.methods}
+    return sorted(routes - {(method, path) for method, path, *_ in CASES} - UNTIMED)
+
+def time_calls(client, method, path, kwargs, calls, before=None):
+    """Latencies in ms of `calls` requests; fails on a non-2xx response"""
+    latencies = []
+    for _ in range(calls):
+        if before:
+            before()
+        started = time.perf_counter()
+        response = client.request(method, path, **kwargs)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 300:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}: {response.text[:200]}")
+    return latencies
+
+def summarize(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"calls": len(latencies), "mean_ms": float(np.mean(latencies)), "p50_ms": float(p50),
+            "p95_ms": float(p95), "p99_ms": float(p99)}
+
+def run(repeat=200):
+    """Benchmark every case and return one result dict per (case, cache mode)"""
+    missing = check_coverage()
+    if missing:
+        raise SystemExit(f"No benchmark case for: {', '.join(f'{method} {path}' for method, path in missing)}")
+    results = []
+    with TestClient(main.app) as client:
+        for method, path, kwargs, cached, weight in CASES:
+            kwargs = {key: value() if callable(value) else value for key, value in kwargs.items()}
+            calls = max(3, int(repeat * weight))
+            label = path + ("?" + "&".join(f"{key}={value}" for key, value in kwargs["params"].items())
+                            if "params" in kwargs else "")
+            # One untimed call warms imports, caches and lazily built state
+            time_calls(client, method, path, kwargs, 1)
+            modes = [("cold", main.response_cache.bump), ("warm", None)] if cached else [("-", None)]
+            for mode, before in modes:
+                latencies = time_calls(client, method, path, kwargs, calls, before)
+                results.append({"endpoint": f"{method} {label}", "cache": mode, **summarize(latencies)})
+    return results
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=200, help="Calls per endpoint (fewer for slow ones)")
+    parser.add_argument("--json", default=None, help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    print(f"{'endpoint':<62}{'cache':>6}{'calls':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for result in results:
+        print(f"{result['endpoint'][:61]:<62}{result['cache']:>6}{result['calls']:>7}{result['p50_ms']:>9.2f}"
+              f"{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,123 @@
+"""
+Benchmark the memory held by the loaded events: DataFrames against EventChunk
+
+Loads the API columns of a dataset in three representations, each in a
+fresh interpreter so RSS figures are not polluted by earlier loads:
+
+- frame (object strings): the CSV with object dtypes and parsed timestamps,
+  as the API held it before the Parquet storage layer;
+- frame (categoricals): the Parquet dataset with categorical dimensions and
+  the derived columns, as the API held it before the compact event store;
+- compact: event_store.EventChunk.load, which the API holds now.
+
+Reports load time, the resident memory the loaded events hold (the RSS
+released by deleting them, so one-off library and allocator overhead of the
+first load is not counted), the peak RSS of the load, and bytes per event. Object
+strings take about 0.5 KB per event, so at 10M events that representation
+needs several GB; leave it out with --representations on small machines.
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+from event_store import EventChunk
+from generate_data import write_sample_data
+from storage import add_derived_columns, convert_csv, read_dataset
+
+API_COLUMNS = ['auth_timestamp', 'state', 'district', 'age_group', 'gender',
+               'biometric_type', 'device_model', 'auth_result']
+
+LOADERS = {
+    "frame (object strings)": lambda paths: _read_csv_objects(paths["csv"]),
+    "frame (categoricals)": lambda paths: add_derived_columns(read_dataset(paths["parquet"], API_COLUMNS)),
+    "compact": lambda paths: EventChunk.load(paths["parquet"]),
+}
+
+def _read_csv_objects(path):
+    df = pd.read_csv(path, usecols=API_COLUMNS)
+    df['auth_timestamp'] = pd.to_datetime(df['auth_timestamp'])
+    return df
+
+def _status_mb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def measure(loader, paths):
+    """Load events with `loader` and report time and memory as a dict"""
+    started = time.perf_counter()
+    events = LOADERS[loader](paths)
+    elapsed = time.perf_counter() - started
+    rows = len(events)
+    # Drop what the load left behind, so only the events themselves are counted
+    gc.collect()
+    pa.default_memory_pool().release_unused()
+    rss_loaded = _status_mb("VmRSS:")
+    del events
+    gc.collect()
+    pa.default_memory_pool().release_unused()
+    held = rss_loaded - _status_mb("VmRSS:")
+    return {
+        "loader": loader,
+        "rows": rows,
+        "seconds": elapsed,
+        "held_mb": held,
+        "peak_rss_mb": _status_mb("VmHWM:"),
+        "bytes_per_event": held * 2 ** 20 / max(rows, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Records to generate when --csv is not given")
+    parser.add_argument("--csv", default=None, help="Existing events CSV to benchmark")
+    parser.add_argument("--representations", nargs="+", choices=list(LOADERS), default=list(LOADERS))
+    parser.add_argument("--json", default=None, help="Also write results to this JSON file")
+    parser.add_argument("--child", nargs=2, metavar=("LOADER", "PATHS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child[0], json.loads(args.child[1]))))
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_file = args.csv
+        if csv_file is None:
+            csv_file = os.path.join(workdir, "events.csv")
+            write_sample_data(csv_file, args.rows, seed=0)
+        paths = {"csv": csv_file, "parquet": os.path.join(workdir, "parquet")}
+        convert_csv(csv_file, paths["parquet"])
+
+        results = []
+        print(f"{'representation':<24}{'rows':>12}{'load s':>9}{'held MB':>9}{'peak MB':>9}{'B/event':>9}")
+        for loader in args.representations:
+            output = subprocess.run(
+                [sys.executable, "-m", "bench.bench_event_store", "--child", loader, json.dumps(paths)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output)
+            results.append(result)
+            print(f"{loader:<24}{result['rows']:>12,}{result['seconds']:>9.1f}{result['held_mb']:>9.0f}"
+                  f"{result['peak_rss_mb']:>9.0f}{result['bytes_per_event']:>9.1f}")
+        compact = next((result for result in results if result["loader"] == "compact"), None)
+        if compact is not None:
+            for result in results:
+                if result is not compact:
+                    print(f"compact holds {result['held_mb'] / compact['held_mb']:.1f}x less than "
+                          f"{result['loader']}")
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
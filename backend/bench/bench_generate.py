@@ -0,0 +1,34 @@
+"""
+Benchmark the vectorized sample data generator against the per-record loop
+"""
+import argparse
+import time
+
+from generate_data import generate_sample_chunks, generate_sample_data_legacy
+
+def rows_per_second(generate, n_records):
+    """Time `generate(n_records)` and return rows generated per second"""
+    started = time.perf_counter()
+    generate(n_records)
+    elapsed = time.perf_counter() - started
+    return n_records / elapsed if elapsed > 0 else float('inf')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--legacy-rows", type=int, default=50_000, help="Records generated by the per-record loop")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="Records generated by the vectorized generator")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="Vectorized chunk size")
+    args = parser.parse_args()
+
+    legacy = rows_per_second(generate_sample_data_legacy, args.legacy_rows)
+    vectorized = rows_per_second(
+        lambda n: sum(len(chunk) for chunk in generate_sample_chunks(n, args.chunk_size, seed=0)),
+        args.rows
+    )
+
+    print(f"legacy loop:  {legacy:>14,.0f} rows/sec ({args.legacy_rows:,} rows)")
+    print(f"vectorized:   {vectorized:>14,.0f} rows/sec ({args.rows:,} rows, chunk {args.chunk_size:,})")
+    print(f"speedup:      {vectorized / legacy:>14.1f}x")
+
+if __name__ == "__main__":
+    main()
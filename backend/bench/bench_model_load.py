@@ -0,0 +1,129 @@
+"""
+Benchmark model cold start and per-worker memory: pickle vs bundle
+
+Writes the current model both as the pickled files the API used to load
+(biometric_model.pkl, label_encoders.pkl) and as a model_store bundle, then
+starts --workers fresh interpreters per format, like uvicorn workers. Each
+imports what loading needs, loads the model and scores one row. Reports the
+import time, the time to read the model files, the time to the first
+prediction (from interpreter start, and from process spawn), and each
+worker's RSS and PSS (resident memory with shared pages split between the
+processes sharing them) while all are alive.
+"""
+import argparse
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sklearn.preprocessing import LabelEncoder
+
+import model_store
+from inference import CATEGORICAL_FEATURES
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import time
+started = time.perf_counter()
+import json, os, sys
+import numpy as np
+fmt, path = sys.argv[1], sys.argv[2]
+if fmt == "pickle":
+    import pickle
+    import xgboost
+    imported = time.perf_counter()
+    with open(os.path.join(path, "biometric_model.pkl"), "rb") as f:
+        model = pickle.load(f)
+    with open(os.path.join(path, "label_encoders.pkl"), "rb") as f:
+        vocab = {feature: list(encoder.classes_) for feature, encoder in pickle.load(f).items()}
+else:
+    import model_store
+    imported = time.perf_counter()
+    model, vocab, _ = model_store.load_bundle(path)
+loaded = time.perf_counter()
+model.predict_proba(np.zeros((1, 8), dtype=np.float32))
+predicted = time.perf_counter()
+print(json.dumps({"import_s": imported - started, "load_s": loaded - imported,
+                  "first_predict_s": predicted - started}), flush=True)
+sys.stdin.readline()
+"""
+
+def _memory_kb(pid):
+    """(RSS, PSS) of a process in kB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0]] = int(parts[1])
+    return values["Rss:"], values["Pss:"]
+
+def write_formats(models_dir, workdir):
+    """Write the current model as pickles and as a bundle; returns {format: path}"""
+    model, vocab, _ = model_store.load_current(models_dir)
+    pickle_dir = os.path.join(workdir, "pickle")
+    os.makedirs(pickle_dir)
+    encoders = {}
+    for feature in CATEGORICAL_FEATURES:
+        encoders[feature] = LabelEncoder()
+        encoders[feature].classes_ = np.array(vocab[feature], dtype=object)
+    with open(os.path.join(pickle_dir, model_store.LEGACY_MODEL_NAME), 'wb') as f:
+        pickle.dump(model, f)
+    with open(os.path.join(pickle_dir, model_store.LEGACY_ENCODERS_NAME), 'wb') as f:
+        pickle.dump(encoders, f)
+    bundle_models = os.path.join(workdir, "bundle")
+    manifest = model_store.save_version(model, vocab, {"mode": "bench"}, bundle_models)
+    return {"pickle": pickle_dir, "bundle": model_store.bundle_dir(manifest, bundle_models)}
+
+def run(fmt, path, workers):
+    """Start `workers` loaders together; returns per-worker timings and memory"""
+    processes = []
+    for _ in range(workers):
+        spawned = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-c", WORKER, fmt, path], cwd=BACKEND_DIR,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        result = json.loads(process.stdout.readline())
+        result["ready_s"] = time.perf_counter() - spawned
+        processes.append((process, result))
+    results = []
+    for process, result in processes:
+        result["rss_mb"], result["pss_mb"] = (kb / 1024 for kb in _memory_kb(process.pid))
+        results.append(result)
+    for process, _ in processes:
+        process.stdin.write("\n")
+        process.stdin.flush()
+        process.wait()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", default="models", help="Models directory to take the current model from")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3, help="Rounds per format; the median is reported")
+    parser.add_argument("--json", default=None, help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    summary = []
+    print(f"{'format':<8}{'import s':>10}{'load ms':>9}{'first predict s':>17}{'ready s':>10}{'RSS MB':>9}"
+          f"{'PSS MB':>9}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for fmt, path in write_formats(args.models, workdir).items():
+            results = [result for _ in range(args.repeat) for result in run(fmt, path, args.workers)]
+            row = {"format": fmt, "workers": args.workers,
+                   **{key: float(np.median([result[key] for result in results]))
+                      for key in ["import_s", "load_s", "first_predict_s", "ready_s", "rss_mb", "pss_mb"]}}
+            summary.append(row)
+            print(f"{fmt:<8}{row['import_s']:>10.3f}{row['load_s'] * 1000:>9.1f}{row['first_predict_s']:>17.3f}"
+                  f"{row['ready_s']:>10.3f}{row['rss_mb']:>9.0f}{row['pss_mb']:>9.0f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark /api/predict latency through the micro-batched inference engine
+
+Fires waves of concurrent predictions over random feature combinations and
+reports latency percentiles with the LRU cache cold and warm. Requires a
+model written by train_model.py.
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+import model_store
+from inference import InferenceEngine
+
+async def wave(engine, requests):
+    """Run `requests` concurrently and return per-request latencies in ms"""
+    async def timed(features):
+        started = time.perf_counter()
+        await engine.predict(features)
+        return (time.perf_counter() - started) * 1000
+    return await asyncio.gather(*[timed(features) for features in requests])
+
+def random_requests(engine, n, rng):
+    """Random request feature dicts over the engine's vocabularies"""
+    requests = []
+    for _ in range(n):
+        features = {feature: values[rng.integers(len(values))] for feature, values in engine.vocab.items()}
+        features.update(month=int(rng.integers(1, 13)), day_of_week=int(rng.integers(0, 7)), hour=int(rng.integers(0, 24)))
+        requests.append(features)
+    return requests
+
+async def run(args):
+    model, vocab, _ = model_store.load_model(args.model)
+    engine = InferenceEngine(model, vocab)
+    rng = np.random.default_rng(0)
+    pool = random_requests(engine, args.distinct, rng)
+    requests = [pool[i] for i in rng.integers(0, len(pool), args.requests)]
+
+    for label in ["cold cache", "warm cache"]:
+        latencies = []
+        started = time.perf_counter()
+        for i in range(0, len(requests), args.concurrency):
+            latencies += await wave(engine, requests[i:i + args.concurrency])
+        elapsed = time.perf_counter() - started
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f"{label:<12} {len(requests) / elapsed:>10,.0f} req/s  "
+              f"p50 {p50:.2f} ms  p95 {p95:.2f} ms  p99 {p99:.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--distinct", type=int, default=2_000, help="Distinct feature combinations requested")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--model", default="models", help="Model bundle, or models directory for its current version")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark risk zone lookups from the prefix-sum index
+
+Times random filter combinations (biometric_type, age_group, device_model,
+gender, a date range, and state drill-down) answered by RiskIndex, against a
+boolean-mask scan of the raw events for the same query. Results are checked
+to agree.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from generate_data import generate_sample_data
+from risk_index import FILTER_DIMENSIONS, RiskIndex
+from storage import add_derived_columns
+
+def scan(frame, where, state):
+    """The same breakdown computed by masking the raw events"""
+    mask = np.ones(len(frame), dtype=bool)
+    for dim, value in where.items():
+        if dim == 'date':
+            days = frame['auth_timestamp'].dt.normalize()
+            mask &= (days >= np.datetime64(value[0])) & (days <= np.datetime64(value[1]))
+        else:
+            mask &= (frame[dim] == value).to_numpy()
+    if state:
+        mask &= (frame['state'] == state).to_numpy()
+    by = ['state', 'district'] if state else ['state']
+    return frame[mask].groupby(by, observed=True)['is_failure'].agg(['size', 'sum'])
+
+def random_query(frame, index, rng):
+    where = {dim: index.vocab[dim][rng.integers(len(index.vocab[dim]))]
+             for dim in FILTER_DIMENSIONS if rng.random() < 0.5}
+    if rng.random() < 0.5:
+        start = index.first_day + rng.integers(index.n_days)
+        where['date'] = (start, start + rng.integers(1, 120))
+    state = index.states[rng.integers(len(index.states))] if rng.random() < 0.5 else None
+    return where, state
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 5_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>10}{'build s':>10}{'index MB':>10}{'index ms/query':>16}{'scan ms/query':>15}")
+    for size in args.sizes:
+        frame = add_derived_columns(generate_sample_data(size, seed=0))
+        started = time.perf_counter()
+        index = RiskIndex.from_frame(frame)
+        build = time.perf_counter() - started
+        queries = [random_query(frame, index, rng) for _ in range(args.queries)]
+
+        index_seconds = scan_seconds = 0.0
+        for where, state in queries:
+            by = ['state', 'district'] if state else ['state']
+            started = time.perf_counter()
+            zones = index.rollup(by, dict(where, state=state) if state else where)
+            index_seconds += time.perf_counter() - started
+
+            started = time.perf_counter()
+            expected = scan(frame, where, state)
+            scan_seconds += time.perf_counter() - started
+            actual = {tuple(row[:-2]): tuple(row[-2:]) for row in zones[by + ['total', 'failures']].itertuples(index=False)}
+            expected = {(key if isinstance(key, tuple) else (key,)): (size, failures)
+                        for key, size, failures in zip(expected.index, expected['size'], expected['sum'])}
+            assert actual == expected, (where, state)
+
+        size_mb = (index.cum_total.nbytes + index.cum_failures.nbytes + index.first_seen.nbytes) / 1024 ** 2
+        print(f"{size:>10,}{build:>10.2f}{size_mb:>10.1f}"
+              f"{index_seconds / len(queries) * 1000:>16.3f}{scan_seconds / len(queries) * 1000:>15.2f}")
+
+if __name__ == "__main__":
+    main()
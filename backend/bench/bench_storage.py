@@ -0,0 +1,89 @@
+"""
+Benchmark cold-start load time and memory of CSV against the Parquet dataset
+
+Each load runs in a fresh interpreter so RSS figures are not polluted by
+earlier loads.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from generate_data import write_sample_data
+from storage import convert_csv, read_csv, read_dataset
+
+API_COLUMNS = ['auth_timestamp', 'state', 'district', 'age_group', 'gender',
+               'biometric_type', 'device_model', 'auth_result']
+
+LOADERS = {
+    "csv (object dtypes)": lambda path: _read_csv_legacy(path),
+    "csv (categoricals)": lambda path: read_csv(path),
+    "parquet": lambda path: read_dataset(path),
+    "parquet (API columns)": lambda path: read_dataset(path, API_COLUMNS),
+}
+
+def _read_csv_legacy(path):
+    """Load the CSV the way the API did before the Parquet storage layer"""
+    df = pd.read_csv(path)
+    df['auth_timestamp'] = pd.to_datetime(df['auth_timestamp'])
+    return df
+
+def rss_mb():
+    """Current resident set size of this process in MB"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def measure(loader, path):
+    """Load `path` with `loader` and report time and memory as a dict"""
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    df = LOADERS[loader](path)
+    elapsed = time.perf_counter() - started
+    return {
+        "loader": loader,
+        "rows": len(df),
+        "seconds": elapsed,
+        "rss_delta_mb": rss_mb() - rss_before,
+        "frame_mb": df.memory_usage(deep=True).sum() / 1024 ** 2,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Records to generate when --csv is not given")
+    parser.add_argument("--csv", default=None, help="Existing events CSV to benchmark")
+    parser.add_argument("--child", nargs=2, metavar=("LOADER", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(*args.child)))
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_file = args.csv
+        if csv_file is None:
+            csv_file = os.path.join(workdir, "events.csv")
+            write_sample_data(csv_file, args.rows, seed=0)
+        parquet_dir = os.path.join(workdir, "parquet")
+        convert_csv(csv_file, parquet_dir)
+
+        print(f"{'loader':<24}{'rows':>12}{'load s':>10}{'RSS MB':>10}{'frame MB':>10}")
+        for loader in LOADERS:
+            path = csv_file if loader.startswith("csv") else parquet_dir
+            output = subprocess.run(
+                [sys.executable, "-m", "bench.bench_storage", "--child", loader, path],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output)
+            print(f"{loader:<24}{result['rows']:>12,}{result['seconds']:>10.2f}"
+                  f"{result['rss_delta_mb']:>10.1f}{result['frame_mb']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Check and benchmark the compiled decision-table prediction path
+
+Compiles the current model into a DecisionTable, checks every entry (and
+the mean-over-genders slot) against predict_proba, then times:
+
+- single predictions: DecisionTable.lookup on a resolved feature tuple, and
+  InferenceEngine.predict with and without the table (LRU cache disabled
+  for the model path so every call reaches the model);
+- batches: DecisionTable.lookup_matrix against predict_proba per row.
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+import model_store
+from inference import CATEGORICAL_FEATURES, TIME_RANGES, DecisionTable, InferenceEngine
+
+def check(table, model, chunk_rows=1_000_000):
+    """Largest differences from predict_proba over the whole table and the gender-mean slot"""
+    gender = CATEGORICAL_FEATURES.index('gender')
+    per_gender = np.delete(table.table, -1, axis=gender)
+    flat = np.asarray(per_gender).reshape(-1)
+    shape = per_gender.shape
+    worst = 0.0
+    for start in range(0, flat.size, chunk_rows):
+        codes = np.unravel_index(np.arange(start, min(start + chunk_rows, flat.size)), shape)
+        matrix = (np.column_stack(codes) + table.offsets).astype(np.float32)
+        error = np.abs(flat[start:start + len(matrix)] - model.predict_proba(matrix)[:, 1])
+        worst = max(worst, float(error.max()))
+    mean_slot = np.take(table.table, [table.table.shape[gender] - 1], axis=gender)
+    mean_error = float(np.abs(mean_slot - per_gender.mean(axis=gender, keepdims=True)).max())
+    return worst, mean_error
+
+def time_per_call(fn, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - started) / calls
+
+async def time_engine(engine, requests):
+    started = time.perf_counter()
+    for features in requests:
+        await engine.predict(features)
+    return (time.perf_counter() - started) / len(requests)
+
+def random_requests(vocab, n, rng):
+    requests = []
+    for _ in range(n):
+        features = {feature: values[rng.integers(len(values))] for feature, values in vocab.items()}
+        features.update({feature: int(rng.integers(low, high + 1)) for feature, (low, high) in TIME_RANGES.items()})
+        requests.append(features)
+    return requests
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", default="models", help="Models directory (or bundle)")
+    parser.add_argument("--calls", type=int, default=200_000, help="Single lookups timed")
+    parser.add_argument("--requests", type=int, default=2_000, help="Engine predictions timed per path")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 10_000, 1_000_000])
+    args = parser.parse_args()
+
+    model, vocab, _ = model_store.load_model(args.models)
+    started = time.perf_counter()
+    table = DecisionTable.compile(model, vocab)
+    print(f"Compiled {table.table.size:,} entries ({table.table.nbytes / 2**20:.1f} MB) "
+          f"in {time.perf_counter() - started:.1f}s")
+    worst, mean_error = check(table, model)
+    print(f"Max |table - predict_proba|: {worst:.2e}; gender-mean slot: {mean_error:.2e}")
+
+    rng = np.random.default_rng(0)
+    requests = random_requests(vocab, args.requests, rng)
+    engine = InferenceEngine(model, vocab, table=table)
+    key = engine.resolve(requests[0])
+    print(f"\n{'single prediction':<34}{'per call':>12}")
+    print(f"{'DecisionTable.lookup':<34}{time_per_call(lambda: table.lookup(key), args.calls) * 1e9:>9.0f} ns")
+    print(f"{'engine.resolve + lookup':<34}"
+          f"{time_per_call(lambda: table.lookup(engine.resolve(requests[0])), args.calls // 10) * 1e9:>9.0f} ns")
+    print(f"{'engine.predict (table)':<34}{asyncio.run(time_engine(engine, requests)) * 1e6:>9.1f} us")
+    uncached = asyncio.run(time_engine(InferenceEngine(model, vocab, cache_size=0), requests))
+    print(f"{'engine.predict (model, no cache)':<34}{uncached * 1e6:>9.1f} us")
+
+    print(f"\n{'batch rows':>12}{'table ns/row':>15}{'predict_proba ns/row':>23}")
+    for size in args.batch_sizes:
+        matrix = (rng.integers(0, table.sizes, (size, len(table.sizes))) + table.offsets).astype(np.float32)
+        calls = max(1, 100_000 // size)
+        lookup = time_per_call(lambda: table.lookup_matrix(matrix), calls) / size
+        proba = time_per_call(lambda: model.predict_proba(matrix), max(1, calls // 10)) / size
+        print(f"{size:>12,}{lookup * 1e9:>15.1f}{proba * 1e9:>23.1f}")
+
+if __name__ == "__main__":
+    main()
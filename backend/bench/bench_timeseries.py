@@ -0,0 +1,58 @@
+"""
+Benchmark windowed trend queries from the hourly time-series store
+
+Times the /api/trends/timeseries payload at each granularity, split by
+device model with 7- and 30-day rolling rates, against grouping the raw
+events by bucket and device model with pandas for the same bucket counts.
+Bucket counts are checked to agree.
+"""
+import argparse
+import time
+
+import analytics
+from generate_data import generate_sample_data
+from storage import add_derived_columns
+from timeseries import GRANULARITIES, TimeSeriesStore
+
+# pandas period frequency and payload label format per granularity
+FREQUENCIES = {'hour': 'h', 'day': 'D', 'week': 'W-SUN', 'month': 'M'}
+LABELS = {'hour': '%Y-%m-%dT%H:%M', 'day': '%Y-%m-%d', 'week': '%Y-%m-%d', 'month': '%Y-%m'}
+
+def scan(frame, granularity):
+    """Attempts and failures per bucket and device model from the raw events"""
+    buckets = frame['auth_timestamp'].dt.to_period(FREQUENCIES[granularity]).dt.start_time
+    return frame.groupby([buckets, 'device_model'], observed=True)['is_failure'].agg(['size', 'sum'])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 5_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10}{'build s':>10}{'store MB':>10}  {'granularity':<12}{'store ms':>10}{'scan ms':>10}")
+    for size in args.sizes:
+        frame = add_derived_columns(generate_sample_data(size, seed=0))
+        started = time.perf_counter()
+        store = TimeSeriesStore.from_frame(frame)
+        build = time.perf_counter() - started
+        size_mb = (store.cum_total.nbytes + store.cum_failures.nbytes) / 1024 ** 2
+
+        for granularity in GRANULARITIES:
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                payload = analytics.timeseries(store, granularity, by='device_model', windows=(7, 30))
+            store_ms = (time.perf_counter() - started) / args.repeat * 1000
+
+            started = time.perf_counter()
+            expected = scan(frame, granularity)
+            scan_ms = (time.perf_counter() - started) * 1000
+
+            actual = {(point['bucket'], series['key']): (point['total_attempts'], point['failures'])
+                      for series in payload['series'] for point in series['points'] if point['total_attempts']}
+            expected = {(bucket.strftime(LABELS[granularity]), device): (total, failures)
+                        for (bucket, device), total, failures in zip(expected.index, expected['size'], expected['sum'])}
+            assert actual == expected, granularity
+            print(f"{size:>10,}{build:>10.2f}{size_mb:>10.1f}  {granularity:<12}{store_ms:>10.2f}{scan_ms:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark model training modes across dataset sizes
+
+For each size a dataset is generated and converted to Parquet, then
+train_model.py runs in a fresh interpreter (in a scratch directory, so the
+real model artifacts are untouched) in the default in-memory mode, the
+streamed --fast mode and --fast with an external-memory page cache. Reports
+wall time, peak RSS and validation AUC from each run's report.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from generate_data import write_sample_data
+from storage import convert_csv
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "train_model.py")
+
+MODES = {
+    "default": [],
+    "fast": ["--fast"],
+    "fast + external": ["--fast", "--external-memory", "cache"],
+}
+
+def run(mode, data_dir, workdir, extra_args):
+    report_file = os.path.join(workdir, "report.json")
+    subprocess.run([sys.executable, TRAIN_SCRIPT, "--data", data_dir, "--report", report_file,
+                    *MODES[mode], *extra_args], cwd=workdir, check=True, capture_output=True, text=True)
+    with open(report_file) as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 5_000_000])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--threads", type=int, default=None, help="Passed to --fast runs")
+    parser.add_argument("--json", default=None, help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rows':>12}  {'mode':<18}{'wall s':>9}{'peak RSS MB':>13}{'AUC':>9}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            csv_file = os.path.join(workdir, "events.csv")
+            data_dir = os.path.join(workdir, "parquet")
+            write_sample_data(csv_file, size, seed=0)
+            convert_csv(csv_file, data_dir)
+            os.remove(csv_file)
+
+            for mode in args.modes:
+                extra_args = ["--threads", str(args.threads)] if args.threads and mode != "default" else []
+                report = run(mode, data_dir, workdir, extra_args)
+                results.append({"size": size, **report, "mode": mode})
+                print(f"{size:>12,}  {mode:<18}{report['wall_s']:>9.1f}{report['peak_rss_mb']:>13.0f}"
+                      f"{report['auc']:>9.4f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark multi-worker memory: per-worker loading vs shared snapshots
+
+Starts the API under uvicorn with --workers N against the data/ and models/
+of the current directory, once with every worker loading the dataset itself
+and once with SNAPSHOT_DIR set, so one worker publishes the dataset and
+aggregates and the others memory-map them. For each mode reports the time
+until every worker serves data, each worker's RSS and PSS (resident memory
+with shared pages split between the processes sharing them; their sum is
+the real footprint), and whether all workers answer the same /api/kpis and
+event count after an ingest sent to one of them.
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.bench_model_load import _memory_kb
+from generate_data import generate_sample_data
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _request(port, method, path, body=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    connection.request(method, path, body=body, headers={"Content-Type": "application/json"} if body else {})
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    return response.status, data
+
+def _children(pid):
+    """PIDs of the direct child processes of `pid`"""
+    children = []
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        children.append(int(name))
+            except (OSError, IndexError):
+                pass
+    return children
+
+def _wait_for_workers(port, workers, timeout):
+    """Wait until `workers` * 4 consecutive health checks report data loaded"""
+    deadline = time.time() + timeout
+    ready = 0
+    while ready < workers * 4:
+        if time.time() > deadline:
+            raise RuntimeError("Workers did not load the data in time")
+        try:
+            status, data = _request(port, "GET", "/api/health")
+            ready = ready + 1 if status == 200 and json.loads(data)["data_loaded"] else 0
+        except OSError:
+            ready = 0
+        if not ready:
+            time.sleep(0.2)
+
+def run(mode, workers, port, ingest_rows, snapshot_dir, timeout=900):
+    env = dict(os.environ, INGEST_PERSIST="0", MODEL_RELOAD_INTERVAL="0")
+    if mode == "snapshot":
+        env["SNAPSHOT_DIR"] = snapshot_dir
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR, "--port",
+                               str(port), "--workers", str(workers), "--log-level", "warning"], env=env)
+    try:
+        _wait_for_workers(port, workers, timeout)
+        result = {"mode": mode, "workers": workers, "ready_s": time.perf_counter() - started}
+        # uvicorn's workers are children of the server process, next to its multiprocessing helpers
+        memory = sorted(_memory_kb(pid) for pid in _children(server.pid))[-workers:]
+        result["rss_mb"] = [rss / 1024 for rss, _ in memory]
+        result["pss_mb"] = [pss / 1024 for _, pss in memory]
+        result["total_pss_mb"] = sum(result["pss_mb"])
+
+        events = generate_sample_data(ingest_rows, seed=1)
+        events['auth_timestamp'] = events['auth_timestamp'].astype(str)
+        _request(port, "POST", "/api/ingest", events.to_json(orient="records"))
+        answers = {_request(port, "GET", "/api/kpis")[1] for _ in range(workers * 10)}
+        counts = {json.loads(_request(port, "POST", "/api/ingest", "[]")[1])["total_events"]
+                  for _ in range(workers * 10)}
+        result["consistent_after_ingest"] = len(answers) == 1 and len(counts) == 1
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--ingest-rows", type=int, default=1000)
+    parser.add_argument("--modes", nargs="+", choices=["per-worker", "snapshot"], default=["per-worker", "snapshot"])
+    parser.add_argument("--json", default=None, help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'mode':<12}{'ready s':>9}{'worker RSS MB':>15}{'worker PSS MB':>15}{'total PSS MB':>14}{'consistent':>12}")
+    for mode in args.modes:
+        # tmpfs keeps the snapshot in shared memory rather than the page cache of a disk
+        snapshot_dir = tempfile.mkdtemp(prefix="uidai-bench-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        try:
+            result = run(mode, args.workers, args.port, args.ingest_rows, snapshot_dir)
+        finally:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+        results.append(result)
+        print(f"{mode:<12}{result['ready_s']:>9.1f}{max(result['rss_mb']):>15.0f}{max(result['pss_mb']):>15.0f}"
+              f"{result['total_pss_mb']:>14.0f}{str(result['consistent_after_ingest']):>12}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+HTTP load test of the analytics endpoints under concurrency
+
+Starts the API under uvicorn once per executor kind (ANALYTICS_EXECUTOR),
+fires concurrent keep-alive clients at a mix of analytics endpoints and
+/api/health, and reports throughput and p50/p95/p99 latency per endpoint.
+With "inline" the analytics run on the event loop and /api/health queues
+behind them; with a pool its tail latency stays flat. Uses whatever dataset
+and models the API loads from data/ and models/.
+"""
+import argparse
+import http.client
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+ENDPOINTS = [
+    "/api/insights",
+    "/api/kpis",
+    "/api/trends",
+    "/api/risk-zones",
+    "/api/risk-zones?biometric_type=fingerprint",
+    "/api/risk-zones?biometric_type=iris&age_group=elderly",
+    "/api/risk-zones?age_group=young",
+]
+
+def wait_until_ready(port, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/api/health")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("API did not start")
+
+def client(port, paths, latencies, lock):
+    """Request each path in turn over one connection, recording latencies in ms"""
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    for path in paths:
+        started = time.perf_counter()
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.setdefault(path.split("?")[0], []).append(elapsed)
+
+def refresher(port, interval, stop):
+    """Reload the dataset periodically so analytics are recomputed on a new cube"""
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    while not stop.wait(interval):
+        connection.request("POST", "/api/refresh")
+        connection.getresponse().read()
+
+def run(kind, args):
+    env = dict(os.environ, ANALYTICS_EXECUTOR=kind)
+    if args.workers:
+        env["ANALYTICS_WORKERS"] = str(args.workers)
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+                              env=env)
+    try:
+        wait_until_ready(args.port)
+        rng = random.Random(0)
+        per_client = args.requests // args.concurrency
+        plans = [[rng.choice(ENDPOINTS) if rng.random() < args.analytics_share else "/api/health"
+                  for _ in range(per_client)] for _ in range(args.concurrency)]
+        latencies = {}
+        lock = threading.Lock()
+        stop = threading.Event()
+        threads = [threading.Thread(target=client, args=(args.port, plan, latencies, lock)) for plan in plans]
+        if args.refresh_interval:
+            threads.append(threading.Thread(target=refresher, args=(args.port, args.refresh_interval, stop), daemon=True))
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads[:args.concurrency]:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stop.set()
+    finally:
+        server.terminate()
+        server.wait()
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"\n{kind}: {total / elapsed:,.0f} req/s over {total} requests")
+    for endpoint, values in sorted(latencies.items()):
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"  {endpoint:<24} p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  p99 {p99:7.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--executors", nargs="+", default=["inline", "thread", "process"])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--analytics-share", type=float, default=0.5, help="Fraction of requests hitting analytics endpoints")
+    parser.add_argument("--refresh-interval", type=float, default=0.2, help="Seconds between dataset reloads (0 disables)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    for kind in args.executors:
+        run(kind, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Check that the cube and DuckDB query backends return identical payloads
+
+Generates a dataset, writes it as CSV and as a partitioned Parquet dataset,
+and compares every analytics payload (risk zones over filter combinations,
+date ranges and state drill-downs) between the in-memory sources
+(AggregateCube, and RiskIndex for risk zones) and DuckDBQueries on each.
+Exits non-zero if any payload differs.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import analytics
+from cube import AggregateCube
+from duckdb_queries import DuckDBQueries
+from generate_data import write_sample_data
+from risk_index import RiskIndex
+from storage import add_derived_columns, convert_csv, load_events
+
+API_COLUMNS = ['auth_timestamp', 'state', 'district', 'age_group', 'gender',
+               'biometric_type', 'device_model', 'auth_result']
+
+# First day of the generated year, so the date ranges below fall inside it
+START_DATE = "2025-01-01"
+
+DATE_RANGES = [(None, None), ("2025-03-01", "2025-03-31"), ("2025-06-10", "2025-06-12"), (None, "2025-01-05"),
+               ("2025-12-30", None), ("2026-06-01", None)]
+
+def payload_calls():
+    """(name, function, source key, args) for every payload the dashboard requests"""
+    calls = [
+        ("kpis", analytics.kpis, "queries", ()),
+        ("trends", analytics.trends, "queries", ()),
+        ("insights", analytics.insights, "queries", ()),
+        ("feature-importance", analytics.feature_importance, "queries", ()),
+    ]
+    for biometric_type in [None, "fingerprint", "iris", "unknown"]:
+        for age_group in [None, "young", "adult", "elderly"]:
+            calls.append(("risk-zones", analytics.risk_zones, "zones", (biometric_type, age_group)))
+    for device_model in [None, "UIDAI_Device_C"]:
+        for gender in [None, "female"]:
+            for start_date, end_date in DATE_RANGES:
+                for state in [None, "Bihar", "Unknown"]:
+                    calls.append(("risk-zones", analytics.risk_zones, "zones",
+                                  ("iris", None, device_model, gender, start_date, end_date, state)))
+    return calls
+
+def check(path):
+    """Compare both backends over the dataset at `path`; return the number of mismatches"""
+    df = add_derived_columns(load_events(path, API_COLUMNS))
+    sources = {"queries": AggregateCube.from_frame(df), "zones": RiskIndex.from_frame(df)}
+    del df
+    queries = DuckDBQueries(path)
+    mismatches = 0
+    for name, fn, key, args in payload_calls():
+        expected = fn(sources[key], *args)
+        actual = fn(queries, *args)
+        # repr() also catches int/float differences that compare equal
+        if repr(expected) != repr(actual) or json.dumps(expected) != json.dumps(actual):
+            mismatches += 1
+            print(f"MISMATCH {name}{args} on {path}\n  {key}:  {expected}\n  duckdb: {actual}")
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_file = os.path.join(workdir, "events.csv")
+        parquet_dir = os.path.join(workdir, "parquet")
+        write_sample_data(csv_file, args.rows, seed=args.seed, start_date=START_DATE)
+        convert_csv(csv_file, parquet_dir)
+
+        mismatches = 0
+        for path in [csv_file, parquet_dir]:
+            mismatches += check(path)
+        n_checks = 2 * len(payload_calls())
+        print(f"{n_checks - mismatches}/{n_checks} payloads identical")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Benchmark suite: datasets, training, endpoints and HTTP load across sizes
+
+For each dataset size, in a scratch directory:
+
+1. generate a dataset with generate_data.py (and convert it to Parquet
+   unless --format csv), timing both;
+2. train the model end to end with train_model.py (bench.bench_train) in
+   each --train-modes mode, recording wall time, peak RSS and AUC;
+3. micro-benchmark every endpoint in-process (bench.bench_endpoints);
+4. start the API under uvicorn and load it over HTTP at each --concurrency
+   level with a mix of dashboard, prediction and health requests,
+   recording throughput and p50/p95/p99 latency per endpoint.
+
+Everything is written to one JSON file (--json) together with the machine
+and git revision, so runs can be compared across sizes and commits;
+--baseline prints the latencies that moved by more than --threshold
+against an earlier results file.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from bench.bench_train import run as run_train
+from bench.load_test import wait_until_ready
+from generate_data import write_sample_data
+from storage import convert_csv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PREDICTION = json.dumps({"age_group": "adult", "biometric_type": "fingerprint", "device_model": "UIDAI_Device_A",
+                         "state": "Maharashtra"})
+
+# (weight, method, path, body) of the HTTP load mix
+HTTP_MIX = [
+    (3, "GET", "/api/kpis", None),
+    (3, "GET", "/api/risk-zones", None),
+    (2, "GET", "/api/risk-zones?biometric_type=iris&age_group=elderly", None),
+    (2, "GET", "/api/trends", None),
+    (2, "GET", "/api/trends/timeseries?granularity=day", None),
+    (1, "GET", "/api/feature-importance", None),
+    (2, "GET", "/api/insights", None),
+    (4, "POST", "/api/predict", PREDICTION),
+    (3, "GET", "/api/health", None),
+]
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def generate(size, workdir, fmt):
+    """Write a dataset into workdir/data/; returns timings and the path the API will load"""
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(data_dir)
+    csv_file = os.path.join(data_dir, "uidai_sample_data.csv")
+    started = time.perf_counter()
+    write_sample_data(csv_file, size, seed=0)
+    result = {"generate_s": time.perf_counter() - started, "csv_mb": os.path.getsize(csv_file) / 2**20}
+    path = csv_file
+    if fmt == "parquet":
+        path = os.path.join(data_dir, "uidai_parquet")
+        started = time.perf_counter()
+        convert_csv(csv_file, path)
+        result["convert_s"] = time.perf_counter() - started
+        result["parquet_mb"] = sum(os.path.getsize(os.path.join(root, name))
+                                   for root, _, names in os.walk(path) for name in names) / 2**20
+    return result, path
+
+def run_endpoints(workdir, repeat):
+    """bench.bench_endpoints in a fresh interpreter started in `workdir`"""
+    output = os.path.join(workdir, "endpoints.json")
+    subprocess.run([sys.executable, os.path.join(BACKEND_DIR, "bench", "bench_endpoints.py"), "--repeat", str(repeat),
+                    "--json", output], cwd=workdir, env=dict(os.environ, PYTHONPATH=BACKEND_DIR), check=True,
+                   capture_output=True, text=True)
+    with open(output) as f:
+        return json.load(f)
+
+def _client(port, plan, latencies, errors, lock):
+    """Send each (method, path, body) of `plan` in turn over one keep-alive connection"""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    for method, path, body in plan:
+        headers = {"Content-Type": "application/json"} if body else {}
+        started = time.perf_counter()
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.setdefault(f"{method} {path}", []).append(elapsed)
+            if response.status >= 300:
+                errors.append(response.status)
+    connection.close()
+
+def _stream_connect_ms(port):
+    """Time until /api/insights/stream sends its first line"""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    started = time.perf_counter()
+    connection.request("GET", "/api/insights/stream")
+    connection.getresponse().readline()
+    elapsed = (time.perf_counter() - started) * 1000
+    connection.close()
+    return elapsed
+
+def _percentiles(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"requests": len(latencies), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+def run_http(workdir, concurrency_levels, requests, port, uvicorn_workers):
+    """Load the API under uvicorn at each concurrency level"""
+    env = dict(os.environ, INGEST_PERSIST="0", MODEL_RELOAD_INTERVAL="0")
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+                               "--port", str(port), "--workers", str(uvicorn_workers), "--log-level", "warning"],
+                              cwd=workdir, env=env)
+    results = []
+    try:
+        wait_until_ready(port, timeout=600)
+        stream_ms = _stream_connect_ms(port)
+        rng = random.Random(0)
+        weights = [weight for weight, *_ in HTTP_MIX]
+        requests_list = [tuple(request) for _, *request in HTTP_MIX]
+        # Warm the response cache and model the way a running server would be
+        _client(port, requests_list, {}, [], threading.Lock())
+        for concurrency in concurrency_levels:
+            per_client = max(1, requests // concurrency)
+            plans = [rng.choices(requests_list, weights, k=per_client) for _ in range(concurrency)]
+            latencies, errors, lock = {}, [], threading.Lock()
+            threads = [threading.Thread(target=_client, args=(port, plan, latencies, errors, lock)) for plan in plans]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            combined = [value for values in latencies.values() for value in values]
+            results.append({"concurrency": concurrency, "uvicorn_workers": uvicorn_workers,
+                            "throughput_rps": len(combined) / elapsed, "errors": len(errors),
+                            "stream_connect_ms": stream_ms, **_percentiles(combined),
+                            "endpoints": {endpoint: _percentiles(values)
+                                          for endpoint, values in sorted(latencies.items())}})
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+def compare(results, baseline, threshold):
+    """Print endpoint and HTTP latencies that changed by more than `threshold` against a baseline run"""
+    def index(run):
+        values = {}
+        for size_run in run["sizes"]:
+            size = size_run["size"]
+            for result in size_run.get("endpoints", []):
+                values[(size, "endpoint", result["endpoint"], result["cache"])] = result["p50_ms"]
+            for result in size_run.get("http", []):
+                values[(size, "http", f"c={result['concurrency']}", "p99")] = result["p99_ms"]
+            for result in size_run.get("train", []):
+                values[(size, "train", result["mode"], "wall")] = result["wall_s"]
+        return values
+    new, old = index(results), index(baseline)
+    changed = [(key, old[key], new[key]) for key in sorted(new.keys() & old.keys(), key=str)
+               if old[key] > 0 and abs(new[key] / old[key] - 1) > threshold]
+    print(f"\n{len(changed)} of {len(new.keys() & old.keys())} measurements moved by more than {threshold:.0%}:")
+    for (size, kind, name, mode), before, after in changed:
+        print(f"  {size:>11,} {kind:<9}{name[:55]:<56}{mode:>6} {before:>10.2f} -> {after:>10.2f} "
+              f"({after / before - 1:+.0%})")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--parts", nargs="+", choices=["train", "endpoints", "http"],
+                        default=["train", "endpoints", "http"])
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet", help="Dataset format the API loads")
+    parser.add_argument("--train-modes", nargs="+", choices=["default", "fast", "fast + external"], default=["fast"])
+    parser.add_argument("--repeat", type=int, default=100, help="In-process calls per endpoint")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=2000, help="HTTP requests per concurrency level")
+    parser.add_argument("--uvicorn-workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--json", default="bench_results.json", help="Results file")
+    parser.add_argument("--baseline", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change reported by --baseline")
+    args = parser.parse_args()
+
+    results = {"created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'), "git": _git_revision(),
+               "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+               "args": vars(args), "sizes": []}
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            print(f"\n== {size:,} rows")
+            data, data_path = generate(size, workdir, args.format)
+            size_run = {"size": size, "data": data}
+            print(f"generated in {data['generate_s']:.1f}s ({data['csv_mb']:.0f} MB CSV)"
+                  + (f", Parquet in {data['convert_s']:.1f}s ({data['parquet_mb']:.0f} MB)" if "convert_s" in data else ""))
+
+            # Training also writes the model the endpoints serve
+            train_modes = args.train_modes if "train" in args.parts else args.train_modes[:1]
+            size_run["train"] = []
+            for mode in train_modes:
+                report = run_train(mode, data_path, workdir, [])
+                size_run["train"].append({**report, "mode": mode})
+                print(f"train {mode:<16}{report['wall_s']:>8.1f}s {report['peak_rss_mb']:>7.0f} MB "
+                      f"AUC {report['auc']:.4f}")
+            if "train" not in args.parts:
+                size_run.pop("train")
+
+            if "endpoints" in args.parts:
+                size_run["endpoints"] = run_endpoints(workdir, args.repeat)
+                for result in size_run["endpoints"]:
+                    print(f"{result['endpoint'][:61]:<62}{result['cache']:>6}  p50 {result['p50_ms']:8.2f} ms"
+                          f"  p99 {result['p99_ms']:8.2f} ms")
+
+            if "http" in args.parts:
+                size_run["http"] = run_http(workdir, args.concurrency, args.requests, args.port,
+                                            args.uvicorn_workers)
+                for result in size_run["http"]:
+                    print(f"HTTP c={result['concurrency']:<4}{result['throughput_rps']:>9,.0f} req/s  "
+                          f"p50 {result['p50_ms']:.2f} ms  p95 {result['p95_ms']:.2f} ms  "
+                          f"p99 {result['p99_ms']:.2f} ms  errors {result['errors']}")
+            results["sizes"].append(size_run)
+
+            # Keep partial results if a larger size fails
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+
+    print(f"\nResults written to {args.json}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f), args.threshold)
+
+if __name__ == "__main__":
+    main()
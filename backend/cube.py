@@ -0,0 +1,211 @@
+"""
+Pre-aggregated success/failure cube for the dashboard endpoints
+
+The cube holds one cell per observed combination of the dimensions in
+CUBE_DIMENSIONS, with the number of attempts, the number of failures and
+the row position at which the combination was first seen. Endpoints roll
+the cube up instead of scanning the raw records, so their cost depends on
+the number of cells rather than the number of authentication events.
+"""
+import numpy as np
+import pandas as pd
+
+import metrics
+from event_store import EventChunk
+
+CUBE_DIMENSIONS = ['state', 'district', 'age_group', 'biometric_type', 'device_model', 'gender', 'month']
+
+# Rollup/totals results memoized per cube; the cube is immutable so they never go stale
+MEMO_SIZE = 256
+
+# Dimensions derived from a stored dimension's labels
+VIRTUAL_DIMENSIONS = {
+    'month_of_year': ('month', lambda label: int(label[5:7])),
+}
+
+class AggregateCube:
+    """Success/failure counts keyed by CUBE_DIMENSIONS"""
+
+    def __init__(self, codes, vocab, total, failures, first_seen):
+        # Cells are shared by concurrent requests, so freeze them
+        for array in [*codes.values(), total, failures, first_seen]:
+            array.setflags(write=False)
+        self.codes = codes
+        self.vocab = vocab
+        self.total = total
+        self.failures = failures
+        self.first_seen = first_seen
+        self._memo = {}
+
+    def shared_arrays(self):
+        """(arrays, metadata) from which from_shared_arrays() rebuilds the cube"""
+        arrays = {f"codes.{dim}": codes for dim, codes in self.codes.items()}
+        arrays.update(total=self.total, failures=self.failures, first_seen=self.first_seen)
+        return arrays, self.vocab
+
+    @classmethod
+    def from_shared_arrays(cls, arrays, vocab):
+        codes = {key.split(".", 1)[1]: array for key, array in arrays.items() if key.startswith("codes.")}
+        return cls(codes, vocab, arrays["total"], arrays["failures"], arrays["first_seen"])
+
+    @classmethod
+    def from_frame(cls, df, offset=0):
+        """
+        Build the cube from a frame of raw authentication events
+
+        `offset` is the position of the frame's first row in the full dataset,
+        used for first_seen when the frame is an appended batch.
+        """
+        return cls.from_events(EventChunk.from_frame(df), offset)
+
+    @classmethod
+    def from_events(cls, events, offset=0):
+        """Build the cube from an EventChunk, working on its codes; `offset` as for from_frame()"""
+        row_codes = []
+        vocab = {}
+        for dim in CUBE_DIMENSIONS:
+            codes, labels = events.periods() if dim == 'month' else events.column(dim)
+            row_codes.append(codes)
+            vocab[dim] = list(labels)
+
+        shape = tuple(max(len(vocab[dim]), 1) for dim in CUBE_DIMENSIONS)
+        row_keys = np.ravel_multi_index(row_codes, shape)
+        cell_keys, first_seen, inverse = np.unique(row_keys, return_index=True, return_inverse=True)
+
+        total = np.bincount(inverse, minlength=len(cell_keys)).astype(np.int64)
+        failures = np.bincount(inverse[events.is_failure()], minlength=len(cell_keys)).astype(np.int64)
+
+        cell_codes = np.unravel_index(cell_keys, shape)
+        codes = {dim: cell_codes[i].astype(np.int32) for i, dim in enumerate(CUBE_DIMENSIONS)}
+        return cls(codes, vocab, total, failures, first_seen.astype(np.int64) + offset)
+
+    def merge(self, other):
+        """
+        Return a new cube combining the counts of this cube and `other`
+
+        Cost is proportional to the number of cells in both cubes, so new
+        batches can be folded in without revisiting raw events. Neither
+        input cube is modified.
+        """
+        vocab = {dim: sorted(set(self.vocab[dim]) | set(other.vocab[dim])) for dim in CUBE_DIMENSIONS}
+        shape = tuple(max(len(vocab[dim]), 1) for dim in CUBE_DIMENSIONS)
+
+        keys = []
+        for cube in (self, other):
+            remapped = []
+            for dim in CUBE_DIMENSIONS:
+                position = {label: i for i, label in enumerate(vocab[dim])}
+                lookup = np.array([position[label] for label in cube.vocab[dim]], dtype=np.int64)
+                remapped.append(lookup[cube.codes[dim]] if len(lookup) else cube.codes[dim].astype(np.int64))
+            keys.append(np.ravel_multi_index(remapped, shape))
+
+        cell_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        total = np.bincount(inverse, weights=np.concatenate([self.total, other.total]),
+                            minlength=len(cell_keys)).astype(np.int64)
+        failures = np.bincount(inverse, weights=np.concatenate([self.failures, other.failures]),
+                               minlength=len(cell_keys)).astype(np.int64)
+        first_seen = np.full(len(cell_keys), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first_seen, inverse, np.concatenate([self.first_seen, other.first_seen]))
+
+        cell_codes = np.unravel_index(cell_keys, shape)
+        codes = {dim: cell_codes[i].astype(np.int32) for i, dim in enumerate(CUBE_DIMENSIONS)}
+        return AggregateCube(codes, vocab, total, failures, first_seen)
+
+    def __len__(self):
+        return len(self.total)
+
+    def _memoized(self, key, compute):
+        """Return a cached result for `key`, computing and storing it on a miss"""
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        result = compute()
+        if len(self._memo) >= MEMO_SIZE:
+            self._memo.clear()
+        self._memo[key] = result
+        return result
+
+    @staticmethod
+    def _where_key(where):
+        return tuple(sorted(
+            (name, tuple(values) if isinstance(values, (list, tuple, set)) else values)
+            for name, values in (where or {}).items()
+        ))
+
+    def dimension(self, name):
+        """Return (per-cell codes, labels) for a stored or virtual dimension"""
+        if name in self.codes:
+            return self.codes[name], self.vocab[name]
+        return self._memoized(('dimension', name), lambda: self._virtual_dimension(name))
+
+    def _virtual_dimension(self, name):
+        base, derive = VIRTUAL_DIMENSIONS[name]
+        derived = [derive(label) for label in self.vocab[base]]
+        labels = sorted(set(derived))
+        lookup = np.array([labels.index(value) for value in derived], dtype=np.int32)
+        codes = lookup[self.codes[base]]
+        codes.setflags(write=False)
+        return codes, labels
+
+    @metrics.timed("cube.mask")
+    def mask(self, where=None):
+        """Boolean mask over cells matching `where` ({dimension: value or list of values})"""
+        selected = np.ones(len(self), dtype=bool)
+        for name, values in (where or {}).items():
+            codes, labels = self.dimension(name)
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            wanted = [labels.index(v) for v in values if v in labels]
+            selected &= np.isin(codes, wanted)
+        return selected
+
+    def totals(self, where=None):
+        """Return (attempts, failures) over the cells matching `where`"""
+        return self._memoized(('totals', self._where_key(where)), lambda: self._totals(where))
+
+    def _totals(self, where):
+        selected = self.mask(where)
+        return int(self.total[selected].sum()), int(self.failures[selected].sum())
+
+    def rollup(self, by, where=None):
+        """
+        Aggregate the cube by the dimensions in `by`
+
+        Returns a DataFrame with one row per observed group, sorted by the
+        group labels, with columns for each dimension in `by` plus total,
+        failures and first_seen. Results are memoized and shared between
+        callers, so treat the returned frame as read-only.
+        """
+        return self._memoized(('rollup', tuple(by), self._where_key(where)), lambda: self._rollup(by, where))
+
+    @metrics.timed("cube.rollup")
+    def _rollup(self, by, where):
+        selected = self.mask(where)
+        group_codes = []
+        group_labels = []
+        for name in by:
+            codes, labels = self.dimension(name)
+            group_codes.append(codes[selected])
+            group_labels.append(labels)
+
+        shape = tuple(max(len(labels), 1) for labels in group_labels)
+        if group_codes:
+            keys = np.ravel_multi_index(group_codes, shape)
+        else:
+            keys = np.zeros(int(selected.sum()), dtype=np.int64)
+        groups, inverse = np.unique(keys, return_inverse=True)
+
+        total = np.bincount(inverse, weights=self.total[selected], minlength=len(groups)).astype(np.int64)
+        failures = np.bincount(inverse, weights=self.failures[selected], minlength=len(groups)).astype(np.int64)
+        first_seen = np.full(len(groups), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first_seen, inverse, self.first_seen[selected])
+
+        with metrics.span("cube.rollup.frame"):
+            result = {}
+            for name, codes, labels in zip(by, np.unravel_index(groups, shape), group_labels):
+                result[name] = [labels[code] for code in codes]
+            result['total'] = total
+            result['failures'] = failures
+            result['first_seen'] = first_seen
+            return pd.DataFrame(result)
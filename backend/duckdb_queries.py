@@ -0,0 +1,181 @@
+"""
+DuckDB query backend for the dashboard analytics
+
+DuckDBQueries answers the same totals() and rollup() queries as
+AggregateCube, but as SQL run directly over the Parquet dataset or CSV file
+on disk. Nothing is loaded into Python memory up front, scans use DuckDB's
+worker threads, and newly written files are picked up on the next query, so
+the analytics functions work unchanged on datasets larger than RAM.
+"""
+import os
+import threading
+from urllib.parse import quote, unquote
+
+import duckdb
+
+import metrics
+
+# Stride separating file index from row number in the Parquet row order key
+FILE_STRIDE = 1 << 32
+
+def _literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+class DuckDBQueries:
+    """totals()/rollup() over events files on disk, answered by DuckDB"""
+
+    def __init__(self, path, threads=None):
+        self.path = path
+        self.threads = threads
+        self.parquet = os.path.isdir(path)
+        self._connection = None
+        self._lock = threading.Lock()
+
+        if self.parquet:
+            pattern = _literal(os.path.join(path, "**", "*.parquet"))
+            self._scan = f"read_parquet({pattern}, hive_partitioning=true, filename=true, file_row_number=true)"
+            # Partition values are URL-encoded in directory names
+            self._encoded = {'state', 'month'}
+            self._dimensions = {'month': "month"}
+            # Row order matches the Parquet reader: files in path order, then row number
+            self._ordered_scan = (
+                f"(SELECT s.*, f.file_index * {FILE_STRIDE} + s.file_row_number AS row_index FROM {self._scan} s "
+                f"JOIN (SELECT file, row_number() OVER (ORDER BY file) AS file_index FROM glob({pattern})) f "
+                f"ON s.filename = f.file)"
+            )
+        else:
+            self._scan = f"read_csv_auto({_literal(path)})"
+            self._encoded = set()
+            self._dimensions = {'month': "strftime(auth_timestamp, '%Y-%m')"}
+            # row_number() follows the order rows are produced in, which is file
+            # order only when one thread reads the CSV; CSV has no file_row_number
+            self._ordered_scan = (f"(SELECT *, row_number() OVER () - 1 AS row_index "
+                                  f"FROM read_csv_auto({_literal(path)}, parallel=false))")
+        self._dimensions['month_of_year'] = "month(auth_timestamp)"
+
+    def __getstate__(self):
+        return {"path": self.path, "threads": self.threads}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["threads"])
+
+    def _cursor(self):
+        """A cursor on this process's connection; cursors may be used from any thread"""
+        with self._lock:
+            if self._connection is None:
+                self._connection = duckdb.connect()
+                if self.threads:
+                    self._connection.execute(f"SET threads TO {int(self.threads)}")
+            return self._connection.cursor()
+
+    def _expression(self, name):
+        return self._dimensions.get(name, name)
+
+    def _where(self, where):
+        """SQL WHERE clause and parameters for {dimension: value or list of values}"""
+        clauses, params = self._conditions(where)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _conditions(self, where):
+        """SQL conditions and their parameters for {dimension: value or list of values}"""
+        clauses = []
+        params = []
+        for name, values in (where or {}).items():
+            if name == 'date':
+                # Inclusive (start, end) dates, either of which may be None
+                for operator, bound in zip([">=", "<="], values):
+                    if bound is not None:
+                        clauses.append(f"CAST(auth_timestamp AS DATE) {operator} ?")
+                        params.append(bound)
+                continue
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            values = list(values)
+            if name in self._encoded:
+                values = [quote(str(value), safe='') for value in values]
+            if not values:
+                clauses.append("false")
+                continue
+            clauses.append(f"{self._expression(name)} IN ({', '.join('?' * len(values))})")
+            params += values
+        return clauses, params
+
+    @metrics.timed("duckdb.totals")
+    def totals(self, where=None):
+        """Return (attempts, failures) over the events matching `where`"""
+        clause, params = self._where(where)
+        total, failures = self._cursor().execute(
+            f"SELECT count(*), count(*) FILTER (WHERE auth_result = 'failure') FROM {self._scan}{clause}",
+            params,
+        ).fetchone()
+        return int(total), int(failures)
+
+    @metrics.timed("duckdb.rollup")
+    def rollup(self, by, where=None):
+        """
+        Aggregate events by the dimensions in `by`
+
+        Returns the same frame as AggregateCube.rollup(): one row per
+        observed group, sorted by the group labels, with total, failures and
+        first_seen (the position of the group's first event in file order).
+        A 'date' range bounds the counts but not first_seen, which is the
+        group's first event matching the other filters on any date, as
+        RiskIndex.rollup() keeps it; groups with no attempts in range are
+        left out.
+        """
+        where = dict(where or {})
+        in_range, range_params = self._conditions({'date': where.pop('date')} if 'date' in where else {})
+        clause, params = self._where(where)
+        counted = ["count(*)", "count(*) FILTER (WHERE auth_result = 'failure')"]
+        if in_range:
+            in_range = " AND ".join(in_range)
+            counted = [f"count(*) FILTER (WHERE {in_range})",
+                       f"count(*) FILTER (WHERE {in_range} AND auth_result = 'failure')"]
+            params = range_params * 2 + params
+        columns = [f'{self._expression(name)} AS "{name}"' for name in by] + [
+            f"({counted[0]})::BIGINT AS total",
+            f"({counted[1]})::BIGINT AS failures",
+            "min(row_index)::BIGINT AS first_seen",
+        ]
+        sql = f"SELECT {', '.join(columns)} FROM {self._ordered_scan}{clause}"
+        if by:
+            sql += " GROUP BY ALL"
+        result = self._cursor().execute(sql, params).df()
+        for name in by:
+            if name in self._encoded:
+                result[name] = result[name].map(unquote)
+        result = result[result['total'] > 0]
+        if by:
+            result = result.sort_values(list(by), ignore_index=True)
+        return result.reset_index(drop=True)
+
+    def hourly_counts(self, dimensions):
+        """
+        Attempts and failures per hour and combination of `dimensions`
+
+        The result is proportional to hours × observed combinations rather
+        than events, small enough to build a TimeSeriesStore from.
+        """
+        columns = ["date_trunc('hour', auth_timestamp) AS hour"]
+        columns += [f'{self._expression(name)} AS "{name}"' for name in dimensions]
+        columns += [
+            "count(*)::BIGINT AS total",
+            "(count(*) FILTER (WHERE auth_result = 'failure'))::BIGINT AS failures",
+        ]
+        result = self._cursor().execute(f"SELECT {', '.join(columns)} FROM {self._scan} GROUP BY ALL").df()
+        for name in dimensions:
+            if name in self._encoded:
+                result[name] = result[name].map(unquote)
+        return result
+
+    def latest_events(self, columns, limit):
+        """The `limit` most recent events' `columns`, oldest first"""
+        selected = ', '.join(f'"{name}"' for name in columns)
+        result = self._cursor().execute(
+            f"SELECT * FROM (SELECT {selected} FROM {self._scan} ORDER BY auth_timestamp DESC LIMIT {int(limit)}) "
+            f"ORDER BY auth_timestamp"
+        ).df()
+        for name in columns:
+            if name in self._encoded:
+                result[name] = result[name].map(unquote)
+        return result
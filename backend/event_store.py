@@ -0,0 +1,276 @@
+"""
+Compact append-only store of authentication events
+
+Events are held dictionary-encoded rather than as DataFrames of strings or
+categoricals. An EventChunk keeps:
+
+- one fixed-width code column per dimension (uint8, or uint16 beyond 256
+  labels), with the dimension's sorted labels as its vocabulary;
+- auth_timestamp as uint32 seconds since the epoch;
+- the success flag bit-packed, eight events per byte, in Arrow's bit order
+  so it converts to an Arrow boolean column without a copy.
+
+That is about 10 bytes per event for the columns the API loads. The
+aggregates (AggregateCube, RiskIndex, TimeSeriesStore) are built from the
+codes directly, and a frame is only materialized for the rows that need
+one (the anomaly detector's warm-up). An EventStore is a list of chunks,
+so appending a batch never copies the events already stored.
+"""
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+DIMENSIONS = ['state', 'district', 'age_group', 'gender', 'biometric_type', 'device_model']
+
+# auth_timestamp range held as uint32 epoch seconds
+EARLIEST_TIMESTAMP = datetime(1970, 1, 1)
+LATEST_TIMESTAMP = datetime(2106, 2, 7, 6, 28, 15)
+
+# Rows read and encoded at a time by EventChunk.load
+LOAD_CHUNK_ROWS = 1_000_000
+
+def _sort_labels(codes, labels, dtype=np.int64):
+    """Recode `codes` over `labels` to codes over the lexically sorted labels"""
+    order = sorted(range(len(labels)), key=labels.__getitem__)
+    remap = np.empty(len(labels), dtype=dtype)
+    remap[order] = np.arange(len(labels))
+    return remap[codes], [labels[i] for i in order]
+
+def _factorize_sorted(values):
+    """Factorize values into codes over their lexically sorted unique labels"""
+    codes, uniques = pd.factorize(values)
+    return _sort_labels(codes, list(uniques))
+
+def _code_dtype(n_labels):
+    """Smallest unsigned integer type holding codes for `n_labels` labels"""
+    for dtype in (np.uint8, np.uint16):
+        if n_labels <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint32
+
+def _epoch_seconds(timestamps):
+    """uint32 seconds since the epoch of datetime64 values (or a column of strings, parsed)"""
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = pd.to_datetime(timestamps)
+    seconds = np.asarray(timestamps).astype('datetime64[s]').astype(np.int64)
+    if len(seconds) and (seconds.min() < 0 or seconds.max() > np.iinfo(np.uint32).max):
+        raise ValueError("auth_timestamp outside 1970-2106 cannot be stored as uint32 epoch seconds")
+    return seconds.astype(np.uint32)
+
+def _array(column):
+    """A table column as one array, without a copy when it is a single chunk"""
+    return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+class EventChunk:
+    """Dictionary-encoded events: per-dimension codes, epoch seconds and packed success bits"""
+
+    def __init__(self, codes, vocab, seconds, success, rows):
+        for array in [*codes.values(), seconds, success]:
+            array.setflags(write=False)
+        self.codes = codes
+        self.vocab = vocab
+        self.seconds = seconds
+        self.success = success
+        self.rows = rows
+
+    @classmethod
+    def from_frame(cls, df):
+        """Encode a frame of raw events (string, categorical or derived columns as loaded)"""
+        codes = {}
+        vocab = {}
+        for dim in DIMENSIONS:
+            if dim in df:
+                dim_codes, labels = _factorize_sorted(df[dim])
+                codes[dim] = dim_codes.astype(_code_dtype(len(labels)))
+                vocab[dim] = labels
+        if 'is_failure' in df:
+            success = df['is_failure'].to_numpy() == 0
+        else:
+            success = (df['auth_result'] != 'failure').to_numpy()
+        return cls(codes, vocab, _epoch_seconds(df['auth_timestamp']), np.packbits(success, bitorder='little'),
+                   len(df))
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Encode an Arrow table of raw events (string or dictionary columns, as
+        read from Parquet) without converting values to Python objects
+        """
+        codes = {}
+        vocab = {}
+        for dim in DIMENSIONS:
+            if dim in table.column_names:
+                encoded = pc.dictionary_encode(table.column(dim).cast(pa.string())).combine_chunks()
+                labels = encoded.dictionary.to_pylist()
+                codes[dim], vocab[dim] = _sort_labels(encoded.indices.to_numpy(), labels, _code_dtype(len(labels)))
+        timestamps = table.column('auth_timestamp').combine_chunks().to_numpy(zero_copy_only=False)
+        success = pc.not_equal(table.column('auth_result').cast(pa.string()), 'failure').combine_chunks()
+        return cls(codes, vocab, _epoch_seconds(timestamps),
+                   np.packbits(success.to_numpy(zero_copy_only=False), bitorder='little'), table.num_rows)
+
+    @classmethod
+    def concat(cls, chunks):
+        """One chunk holding the events of `chunks` in order, over the union of their vocabularies"""
+        chunks = [chunk for chunk in chunks if len(chunk)]
+        if len(chunks) == 1:
+            return chunks[0]
+        if not chunks:
+            return cls({}, {}, np.empty(0, np.uint32), np.empty(0, np.uint8), 0)
+        codes = {}
+        vocab = {}
+        for dim in DIMENSIONS:
+            if not all(dim in chunk.codes for chunk in chunks):
+                continue
+            labels = sorted(set().union(*(chunk.vocab[dim] for chunk in chunks)))
+            position = {label: i for i, label in enumerate(labels)}
+            dtype = _code_dtype(len(labels))
+            codes[dim] = np.concatenate([np.array([position[label] for label in chunk.vocab[dim]], dtype=dtype)
+                                         [chunk.codes[dim]] for chunk in chunks])
+            vocab[dim] = labels
+        seconds = np.concatenate([chunk.seconds for chunk in chunks])
+        success = np.packbits(np.concatenate([chunk.is_success() for chunk in chunks]), bitorder='little')
+        return cls(codes, vocab, seconds, success, sum(len(chunk) for chunk in chunks))
+
+    @classmethod
+    def read(cls, path, chunk_size=LOAD_CHUNK_ROWS):
+        """
+        Yield a Parquet dataset or CSV file as chunks of about `chunk_size`
+        events, encoding each as it is read (for Parquet, without creating
+        Python string objects)
+        """
+        from storage import read_chunks, read_tables
+        columns = ['auth_timestamp', 'auth_result'] + DIMENSIONS
+        if os.path.isdir(path) or path.endswith('.parquet'):
+            for table in read_tables(path, chunk_size, columns):
+                yield cls.from_table(table)
+        else:
+            for frame in read_chunks(path, chunk_size, columns):
+                yield cls.from_frame(frame)
+
+    @classmethod
+    def load(cls, path, chunk_size=LOAD_CHUNK_ROWS):
+        """Read a dataset into one chunk (see read()); no full DataFrame of it is ever built"""
+        return cls.concat(list(cls.read(path, chunk_size)))
+
+    @classmethod
+    def from_arrow(cls, table):
+        """Chunk over the buffers of a table written by to_arrow() (zero-copy for memory-mapped tables)"""
+        codes = {}
+        vocab = {}
+        for dim in DIMENSIONS:
+            if dim in table.column_names:
+                column = _array(table.column(dim))
+                codes[dim] = column.indices.to_numpy(zero_copy_only=False)
+                vocab[dim] = column.dictionary.to_pylist()
+        rows = table.num_rows
+        success = _array(table.column('success'))
+        # Arrow booleans are packed with the same bit order; slice off the validity buffer
+        packed = np.frombuffer(success.buffers()[1], dtype=np.uint8)[:(rows + 7) // 8]
+        seconds = _array(table.column('auth_timestamp')).to_numpy(zero_copy_only=False)
+        return cls(codes, vocab, seconds, packed, rows)
+
+    def to_arrow(self):
+        """The chunk as an Arrow table of dictionary, uint32 and boolean columns sharing its buffers"""
+        columns = {dim: pa.DictionaryArray.from_arrays(self.codes[dim], pa.array(self.vocab[dim], pa.string()))
+                   for dim in self.codes}
+        columns['auth_timestamp'] = pa.array(self.seconds)
+        columns['success'] = pa.Array.from_buffers(pa.bool_(), self.rows, [None, pa.py_buffer(self.success)])
+        return pa.table(columns)
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def nbytes(self):
+        return sum(codes.nbytes for codes in self.codes.values()) + self.seconds.nbytes + self.success.nbytes
+
+    def column(self, dim):
+        """(codes, sorted labels) of a dimension"""
+        return self.codes[dim], self.vocab[dim]
+
+    def is_success(self):
+        return np.unpackbits(self.success, count=self.rows, bitorder='little').view(bool)
+
+    def is_failure(self):
+        return ~self.is_success()
+
+    def timestamps(self, unit='s'):
+        """auth_timestamp as datetime64 in `unit` ('s', 'h', 'D', 'M', ...)"""
+        return self.seconds.astype('datetime64[s]').astype(f'datetime64[{unit}]')
+
+    def periods(self):
+        """(codes, labels) of each event's 'YYYY-MM' month"""
+        months = self.timestamps('M').astype(np.int64)
+        first = int(months.min()) if len(months) else 0
+        offsets = months - first
+        observed = np.flatnonzero(np.bincount(offsets, minlength=1))
+        remap = np.zeros(int(offsets.max()) + 1 if len(offsets) else 1, dtype=np.int64)
+        remap[observed] = np.arange(len(observed))
+        labels = [str(np.datetime64(first + int(i), 'M')) for i in observed] if len(months) else []
+        return remap[offsets], labels
+
+    def to_frame(self, rows=None):
+        """
+        Materialize events as a DataFrame with categorical dimensions,
+        auth_timestamp, auth_result and the derived columns; `rows` selects a
+        subset by position
+        """
+        from storage import add_derived_columns
+        select = slice(None) if rows is None else rows
+        frame = pd.DataFrame({
+            'auth_timestamp': pd.to_datetime(self.seconds[select].astype(np.int64), unit='s'),
+            **{dim: pd.Categorical.from_codes(self.codes[dim][select].astype(np.int32), self.vocab[dim])
+               for dim in self.codes},
+            'auth_result': pd.Categorical.from_codes(self.is_success()[select].astype(np.int8),
+                                                     ['failure', 'success']),
+        })
+        return add_derived_columns(frame)
+
+    def recent(self, n):
+        """The `n` most recent events as a frame (see to_frame())"""
+        if n >= self.rows:
+            return self.to_frame()
+        rows = np.argpartition(self.seconds, self.rows - n)[self.rows - n:]
+        return self.to_frame(np.sort(rows))
+
+class EventStore:
+    """Append-only list of EventChunks"""
+
+    def __init__(self, chunks=None):
+        self._chunks = [chunk for chunk in (chunks or []) if len(chunk)]
+        self._rows = sum(len(chunk) for chunk in self._chunks)
+        self._lock = threading.Lock()
+
+    def append(self, batch):
+        """Append a batch (DataFrame or EventChunk) and return the row position of its first event"""
+        if not isinstance(batch, EventChunk):
+            batch = EventChunk.from_frame(batch)
+        with self._lock:
+            offset = self._rows
+            if len(batch):
+                self._chunks = self._chunks + [batch]
+                self._rows += len(batch)
+            return offset
+
+    def chunks(self):
+        """Snapshot of the current chunks (later appends are not included)"""
+        return list(self._chunks)
+
+    def to_frame(self):
+        """Materialize all events as one DataFrame (see EventChunk.to_frame)"""
+        chunks = self.chunks()
+        if not chunks:
+            return pd.DataFrame()
+        return EventChunk.concat(chunks).to_frame()
+
+    @property
+    def nbytes(self):
+        return sum(chunk.nbytes for chunk in self.chunks())
+
+    def __len__(self):
+        return self._rows
@@ -0,0 +1,191 @@
+"""
+Worker pools for CPU-bound analytics
+
+Analytics functions run off the asyncio event loop so slow aggregations do
+not stall other requests on the same uvicorn worker. The thread pool suits
+NumPy/pandas work that releases the GIL; the process pool runs heavier
+aggregations in separate interpreters, reading the aggregate cube from
+shared memory rather than pickling it on every call. Identical concurrent
+requests are coalesced so only one computation runs per key.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import metrics
+
+# Shared sources kept alive per key after a newer one is published, for in-flight calls
+RETAINED_GENERATIONS = 2
+
+class SharedSource:
+    """
+    Picklable handle to a query source whose arrays live in shared memory
+
+    Works for any source with shared_arrays() and from_shared_arrays(), such
+    as AggregateCube and RiskIndex. Only the segment name, array layout and
+    metadata travel to worker processes; workers map the segment and rebuild
+    the source over zero-copy array views.
+    """
+
+    def __init__(self, cls, name, layout, meta):
+        self.cls = cls
+        self.name = name
+        self.layout = layout
+        self.meta = meta
+        self._segment = None
+
+    @classmethod
+    def create(cls, source):
+        """Copy a source's arrays into a new shared memory segment"""
+        arrays, meta = source.shared_arrays()
+        size = sum(array.nbytes for array in arrays.values())
+        segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        layout = []
+        offset = 0
+        for key, array in arrays.items():
+            np.ndarray(array.shape, array.dtype, buffer=segment.buf, offset=offset)[:] = array
+            layout.append((key, offset, array.shape, array.dtype.str))
+            offset += array.nbytes
+        handle = cls(type(source), segment.name, layout, meta)
+        handle._segment = segment
+        return handle
+
+    def __getstate__(self):
+        return {"cls": self.cls, "name": self.name, "layout": self.layout, "meta": self.meta}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _segment=None)
+
+    def attach(self):
+        """Map the segment and return the source rebuilt over it"""
+        if self._segment is None:
+            # Workers share the publishing process's resource tracker, so
+            # attaching re-registers the same name and needs no cleanup here
+            self._segment = shared_memory.SharedMemory(name=self.name)
+        arrays = {
+            key: np.ndarray(shape, np.dtype(dtype), buffer=self._segment.buf, offset=offset)
+            for key, offset, shape, dtype in self.layout
+        }
+        return self.cls.from_shared_arrays(arrays, self.meta)
+
+    def release(self, unlink=False):
+        if self._segment is not None:
+            try:
+                self._segment.close()
+                if unlink:
+                    self._segment.unlink()
+            except (BufferError, FileNotFoundError):
+                pass
+            self._segment = None
+
+# (handle, cube) pairs attached in this worker process, keyed by segment name;
+# the handle keeps the mapping open for as long as the cube's views are used
+_attached = {}
+
+def _call(fn, source, args):
+    """
+    Run fn(source, *args) in a worker, resolving shared memory handles
+
+    Returns the result and the seconds spent in each metrics.span() of the
+    call, which the caller adds to the request being served.
+    """
+    with metrics.collect() as stages:
+        # SharedSource and snapshot.SnapshotSource handles are mapped once per worker
+        if hasattr(source, "attach"):
+            with metrics.span("executor.attach"):
+                if source.name not in _attached:
+                    while len(_attached) >= RETAINED_GENERATIONS:
+                        _attached.pop(next(iter(_attached)))
+                    _attached[source.name] = (source, source.attach())
+                source = _attached[source.name][1]
+        started = time.perf_counter()
+        result = fn(source, *args)
+        stages["executor.compute"] = time.perf_counter() - started
+    return result, stages
+
+class AnalyticsExecutor:
+    """
+    Run analytics functions on a thread or process pool with request coalescing
+
+    kind "inline" runs them directly on the event loop, as the handlers
+    originally did, and is kept for comparison in bench/load_test.py.
+    """
+
+    def __init__(self, kind="thread", workers=None):
+        if kind not in ("inline", "thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.coalesced = 0
+        self._pool = None
+        self._sources = {}
+        self._shared = {}
+        self._inflight = {}
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == "process":
+                # Forking a process that has loaded the model (OpenMP threads)
+                # is unsafe, so workers come from a clean forkserver
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("forkserver"))
+            else:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="analytics")
+        return self._pool
+
+    def publish(self, source, key="queries"):
+        """Make `source` (a cube or other picklable query source) the data for run(..., source=key)"""
+        if self.kind == "process" and hasattr(source, "shared_arrays"):
+            shared = SharedSource.create(source)
+            retained = self._shared.setdefault(key, [])
+            retained.append(shared)
+            while len(retained) > RETAINED_GENERATIONS:
+                retained.pop(0).release(unlink=True)
+            source = shared
+        self._sources[key] = source
+
+    async def run(self, name, fn, *args, source="queries"):
+        """
+        Run fn(data, *args) on the pool against the source published under
+        `source` and return its result
+
+        Concurrent calls with the same name and arguments against the same
+        data share a single computation.
+        """
+        source = self._sources.get(source)
+        if self.kind == "inline":
+            result, stages = _call(fn, source, args)
+            metrics.record_stages(stages)
+            return result
+        key = (name, id(source), args)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            with metrics.span("executor.coalesced"):
+                return (await asyncio.shield(future))[0]
+
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        future = asyncio.ensure_future(loop.run_in_executor(self._get_pool(), _call, fn, source, args))
+        self._inflight[key] = future
+        try:
+            result, stages = await asyncio.shield(future)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        # "executor" is the wait for the pool plus the call itself
+        metrics.record_stages({"executor": time.perf_counter() - started, **stages})
+        return result
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        for retained in self._shared.values():
+            for shared in retained:
+                shared.release(unlink=True)
+        self._shared = {}
@@ -0,0 +1,136 @@
+"""
+TreeSHAP explanations for the failure model
+
+Attributions come from XGBoost's own TreeSHAP (`pred_contribs=True`), which
+handles the native categorical splits and scores a whole matrix per call.
+TreeSHAP costs milliseconds per row, so training computes them once and
+saves them with the model version as explanations.npz:
+
+- global importances: mean |SHAP| per feature over a sample of training rows;
+- per-combination attributions for every (age_group, biometric_type,
+  device_model, state, gender) code combination, averaged over a sample of
+  the training rows' (month, day_of_week, hour) values. A missing gender is
+  stored as the mean over genders, like InferenceEngine averages it.
+
+The API then serves /api/feature-importance and prediction factors with an
+array lookup. Combinations outside the grid (categories added by
+retrain.py, or a model saved without explanations) are explained on demand,
+micro-batched into single TreeSHAP calls and kept in an LRU cache.
+"""
+import io
+import os
+
+import numpy as np
+import xgboost as xgb
+
+from inference import CATEGORICAL_FEATURES, MODEL_FEATURES, LRUCache, MicroBatcher
+
+EXPLANATIONS_NAME = "explanations.npz"
+
+def contributions(booster, matrix):
+    """SHAP values (log-odds) per row of an encoded feature matrix; the last column is the bias"""
+    types = booster.feature_types
+    dmatrix = xgb.DMatrix(matrix, feature_names=booster.feature_names, feature_types=types,
+                          enable_categorical=bool(types) and 'c' in types)
+    return booster.predict(dmatrix, pred_contribs=True)
+
+def grid_rows(codes, times):
+    """Model input rows for categorical code tuples crossed with (month, day_of_week, hour) rows"""
+    codes = np.asarray(codes, dtype=np.float32).reshape(-1, len(CATEGORICAL_FEATURES))
+    rows = np.empty((len(codes) * len(times), len(MODEL_FEATURES)), dtype=np.float32)
+    rows[:, :len(CATEGORICAL_FEATURES)] = np.repeat(codes, len(times), axis=0)
+    rows[:, len(CATEGORICAL_FEATURES):] = np.tile(times, (len(codes), 1))
+    return rows
+
+def build_explanations(model, vocab, sample, n_importance_rows=2000, n_times=8, seed=42):
+    """
+    Global importances and the per-combination attribution grid for a model
+
+    `sample` is an encoded feature matrix of training or validation rows:
+    importances are averaged over up to `n_importance_rows` of them, and the
+    grid over `n_times` of their (month, day_of_week, hour) values.
+    """
+    booster = model.get_booster()
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(sample, dtype=np.float32)
+    rows = sample[rng.choice(len(sample), min(n_importance_rows, len(sample)), replace=False)]
+    importance = np.abs(contributions(booster, rows)[:, :-1]).mean(axis=0)
+    times = rows[rng.choice(len(rows), min(n_times, len(rows)), replace=False), len(CATEGORICAL_FEATURES):]
+
+    shape = tuple(len(vocab[feature]) for feature in CATEGORICAL_FEATURES)
+    codes = np.indices(shape).reshape(len(shape), -1).T
+    contribs = contributions(booster, grid_rows(codes, times))
+    attributions = contribs.reshape(len(codes), len(times), -1).mean(axis=1).reshape(shape + (-1,))
+    # An extra gender slot holds the average over genders
+    attributions = np.concatenate([attributions, attributions.mean(axis=4, keepdims=True)], axis=4)
+    return {"features": np.array(MODEL_FEATURES), "importance": importance.astype(np.float32),
+            "base_value": np.float32(contribs[0, -1]), "times": times, "attributions": attributions.astype(np.float32)}
+
+def save_explanations(explanations):
+    """Explanations as .npz bytes, written into the model bundle by model_store.save_version"""
+    buffer = io.BytesIO()
+    np.savez(buffer, **explanations)
+    return buffer.getvalue()
+
+class Explainer:
+    """Prediction factors and feature importance for the model being served"""
+
+    def __init__(self, model, explanations=None, cache_size=4096, max_batch_size=512, max_wait_ms=2.0):
+        self.booster = model.get_booster()
+        self.explanations = explanations
+        self.cache = LRUCache(cache_size)
+        self.batcher = MicroBatcher(self.contributions, max_batch_size, max_wait_ms)
+        # Without precomputed explanations, misses are averaged over a fixed spread of times
+        self.times = explanations["times"] if explanations else np.array(
+            [[month, day, hour] for month, day, hour in zip([1, 4, 7, 10], [0, 2, 4, 6], [3, 9, 15, 21])],
+            dtype=np.float32)
+
+    @classmethod
+    def load(cls, model, explanations_file=None, **kwargs):
+        """Explainer for a model, with the explanations saved by train_model.py if the file exists"""
+        explanations = None
+        if explanations_file and os.path.exists(explanations_file):
+            with np.load(explanations_file, allow_pickle=False) as arrays:
+                explanations = dict(arrays)
+        return cls(model, explanations, **kwargs)
+
+    def contributions(self, matrix):
+        return contributions(self.booster, matrix)
+
+    def feature_importance(self):
+        """Features by share of the mean |SHAP| (percent), or None without precomputed explanations"""
+        if self.explanations is None:
+            return None
+        importance = self.explanations["importance"]
+        total = float(importance.sum()) or 1.0
+        features = [{"name": feature.replace('_', ' ').title(), "importance": round(float(value) / total * 100, 2)}
+                    for feature, value in zip(self.explanations["features"], importance)]
+        features.sort(key=lambda x: x['importance'], reverse=True)
+        return {"features": features}
+
+    async def factors(self, key, n_genders):
+        """
+        SHAP values (log-odds) of the categorical features for a resolved
+        feature tuple from InferenceEngine.resolve
+        """
+        codes = key[:len(CATEGORICAL_FEATURES)]
+        gender = CATEGORICAL_FEATURES.index('gender')
+        values = None
+        if self.explanations is not None:
+            grid = self.explanations["attributions"]
+            sizes = grid.shape[:gender] + (grid.shape[gender] - 1,)
+            index = codes[:gender] + (sizes[gender] if codes[gender] is None else codes[gender],)
+            if all(code < size for code, size in zip(codes[:gender], sizes)) and (
+                    index[gender] < sizes[gender] or n_genders == sizes[gender]):
+                values = grid[index]
+        if values is None:
+            values = self.cache.get(codes)
+        if values is None:
+            genders = range(n_genders) if codes[gender] is None else [codes[gender]]
+            rows = grid_rows([codes[:gender] + (g,) for g in genders], self.times)
+            values = (await self.batcher.submit(rows))[:, :-1].mean(axis=0)
+            self.cache.put(codes, values)
+        return {feature: round(float(values[i]), 4) + 0.0 for i, feature in enumerate(CATEGORICAL_FEATURES)}
+
+    async def close(self):
+        await self.batcher.close()
@@ -1,11 +1,15 @@
 """
 Generate sample UIDAI biometric authentication dataset
 """
+import argparse
+import os
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import random
 
+from storage import CSV_DATE_FORMAT
+
 # Indian states and districts
 STATES = ["Maharashtra", "Delhi", "Karnataka", "Tamil Nadu", "Gujarat", "Rajasthan", 
           "West Bengal", "Uttar Pradesh", "Bihar", "Punjab", "Haryana", "Kerala"]
@@ -30,8 +34,8 @@ BIOMETRIC_TYPES = ["fingerprint", "iris"]
 DEVICE_MODELS = ["UIDAI_Device_A", "UIDAI_Device_B", "UIDAI_Device_C", "UIDAI_Device_D", "UIDAI_Device_E"]
 FAILURE_REASONS = ["poor_quality", "environmental", "device_error", "user_error", "network_timeout", None]
 
-def generate_sample_data(n_records=10000):
-    """Generate sample UIDAI authentication data"""
+def generate_sample_data_legacy(n_records=10000):
+    """Generate sample UIDAI authentication data one record at a time"""
     
     records = []
     start_date = datetime.now() - timedelta(days=365)
@@ -121,31 +125,147 @@ def generate_sample_data(n_records=10000):
     df = pd.DataFrame(records)
     return df
 
+GENDERS = ["male", "female", "other"]
+WINTER_MONTHS = [11, 12, 1, 2]
+HIGH_RISK_STATES = ["Bihar", "Rajasthan", "Uttar Pradesh"]
+LOW_QUALITY_DEVICES = ["UIDAI_Device_C", "UIDAI_Device_D"]
+
+def generate_sample_chunks(n_records=10000, chunk_size=1_000_000, seed=None, start_date=None):
+    """
+    Generate sample UIDAI authentication data as DataFrame chunks
+
+    Every column is drawn as a NumPy array, using the same failure model as
+    generate_sample_data_legacy. Pass `seed` (and `start_date`) to make the
+    output reproducible.
+    """
+    rng = np.random.default_rng(seed)
+    if start_date is None:
+        start_date = datetime.now() - timedelta(days=365)
+    start = np.datetime64(pd.Timestamp(start_date), 'us')
+
+    district_names = sorted({district for state in STATES for district in DISTRICTS[state]})
+    district_codes = np.array([[district_names.index(d) for d in DISTRICTS[state]] for state in STATES])
+    failure_reasons = FAILURE_REASONS[:-1]
+
+    high_risk_states = np.isin(STATES, HIGH_RISK_STATES)
+    low_quality_devices = np.isin(DEVICE_MODELS, LOW_QUALITY_DEVICES)
+    elderly = AGE_GROUPS.index("elderly")
+    young = AGE_GROUPS.index("young")
+    fingerprint = BIOMETRIC_TYPES.index("fingerprint")
+
+    remaining = n_records
+    while remaining > 0:
+        n = min(chunk_size, remaining)
+        remaining -= n
+
+        # Random timestamp
+        days_offset = rng.integers(0, 366, n)
+        hours_offset = rng.integers(0, 24, n)
+        timestamp = start + days_offset.astype('timedelta64[D]') + hours_offset.astype('timedelta64[h]')
+        month = timestamp.astype('datetime64[M]').astype(np.int64) % 12 + 1
+
+        # Random state and district
+        state = rng.integers(0, len(STATES), n)
+        district = rng.integers(0, district_codes.shape[1], n)
+
+        # Random demographics
+        age_group = rng.choice(len(AGE_GROUPS), size=n, p=[0.3, 0.5, 0.2])
+        gender = rng.integers(0, len(GENDERS), n)
+
+        # Biometric type with some correlation to age (elderly prefer iris)
+        fingerprint_weight = np.where(age_group == elderly, 0.4, 0.5)
+        biometric_type = np.where(rng.random(n) < fingerprint_weight, fingerprint, 1 - fingerprint)
+
+        # Device model
+        device_model = rng.integers(0, len(DEVICE_MODELS), n)
+
+        # Failure probability based on various factors
+        base_failure_rate = np.full(n, 0.15)
+        base_failure_rate += np.where(age_group == elderly, 0.1, 0.0)
+        base_failure_rate -= np.where(age_group == young, 0.02, 0.0)
+        base_failure_rate += np.where(biometric_type == fingerprint, 0.05, 0.0)
+        base_failure_rate += np.where(low_quality_devices[device_model], 0.08, 0.0)
+        base_failure_rate += np.where(np.isin(month, WINTER_MONTHS), 0.05, 0.0)
+        base_failure_rate += np.where(high_risk_states[state], 0.05, 0.0)
+
+        # Determine success/failure, failure reason and retries
+        failed = rng.random(n) < base_failure_rate
+        failure_reason = np.where(failed, rng.integers(0, len(failure_reasons), n), -1)
+        attempt_count = np.where(failed & (rng.random(n) < 0.3), rng.integers(2, 5, n), 1)
+
+        yield pd.DataFrame({
+            "auth_timestamp": timestamp,
+            "state": pd.Categorical.from_codes(state, STATES),
+            "district": pd.Categorical.from_codes(district_codes[state, district], district_names),
+            "age_group": pd.Categorical.from_codes(age_group, AGE_GROUPS),
+            "gender": pd.Categorical.from_codes(gender, GENDERS),
+            "biometric_type": pd.Categorical.from_codes(biometric_type, BIOMETRIC_TYPES),
+            "device_model": pd.Categorical.from_codes(device_model, DEVICE_MODELS),
+            "auth_result": pd.Categorical.from_codes(failed.astype(np.int8), ["success", "failure"]),
+            "failure_reason": pd.Categorical.from_codes(failure_reason, failure_reasons),
+            "attempt_count": attempt_count
+        })
+
+def generate_sample_data(n_records=10000, seed=None, start_date=None):
+    """Generate sample UIDAI authentication data"""
+    chunks = list(generate_sample_chunks(n_records, chunk_size=n_records, seed=seed, start_date=start_date))
+    if not chunks:
+        return pd.DataFrame(columns=["auth_timestamp", "state", "district", "age_group", "gender", "biometric_type",
+                                     "device_model", "auth_result", "failure_reason", "attempt_count"])
+    return pd.concat(chunks, ignore_index=True)
+
+def _summarize_chunk(chunk):
+    """Attempt and failure counts overall and per age group / biometric type"""
+    failed = (chunk['auth_result'] == 'failure').astype(np.int64)
+    parts = [pd.DataFrame({"attempts": [len(chunk)], "failures": [failed.sum()]},
+                          index=pd.MultiIndex.from_tuples([("all", "all")]))]
+    for column in ['age_group', 'biometric_type']:
+        counts = failed.groupby(chunk[column], observed=True).agg(['size', 'sum'])
+        counts.columns = ["attempts", "failures"]
+        counts.index = pd.MultiIndex.from_product([[column], counts.index])
+        parts.append(counts)
+    return pd.concat(parts)
+
+def write_sample_data(output_file, n_records=10000, chunk_size=1_000_000, seed=None, start_date=None):
+    """Stream generated chunks to a CSV file and return summary attempt/failure counts"""
+    summaries = []
+    for i, chunk in enumerate(generate_sample_chunks(n_records, chunk_size, seed, start_date)):
+        chunk.to_csv(output_file, mode='w' if i == 0 else 'a', header=(i == 0), index=False,
+                     date_format=CSV_DATE_FORMAT)
+        summaries.append(_summarize_chunk(chunk))
+    return pd.concat(summaries).groupby(level=[0, 1]).sum()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate sample UIDAI authentication data")
+    parser.add_argument("--rows", type=int, default=15000, help="Number of records to generate")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="Records generated and written per chunk")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible output")
+    parser.add_argument("--start-date", default=None, help="First day of the generated year (YYYY-MM-DD)")
+    parser.add_argument("--output", default="data/uidai_sample_data.csv", help="CSV file to write")
+    args = parser.parse_args()
+
     print("Generating sample UIDAI dataset...")
-    df = generate_sample_data(n_records=15000)
     
     # Create directories
-    import os
-    os.makedirs("data", exist_ok=True)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
     os.makedirs("models", exist_ok=True)
     
     # Save to CSV
-    output_file = "data/uidai_sample_data.csv"
-    df.to_csv(output_file, index=False)
-    print(f"Generated {len(df)} records")
-    print(f"Saved to {output_file}")
+    stats = write_sample_data(args.output, args.rows, args.chunk_size, args.seed, args.start_date)
+    print(f"Generated {args.rows} records")
+    print(f"Saved to {args.output}")
+    if args.rows == 0:
+        raise SystemExit(0)
+    
+    rates = (stats['failures'] / stats['attempts'] * 100)
     print(f"\nSample statistics:")
-    print(f"Total records: {len(df)}")
-    print(f"Failure rate: {len(df[df['auth_result'] == 'failure']) / len(df) * 100:.2f}%")
+    print(f"Total records: {args.rows}")
+    print(f"Failure rate: {rates[('all', 'all')]:.2f}%")
     print(f"\nBy age group:")
-    for age in df['age_group'].unique():
-        age_df = df[df['age_group'] == age]
-        failure_rate = len(age_df[age_df['auth_result'] == 'failure']) / len(age_df) * 100
-        print(f"  {age}: {failure_rate:.2f}%")
+    for (column, age), failure_rate in rates.items():
+        if column == 'age_group':
+            print(f"  {age}: {failure_rate:.2f}%")
     print(f"\nBy biometric type:")
-    for bio in df['biometric_type'].unique():
-        bio_df = df[df['biometric_type'] == bio]
-        failure_rate = len(bio_df[bio_df['auth_result'] == 'failure']) / len(bio_df) * 100
-        print(f"  {bio}: {failure_rate:.2f}%")
-
+    for (column, bio), failure_rate in rates.items():
+        if column == 'biometric_type':
+            print(f"  {bio}: {failure_rate:.2f}%")
@@ -0,0 +1,330 @@
+"""
+Model-backed failure prediction for /api/predict
+
+The engine wraps a model and its category vocabularies loaded by
+model_store, encodes request categoricals through precomputed lookup tables,
+micro-batches concurrent requests into single predict_proba calls and keeps
+an LRU cache of probabilities keyed by the encoded feature tuple. Optionally
+the model is compiled into a DecisionTable and predictions become array
+lookups.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+CATEGORICAL_FEATURES = ['age_group', 'biometric_type', 'device_model', 'state', 'gender']
+TIME_FEATURES = ['month', 'day_of_week', 'hour']
+MODEL_FEATURES = CATEGORICAL_FEATURES + TIME_FEATURES
+# Inclusive ranges of the time features
+TIME_RANGES = {'month': (1, 12), 'day_of_week': (0, 6), 'hour': (0, 23)}
+
+class UnknownCategoryError(ValueError):
+    """Raised when a request carries a categorical value the model was not trained on"""
+
+    def __init__(self, feature, value):
+        super().__init__(f"Unknown {feature}: {value}")
+        self.feature = feature
+        self.value = value
+
+class LRUCache:
+    """Thread-safe least-recently-used mapping with a fixed capacity"""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class MicroBatcher:
+    """
+    Collect concurrent prediction requests into single model calls
+
+    Requests submitted within `max_wait_ms` of each other (up to
+    `max_batch_size` rows) are stacked into one matrix and scored with one
+    call to `predict_fn`, which runs on the default executor so the event
+    loop stays responsive.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=512, max_wait_ms=2.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._worker = None
+        self._closed = False
+
+    async def submit(self, rows):
+        """Score a 2-D array of encoded rows and return their probabilities"""
+        if self._closed:
+            # Stragglers after close() are scored on their own
+            return await asyncio.get_running_loop().run_in_executor(None, self.predict_fn, rows)
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, future))
+        return await future
+
+    async def close(self):
+        """Stop the worker once the requests already queued have been scored"""
+        self._closed = True
+        if self._worker is not None and not self._worker.done():
+            await self._queue.put(None)
+            await self._worker
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            matrix = np.vstack([rows for rows, _ in batch])
+            try:
+                probabilities = await loop.run_in_executor(None, self.predict_fn, matrix)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for rows, future in batch:
+                if not future.done():
+                    future.set_result(probabilities[offset:offset + len(rows)])
+                offset += len(rows)
+
+class DecisionTable:
+    """
+    Failure probability of every encoded feature combination
+
+    The model's input space is small and discrete, so it can be compiled
+    into a dense float32 array indexed by (age_group, biometric_type,
+    device_model, state, gender, month - 1, day_of_week, hour) codes: about
+    2.2M entries (9 MB) for the sample data's vocabularies. An extra gender
+    slot holds the mean over genders for requests without one. Predictions
+    are then array indexing; rows outside the table (time features out of
+    range) are left to the model.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.flat = table.reshape(-1)
+        # Valid code ranges; the last gender slot is the mean and not a valid code
+        self.sizes = np.array(table.shape[:4] + (table.shape[4] - 1,) + table.shape[5:])
+        self.offsets = np.array([0] * len(CATEGORICAL_FEATURES) + [low for low, _ in TIME_RANGES.values()])
+        self.strides = np.array(table.strides) // table.itemsize
+        # Per feature (offset, size, stride, code when missing) as plain ints for single lookups
+        gender = CATEGORICAL_FEATURES.index('gender')
+        self._axes = [(int(offset), int(size), int(stride), int(size) if i == gender else None)
+                      for i, (offset, size, stride) in enumerate(zip(self.offsets, self.sizes, self.strides))]
+
+    @classmethod
+    def compile(cls, model, vocab, chunk_rows=1_000_000):
+        """Score every feature combination with the model"""
+        shape = tuple(len(vocab[feature]) for feature in CATEGORICAL_FEATURES) + tuple(
+            high - low + 1 for low, high in TIME_RANGES.values())
+        offsets = np.array([0] * len(CATEGORICAL_FEATURES) + [low for low, _ in TIME_RANGES.values()],
+                           dtype=np.float32)
+        size = int(np.prod(shape))
+        probabilities = np.empty(size, dtype=np.float32)
+        for start in range(0, size, chunk_rows):
+            codes = np.unravel_index(np.arange(start, min(start + chunk_rows, size)), shape)
+            matrix = np.column_stack(codes).astype(np.float32) + offsets
+            probabilities[start:start + len(matrix)] = model.predict_proba(matrix)[:, 1]
+        table = probabilities.reshape(shape)
+        gender = CATEGORICAL_FEATURES.index('gender')
+        return cls(np.concatenate([table, table.mean(axis=gender, keepdims=True)], axis=gender))
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a saved table, so processes loading it share its pages"""
+        return cls(np.load(path, mmap_mode='r'))
+
+    def save(self, file):
+        """Write the table in .npy format to a path or open file"""
+        np.save(file, np.ascontiguousarray(self.table))
+
+    def lookup(self, key):
+        """Probability for a resolved feature tuple (see InferenceEngine.resolve), or None if out of range"""
+        flat = 0
+        for code, (offset, size, stride, missing) in zip(key, self._axes):
+            if code is None:
+                code = missing
+            else:
+                code -= offset
+                if not 0 <= code < size:
+                    return None
+            flat += code * stride
+        return float(self.flat[flat])
+
+    def lookup_matrix(self, matrix):
+        """(probabilities, in_range) for the rows of an encoded feature matrix; out-of-range rows are 0"""
+        codes = matrix.astype(np.intp) - self.offsets
+        in_range = ((codes >= 0) & (codes < self.sizes)).all(axis=1)
+        flat = np.where(in_range, codes @ self.strides, 0)
+        return np.where(in_range, self.flat[flat], np.float32(0)), in_range
+
+    def max_error(self, model, rows=1000, seed=0):
+        """Largest difference from the model's predict_proba over random in-range rows"""
+        rng = np.random.default_rng(seed)
+        matrix = (rng.integers(0, self.sizes, (rows, len(self.sizes))) + self.offsets).astype(np.float32)
+        return float(np.abs(self.lookup_matrix(matrix)[0] - model.predict_proba(matrix)[:, 1]).max())
+
+class InferenceEngine:
+    """Failure probability predictions from the trained XGBoost model"""
+
+    def __init__(self, model, vocab, cache_size=4096, max_batch_size=512, max_wait_ms=2.0, table=None):
+        self.model = model
+        self.table = table
+        self.vocab = {feature: [str(value) for value in vocab[feature]] for feature in CATEGORICAL_FEATURES}
+        self.lookup = {feature: {value: code for code, value in enumerate(values)}
+                       for feature, values in self.vocab.items()}
+        self.cache = LRUCache(cache_size)
+        self.batcher = MicroBatcher(self.predict_matrix, max_batch_size, max_wait_ms)
+
+    def resolve(self, features, now=None):
+        """
+        Fill in optional features and return the feature tuple used as cache key
+
+        A missing gender is averaged over every gender the model knows; missing
+        month, day_of_week or hour default to the current time.
+        """
+        now = now or datetime.now()
+        defaults = {'month': now.month, 'day_of_week': now.weekday(), 'hour': now.hour}
+        key = []
+        for feature in CATEGORICAL_FEATURES:
+            value = features.get(feature)
+            if value is None and feature == 'gender':
+                key.append(None)
+                continue
+            if value not in self.lookup[feature]:
+                raise UnknownCategoryError(feature, value)
+            key.append(self.lookup[feature][value])
+        for feature in TIME_FEATURES:
+            value = features.get(feature)
+            key.append(defaults[feature] if value is None else int(value))
+        return tuple(key)
+
+    def encode(self, key):
+        """Expand a resolved feature tuple into the model input rows it averages over"""
+        genders = range(len(self.vocab['gender'])) if key[4] is None else [key[4]]
+        rows = np.empty((len(genders), len(MODEL_FEATURES)), dtype=np.float32)
+        rows[:] = [code if code is not None else 0 for code in key]
+        rows[:, 4] = list(genders)
+        return rows
+
+    def encode_frame(self, frame, now=None):
+        """
+        Encode a frame of request rows into a model input matrix
+
+        Returns (matrix, row_index), where row_index maps each matrix row back
+        to its input row: rows without a gender expand to one row per gender.
+        Optional features follow the same defaults as resolve().
+        """
+        now = now or datetime.now()
+        defaults = {'month': now.month, 'day_of_week': now.weekday(), 'hour': now.hour}
+        n = len(frame)
+        matrix = np.empty((n, len(MODEL_FEATURES)), dtype=np.float32)
+        for i, feature in enumerate(CATEGORICAL_FEATURES):
+            values = frame[feature] if feature in frame else pd.Series(None, index=frame.index, dtype=object)
+            codes = pd.Categorical(values, categories=self.vocab[feature]).codes
+            unknown = codes < 0
+            if feature == 'gender':
+                unknown &= values.notna().to_numpy()
+            if unknown.any():
+                raise UnknownCategoryError(feature, values[unknown].iloc[0])
+            matrix[:, i] = codes
+        for i, feature in enumerate(TIME_FEATURES, start=len(CATEGORICAL_FEATURES)):
+            values = frame[feature] if feature in frame else pd.Series(np.nan, index=frame.index)
+            matrix[:, i] = pd.to_numeric(values).fillna(defaults[feature]).to_numpy()
+
+        gender = CATEGORICAL_FEATURES.index('gender')
+        missing = np.flatnonzero(matrix[:, gender] < 0)
+        if len(missing) == 0:
+            return matrix, np.arange(n)
+        n_genders = len(self.vocab['gender'])
+        expanded = np.repeat(matrix[missing], n_genders, axis=0)
+        expanded[:, gender] = np.tile(np.arange(n_genders), len(missing))
+        known = np.flatnonzero(matrix[:, gender] >= 0)
+        return (np.vstack([matrix[known], expanded]),
+                np.concatenate([known, np.repeat(missing, n_genders)]))
+
+    def predict_frame(self, frame):
+        """Failure probability (0-1) for every row of a frame of request features"""
+        matrix, row_index = self.encode_frame(frame)
+        probabilities = self.predict_matrix(matrix) if len(matrix) else np.empty(0)
+        sums = np.bincount(row_index, weights=probabilities, minlength=len(frame))
+        counts = np.bincount(row_index, minlength=len(frame))
+        return sums / np.maximum(counts, 1)
+
+    def predict_matrix(self, matrix):
+        """Failure probability for each row of an encoded feature matrix"""
+        if self.table is None:
+            return self.model.predict_proba(matrix)[:, 1]
+        probabilities, in_range = self.table.lookup_matrix(matrix)
+        if not in_range.all():
+            probabilities[~in_range] = self.model.predict_proba(matrix[~in_range])[:, 1]
+        return probabilities
+
+    async def close(self):
+        """Finish queued predictions and stop the micro-batching worker"""
+        await self.batcher.close()
+
+    async def predict(self, features):
+        """Failure probability (0-1) for a dict of request features"""
+        key = self.resolve(features)
+        if self.table is not None:
+            probability = self.table.lookup(key)
+            if probability is not None:
+                return probability
+        probability = self.cache.get(key)
+        if probability is None:
+            probability = float(np.mean(await self.batcher.submit(self.encode(key)), dtype=np.float64))
+            self.cache.put(key, probability)
+        return probability
@@ -0,0 +1,107 @@
+"""
+Incremental ingestion of authentication events
+
+Batches arrive through POST /api/ingest or by tailing a CSV/NDJSON file that
+another process appends to. Each batch is normalised to the storage columns
+before being appended to the in-memory event store and folded into the
+aggregate cube.
+"""
+import asyncio
+import io
+import json
+import os
+import warnings
+
+import pandas as pd
+
+from storage import EVENT_COLUMNS
+
+def events_frame(rows):
+    """
+    Build a storage-shaped events frame from a list of event dicts or a DataFrame
+
+    Timezone-aware timestamps are converted to UTC and all timestamps are
+    stored naive, like those of the dataset.
+    """
+    frame = pd.DataFrame(rows, columns=EVENT_COLUMNS)
+    frame['auth_timestamp'] = pd.to_datetime(frame['auth_timestamp'], utc=True).dt.tz_localize(None)
+    frame['attempt_count'] = frame['attempt_count'].fillna(1).astype('int64')
+    return frame
+
+class FileTailer:
+    """
+    Follow a growing CSV or NDJSON file and return newly appended events
+
+    Reading starts at the current end of the file, like `tail -f`, so a
+    restart does not re-ingest events that were already persisted. Only
+    complete lines are consumed; a partially written last line is kept for
+    the next poll. Lines that cannot be parsed into events are reported and
+    skipped without losing the rest of their batch.
+    """
+
+    def __init__(self, path, from_start=False):
+        self.path = path
+        self.ndjson = path.endswith(('.ndjson', '.jsonl'))
+        self.header = None
+        self.position = None if not from_start else 0
+        self._pending = b""
+
+    def _read_header(self, f):
+        f.seek(0)
+        self.header = f.readline().decode().strip()
+        return f.tell()
+
+    def poll(self):
+        """Return a frame of events appended since the last poll (possibly empty)"""
+        if not os.path.exists(self.path):
+            return events_frame([])
+        with open(self.path, 'rb') as f:
+            header_end = 0 if self.ndjson else self._read_header(f)
+            size = os.fstat(f.fileno()).st_size
+            if self.position is None or self.position > size:
+                # First poll, or the file was truncated/rotated
+                self.position = size if self.position is None else header_end
+                self._pending = b""
+            self.position = max(self.position, header_end)
+            f.seek(self.position)
+            data = self._pending + f.read()
+            self.position = f.tell()
+
+        complete, _, self._pending = data.rpartition(b"\n")
+        lines = [line for line in complete.splitlines() if line.strip()]
+        if not lines:
+            return events_frame([])
+        try:
+            return self._parse(lines)
+        except (ValueError, TypeError, pd.errors.ParserWarning):
+            pass
+        # Some line is malformed: parse them one by one to keep the others
+        frames = []
+        for line in lines:
+            try:
+                frames.append(self._parse([line]))
+            except (ValueError, TypeError, pd.errors.ParserWarning) as e:
+                print(f"Warning: Skipping malformed line in {self.path} ({e}): {line[:200]!r}")
+        return pd.concat(frames, ignore_index=True) if frames else events_frame([])
+
+    def _parse(self, lines):
+        """Events frame of complete lines (bytes without their newline)"""
+        if self.ndjson:
+            return events_frame([json.loads(line) for line in lines])
+        text = "\n".join([self.header] + [line.decode() for line in lines])
+        with warnings.catch_warnings():
+            # Fields beyond the header's would otherwise be dropped silently
+            warnings.simplefilter("error", pd.errors.ParserWarning)
+            return events_frame(pd.read_csv(io.StringIO(text), index_col=False))
+
+async def tail_file(path, ingest, interval=1.0):
+    """Poll `path` every `interval` seconds and pass new event batches to `ingest`"""
+    tailer = FileTailer(path)
+    while True:
+        try:
+            batch = await asyncio.to_thread(tailer.poll)
+            if len(batch):
+                await ingest(batch)
+        except Exception as e:
+            print(f"Warning: Could not ingest from {path}: {e}")
+        await asyncio.sleep(interval)
@@ -1,16 +1,51 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List, Dict
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator
+from starlette.requests import ClientDisconnect
+from typing import Optional, List, Dict, Literal
 import pandas as pd
 import numpy as np
-import pickle
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+import asyncio
+import functools
 import json
 
+import analytics
+import metrics
+import model_store
+from anomaly import AnomalyDetector
+from approx import ApproxIndex
+from cube import AggregateCube
+from duckdb_queries import DuckDBQueries
+from event_store import EARLIEST_TIMESTAMP, LATEST_TIMESTAMP, EventChunk, EventStore
+from executors import AnalyticsExecutor
+from explain import EXPLANATIONS_NAME, Explainer
+from inference import InferenceEngine, UnknownCategoryError
+from ingest import events_frame, tail_file
+from response_cache import ResponseCache
+from risk_index import RiskIndex, index_cell_limit
+from snapshot import SnapshotMiddleware, SnapshotStore, dataset_stamp
+from timeseries import GRANULARITIES, SERIES_DIMENSIONS, TimeSeriesStore, series_cell_limit
+from storage import CSV_DATE_FORMAT, add_derived_columns, release_memory, write_dataset
+
 app = FastAPI(title="UIDAI Biometric Dashboard API")
 
+# Request latency, per-stage timings and memory per request, served on
+# /metrics; METRICS_TRACEMALLOC=1 also traces allocations, at a cost
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_TRACEMALLOC = os.environ.get("METRICS_TRACEMALLOC", "0") == "1"
+
+# Start the sampling profiler at startup (it can also be switched on and off
+# with POST /api/profiler), sampling every PROFILER_INTERVAL_MS
+PROFILER = os.environ.get("PROFILER", "0") == "1"
+PROFILER_INTERVAL_MS = float(os.environ.get("PROFILER_INTERVAL_MS", "5"))
+
+if METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware, trace_allocations=METRICS_TRACEMALLOC)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -22,13 +57,81 @@ app.add_middleware(
 
 # Load data and models
 DATA_FILE = "data/uidai_sample_data.csv"
-MODEL_FILE = "models/biometric_model.pkl"
-SHAP_EXPLAINER_FILE = "models/shap_explainer.pkl"
+PARQUET_DATA_DIR = "data/uidai_parquet"
+MODELS_DIR = "models"
+
+# Rows scored per vectorized pass when streaming NDJSON batch predictions
+BATCH_CHUNK_ROWS = 10000
+
+# Ingestion: optionally follow a CSV/NDJSON file, and append ingested batches
+# to the dataset on disk so they survive a restart
+INGEST_TAIL_FILE = os.environ.get("INGEST_TAIL_FILE")
+INGEST_TAIL_INTERVAL = float(os.environ.get("INGEST_TAIL_INTERVAL", "1.0"))
+INGEST_PERSIST = os.environ.get("INGEST_PERSIST", "1") == "1"
+
+# Analytics run on a "thread" or "process" pool; the process pool reads the
+# cube from shared memory
+ANALYTICS_EXECUTOR = os.environ.get("ANALYTICS_EXECUTOR", "thread")
+ANALYTICS_WORKERS = int(os.environ.get("ANALYTICS_WORKERS", "0")) or None
+
+# Analytics answer from the in-memory aggregate "cube", or from "duckdb"
+# running SQL over the files on disk without loading them into memory
+QUERY_BACKEND = os.environ.get("QUERY_BACKEND", "cube")
+DUCKDB_THREADS = int(os.environ.get("DUCKDB_THREADS", "0")) or None
+
+# Compile the model into a dense lookup table over every feature combination
+# (see inference.DecisionTable) so predictions are array indexing
+PREDICT_TABLE = os.environ.get("PREDICT_TABLE", "0") == "1"
+
+# Seconds between checks for a newly published model version (0 to disable)
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", "30"))
+
+# Multi-worker mode: one worker at a time loads the dataset (or merges an
+# ingested batch) and publishes it with the aggregates and anomaly detector
+# as a numbered snapshot in SNAPSHOT_DIR (best on tmpfs, e.g. /dev/shm/uidai),
+# which every worker memory-maps; SNAPSHOT_KEEP generations are kept
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR")
+SNAPSHOT_KEEP = int(os.environ.get("SNAPSHOT_KEEP", "4"))
+
+# Approximate analytics (?approx=true on /api/kpis, /api/risk-zones and
+# /api/trends): events sampled per (state, device model) stratum, 0 to
+# disable, and the sampled events below which a group is computed exactly
+APPROX_SAMPLE_SIZE = int(os.environ.get("APPROX_SAMPLE_SIZE", "8192"))
+APPROX_MIN_SAMPLES = int(os.environ.get("APPROX_MIN_SAMPLES", "100"))
+
+# Rendered analytics responses kept per endpoint, params and dataset version
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "512"))
+
+# Most recent stored events replayed into the anomaly detector on load, and
+# seconds between keep-alive comments on the insights event stream
+ANOMALY_WARMUP_EVENTS = int(os.environ.get("ANOMALY_WARMUP_EVENTS", "1000000"))
+INSIGHTS_KEEPALIVE = float(os.environ.get("INSIGHTS_KEEPALIVE", "15"))
+
+# Columns the API reads from storage
+DATASET_COLUMNS = ['auth_timestamp', 'state', 'district', 'age_group', 'gender',
+                   'biometric_type', 'device_model', 'auth_result']
 
 # Global variables for data and models
-df = None
+events = None
+cube = None
+risk_index = None
+timeseries_store = None
+queries = None
+approx_index = None
+anomaly_detector = AnomalyDetector()
 model = None
-shap_explainer = None
+engine = None
+model_manifest = None
+explainer = None
+snapshots = SnapshotStore(SNAPSHOT_DIR, SNAPSHOT_KEEP) if SNAPSHOT_DIR else None
+snapshot = None
+
+analytics_executor = AnalyticsExecutor(ANALYTICS_EXECUTOR, ANALYTICS_WORKERS)
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+profiler = metrics.SamplingProfiler(PROFILER_INTERVAL_MS / 1000)
+
+# Queues of the clients following /api/insights/stream
+_insight_subscribers = set()
 
 class PredictionRequest(BaseModel):
     age_group: str
@@ -36,26 +139,333 @@ class PredictionRequest(BaseModel):
     device_model: str
     state: str
     district: Optional[str] = None
+    gender: Optional[str] = None
+    month: Optional[int] = Field(None, ge=1, le=12)
+    day_of_week: Optional[int] = Field(None, ge=0, le=6)
+    hour: Optional[int] = Field(None, ge=0, le=23)
+
+class AuthEvent(BaseModel):
+    auth_timestamp: datetime
+    state: str
+    district: str
+    age_group: str
+    gender: str
+    biometric_type: str
+    device_model: str
+    auth_result: Literal['success', 'failure']
+    failure_reason: Optional[str] = None
+    attempt_count: int = 1
+
+    @field_validator('auth_timestamp')
+    @classmethod
+    def storable_timestamp(cls, value):
+        """Convert to naive UTC and check the event store can hold the timestamp"""
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        if not EARLIEST_TIMESTAMP <= value <= LATEST_TIMESTAMP:
+            raise ValueError(f"auth_timestamp must be between {EARLIEST_TIMESTAMP} and {LATEST_TIMESTAMP}")
+        return value
+
+_auth_events = TypeAdapter(List[AuthEvent])
+
+# Serialises ingest batches so cube merges apply one at a time
+_ingest_lock = asyncio.Lock()
+
+def _data_path():
+    return PARQUET_DATA_DIR if os.path.isdir(PARQUET_DATA_DIR) else DATA_FILE
+
+def _load_sources(data_path):
+    """
+    (events, sources, detector) for the dataset at data_path: the events as
+    one compact EventChunk (None for DuckDB), the query sources by executor
+    key and an anomaly detector warmed up on recent history
+    """
+    if QUERY_BACKEND == "duckdb":
+        duckdb_queries = DuckDBQueries(data_path, DUCKDB_THREADS)
+        data = None
+        sources = {"queries": duckdb_queries, "zones": duckdb_queries,
+                   "timeseries": TimeSeriesStore.from_hourly_counts(duckdb_queries.hourly_counts(SERIES_DIMENSIONS))}
+        recent = duckdb_queries.latest_events(DATASET_COLUMNS, ANOMALY_WARMUP_EVENTS)
+    else:
+        # The aggregates are built from the chunk's codes; no frame of the dataset is kept
+        data = EventChunk.load(data_path)
+        sources = {"queries": AggregateCube.from_events(data), "zones": RiskIndex.from_events(data),
+                   "timeseries": TimeSeriesStore.from_events(data)}
+        recent = data.recent(ANOMALY_WARMUP_EVENTS)
+    if APPROX_SAMPLE_SIZE > 0:
+        # DuckDB keeps no events in memory, so the samples are drawn while streaming the dataset
+        sources["approx"] = (ApproxIndex.from_events(data, sample_size=APPROX_SAMPLE_SIZE) if data is not None else
+                             ApproxIndex.from_chunks(EventChunk.read(data_path), APPROX_SAMPLE_SIZE))
+    # Replay recent history so baselines are established before new events arrive
+    detector = AnomalyDetector()
+    detector.update(recent)
+    del recent
+    release_memory()
+    return data, sources, detector
+
+def _use_sources(sources, detector, event_store=None, handles=None):
+    """Serve from `sources`, handing the analytics executor `handles` in their place where given"""
+    global events, cube, risk_index, timeseries_store, queries, approx_index, anomaly_detector
+    queries, timeseries_store = sources["queries"], sources["timeseries"]
+    approx_index = sources.get("approx")
+    cube = queries if isinstance(queries, AggregateCube) else None
+    risk_index = sources["zones"] if isinstance(sources["zones"], RiskIndex) else None
+    events = event_store
+    anomaly_detector = detector
+    for key, source in sources.items():
+        analytics_executor.publish((handles or {}).get(key, source), key)
+    response_cache.bump()
+
+def load_dataset(reuse_snapshot=False):
+    """
+    Load the dataset and rebuild the aggregates (or point DuckDB at it)
+
+    In multi-worker mode the result is published as a new snapshot
+    generation instead; with `reuse_snapshot` (at startup) a current
+    snapshot of the same dataset, published by another worker, is used as is.
+    """
+    data_path = _data_path()
+    if not os.path.exists(data_path):
+        return
+    if snapshots is not None:
+        with snapshots.lock():
+            if not (reuse_snapshot and _snapshot_is_current(data_path)):
+                data, sources, detector = _load_sources(data_path)
+                rows = len(data) if data is not None else sources["queries"].totals()[0]
+                snapshots.publish(_snapshot_sources(sources), detector, [data] if data is not None else [], rows,
+                                  info={"backend": QUERY_BACKEND, "dataset": dataset_stamp(data_path),
+                                        "persisted": True})
+        _attach_snapshot()
+        return
+    data, sources, detector = _load_sources(data_path)
+    _use_sources(sources, detector, EventStore([data]) if data is not None else None)
+
+def _snapshot_sources(sources):
+    """The sources that live in a snapshot; DuckDB reads the files on disk in every worker"""
+    return {key: source for key, source in sources.items() if hasattr(source, "shared_arrays")}
+
+def _snapshot_is_current(data_path):
+    """Whether the current snapshot holds exactly the dataset on disk, as this backend loads it"""
+    manifest = snapshots.manifest()
+    return (manifest is not None and manifest["backend"] == QUERY_BACKEND and manifest["persisted"]
+            and manifest["dataset"] == dataset_stamp(data_path))
+
+def _attach_snapshot():
+    """
+    Switch to the current snapshot generation
+
+    Returns the anomaly detector changes of the generations skipped over,
+    for the clients of /api/insights/stream connected to this worker.
+    """
+    global snapshot
+    new_snapshot = snapshots.attach()
+    if new_snapshot is None or (snapshot is not None and new_snapshot.generation == snapshot.generation):
+        return []
+    sources = dict(new_snapshot.sources)
+    if QUERY_BACKEND == "duckdb":
+        sources["queries"] = sources["zones"] = DuckDBQueries(_data_path(), DUCKDB_THREADS)
+    # Process pool workers map the snapshot files themselves
+    handles = ({key: new_snapshot.handle(key) for key in new_snapshot.sources}
+               if analytics_executor.kind == "process" else None)
+    changes = snapshots.changes(snapshot.generation, new_snapshot.generation) if snapshot is not None else []
+    _use_sources(sources, new_snapshot.detector, handles=handles)
+    snapshot = new_snapshot
+    return changes
+
+# Serialises snapshot switches within this worker
+_snapshot_lock = asyncio.Lock()
+
+async def sync_snapshot():
+    """Switch to the newest snapshot generation if another worker (or this one) published it"""
+    if snapshots.generation() == (snapshot.generation if snapshot is not None else 0):
+        return
+    async with _snapshot_lock:
+        _publish_insights(await run_in_threadpool(_attach_snapshot))
+
+if snapshots is not None:
+    app.add_middleware(SnapshotMiddleware, sync=sync_snapshot)
+
+def _persist_batch(batch):
+    """Append an ingested batch to the dataset the API loads on startup"""
+    data_path = _data_path()
+    if os.path.isdir(data_path):
+        write_dataset(batch, data_path)
+    else:
+        os.makedirs(os.path.dirname(data_path) or ".", exist_ok=True)
+        batch.to_csv(data_path, mode='a', header=not os.path.exists(data_path), index=False,
+                     date_format=CSV_DATE_FORMAT)
+
+def _event_count():
+    if snapshot is not None:
+        return snapshot.rows
+    if events is not None:
+        return len(events)
+    return queries.totals()[0] if queries is not None else 0
+
+async def ingest_batch(batch):
+    """
+    Append a batch of events and fold it into the aggregate cube
+
+    Only the batch is aggregated; the cube merge costs O(cells) and the
+    global cube reference is swapped once the merged cube is ready, so
+    readers never see a partial update. The DuckDB backend reads the
+    dataset on disk, so batches are always persisted and only the hourly
+    time series is kept in memory.
+    """
+    global events, cube, risk_index, timeseries_store, queries, approx_index
+    if snapshots is not None:
+        async with _ingest_lock:
+            await run_in_threadpool(_ingest_snapshot, batch)
+        await sync_snapshot()
+        return
+    async with _ingest_lock:
+        derived = add_derived_columns(batch[DATASET_COLUMNS].copy())
+        # Encode and aggregate the batch first: a batch that cannot be stored
+        # raises here, before it is persisted or seen by the anomaly detector
+        chunk = await run_in_threadpool(EventChunk.from_frame, derived)
+        batch_series = await run_in_threadpool(TimeSeriesStore.from_events, chunk, series_cell_limit(timeseries_store))
+        new_series = batch_series if timeseries_store is None else await run_in_threadpool(timeseries_store.merge, batch_series)
+        new_approx = None
+        if APPROX_SAMPLE_SIZE > 0:
+            offset = len(approx_index) if approx_index is not None else 0
+            batch_approx = await run_in_threadpool(ApproxIndex.from_events, chunk, offset, APPROX_SAMPLE_SIZE)
+            new_approx = batch_approx if approx_index is None else await run_in_threadpool(approx_index.merge, batch_approx)
+        if QUERY_BACKEND != "duckdb":
+            offset = len(events) if events is not None else 0
+            batch_cube = await run_in_threadpool(AggregateCube.from_events, chunk, offset)
+            batch_index = await run_in_threadpool(RiskIndex.from_events, chunk, offset, index_cell_limit(risk_index))
+            new_cube = batch_cube if cube is None else await run_in_threadpool(cube.merge, batch_cube)
+            new_index = batch_index if risk_index is None else await run_in_threadpool(risk_index.merge, batch_index)
+
+        if INGEST_PERSIST or QUERY_BACKEND == "duckdb":
+            await run_in_threadpool(_persist_batch, batch)
+        _publish_insights(await run_in_threadpool(anomaly_detector.update, derived))
+        timeseries_store = new_series
+        analytics_executor.publish(timeseries_store, "timeseries")
+        if new_approx is not None:
+            approx_index = new_approx
+            analytics_executor.publish(approx_index, "approx")
+        if QUERY_BACKEND == "duckdb":
+            # A fresh source so in-flight calls on the old data are not coalesced with new ones
+            queries = DuckDBQueries(_data_path(), DUCKDB_THREADS)
+            analytics_executor.publish(queries)
+            analytics_executor.publish(queries, "zones")
+            response_cache.bump()
+            return
+        if events is None:
+            events = EventStore()
+        events.append(chunk)
+        cube, risk_index = new_cube, new_index
+        queries = cube
+        analytics_executor.publish(queries)
+        analytics_executor.publish(risk_index, "zones")
+        response_cache.bump()
+
+def _ingest_snapshot(batch):
+    """
+    Merge a batch into the newest snapshot generation and publish the result
+
+    Runs under the snapshot lock, so batches ingested by different workers
+    are persisted and merged one at a time, each on top of the last.
+    """
+    with snapshots.lock():
+        derived = add_derived_columns(batch[DATASET_COLUMNS].copy())
+        base = snapshots.attach()
+        rows = base.rows if base is not None else 0
+        # Encoded and merged before the batch is persisted or seen by the detector, as in ingest_batch()
+        chunk = EventChunk.from_frame(derived)
+        base_sources = base.sources if base is not None else {}
+        series_limit = series_cell_limit(base_sources.get("timeseries"))
+        batch_sources = {"timeseries": TimeSeriesStore.from_events(chunk, series_limit)}
+        if QUERY_BACKEND != "duckdb":
+            index_limit = index_cell_limit(base_sources.get("zones"))
+            batch_sources.update(queries=AggregateCube.from_events(chunk, rows),
+                                 zones=RiskIndex.from_events(chunk, rows, index_limit))
+        if APPROX_SAMPLE_SIZE > 0:
+            batch_sources["approx"] = ApproxIndex.from_events(chunk, rows, APPROX_SAMPLE_SIZE)
+        sources = {key: base.sources[key].merge(source) if base is not None and key in base.sources else source
+                   for key, source in batch_sources.items()}
+        chunks = (base.chunk_files if base is not None else []) + ([chunk] if QUERY_BACKEND != "duckdb" else [])
+        persisted = INGEST_PERSIST or QUERY_BACKEND == "duckdb"
+        if persisted:
+            _persist_batch(batch)
+        detector = base.detector if base is not None else AnomalyDetector()
+        changes = detector.update(derived)
+        snapshots.publish(sources, detector, chunks, rows + len(batch), changes,
+                          info={"backend": QUERY_BACKEND,
+                                "dataset": dataset_stamp(_data_path()) if persisted else None,
+                                "persisted": persisted and (base is None or base.manifest["persisted"])})
+
+def _load_engine():
+    """Inference engine, explainer and manifest for the current model version (see model_store)"""
+    if not model_store.has_model(MODELS_DIR):
+        return None, None, None
+    new_model, vocab, manifest = model_store.load_current(MODELS_DIR)
+    table = model_store.decision_table(new_model, vocab, manifest, MODELS_DIR) if PREDICT_TABLE else None
+    explanations_file = model_store.current_file(EXPLANATIONS_NAME, MODELS_DIR)
+    return InferenceEngine(new_model, vocab, table=table), Explainer.load(new_model, explanations_file), manifest
+
+# Serialises model swaps
+_model_lock = asyncio.Lock()
+
+async def swap_model():
+    """
+    Load the current model version and swap it in if it is new
+
+    The new engine is fully loaded before the global reference changes, so
+    every request is served by either the old or the new model. The old
+    engine finishes the predictions already queued on it before it stops.
+    """
+    global model, engine, explainer, model_manifest
+    async with _model_lock:
+        manifest = model_store.read_manifest(MODELS_DIR)
+        version = manifest["version"] if manifest else None
+        if engine is not None and version == (model_manifest["version"] if model_manifest else None):
+            return False
+        new_engine, new_explainer, new_manifest = await run_in_threadpool(_load_engine)
+        if new_engine is None:
+            return False
+        old_engine, old_explainer = engine, explainer
+        engine, explainer, model, model_manifest = new_engine, new_explainer, new_engine.model, new_manifest
+    if old_engine is not None:
+        await old_engine.close()
+        await old_explainer.close()
+    return True
+
+async def watch_model(interval):
+    """Swap in newly published model versions, checking every `interval` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await swap_model():
+                print(f"Model version {model_manifest and model_manifest['version']} loaded")
+        except Exception as e:
+            print(f"Warning: Could not load the new model version: {e}")
 
 @app.on_event("startup")
 async def startup_event():
-    global df, model, shap_explainer
+    # Data and models load independently, so a dataset that fails to load does not also leave the model unloaded
     try:
-        # Load data
-        if os.path.exists(DATA_FILE):
-            df = pd.read_csv(DATA_FILE)
-            df['auth_timestamp'] = pd.to_datetime(df['auth_timestamp'])
-        
-        # Load models
-        if os.path.exists(MODEL_FILE):
-            with open(MODEL_FILE, 'rb') as f:
-                model = pickle.load(f)
-        
-        if os.path.exists(SHAP_EXPLAINER_FILE):
-            with open(SHAP_EXPLAINER_FILE, 'rb') as f:
-                shap_explainer = pickle.load(f)
+        load_dataset(reuse_snapshot=True)
+
+        if INGEST_TAIL_FILE:
+            asyncio.get_running_loop().create_task(tail_file(INGEST_TAIL_FILE, ingest_batch, INGEST_TAIL_INTERVAL))
     except Exception as e:
-        print(f"Warning: Could not load data/models: {e}")
+        print(f"Warning: Could not load data: {e}")
+
+    try:
+        await swap_model()
+        if MODEL_RELOAD_INTERVAL > 0:
+            asyncio.get_running_loop().create_task(watch_model(MODEL_RELOAD_INTERVAL))
+    except Exception as e:
+        print(f"Warning: Could not load models: {e}")
+    if PROFILER:
+        profiler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    profiler.stop()
+    analytics_executor.shutdown()
 
 @app.get("/")
 async def root():
@@ -63,88 +473,183 @@ async def root():
 
 @app.get("/api/health")
 async def health():
-    return {"status": "healthy", "data_loaded": df is not None, "model_loaded": model is not None}
+    return {"status": "healthy", "data_loaded": queries is not None, "model_loaded": model is not None,
+            "model_version": model_manifest["version"] if model_manifest else None,
+            "snapshot_generation": snapshot.generation if snapshot is not None else None}
+
+@app.get("/api/model")
+async def get_model():
+    """Manifest of the model version being served"""
+    return model_manifest or {"version": None}
+
+@app.post("/api/model/reload")
+async def reload_model():
+    """Swap in the current model version now rather than at the next check"""
+    swapped = await swap_model()
+    return {"swapped": swapped, "version": model_manifest["version"] if model_manifest else None}
+
+@app.post("/api/refresh")
+async def refresh():
+    """Reload the dataset and rebuild the aggregate cube"""
+    async with _ingest_lock:
+        await run_in_threadpool(load_dataset)
+    return {"data_loaded": queries is not None, "cube_cells": len(cube) if cube is not None else 0}
+
+@app.post("/api/ingest")
+async def ingest(request: Request):
+    """
+    Append authentication events to the live dataset
+
+    Accepts a JSON list of events (or {"events": [...]}) or an
+    application/x-ndjson body with one event per line; malformed JSON, or
+    JSON of another shape, is answered with 400 (naming the line for
+    NDJSON). KPIs, trends and risk zones reflect the batch as soon as the
+    call returns.
+    """
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        body = await request.body()
+        rows = [_parse_json(line, i) for i, line in enumerate(body.splitlines(), start=1) if line.strip()]
+    else:
+        body = _parse_json(await request.body())
+        rows = _body_rows(body, "events")
+    try:
+        validated = _auth_events.dump_python(_auth_events.validate_python(rows))
+    except ValidationError as e:
+        # The context of validator errors holds the exception itself, which is not JSON serializable
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+    batch = events_frame(validated)
+    if len(batch):
+        try:
+            await ingest_batch(batch)
+        except ValueError as e:
+            # The batch would multiply the aggregates' label combinations (see
+            # MAX_CELLS in timeseries and risk_index); nothing was stored
+            raise HTTPException(status_code=422, detail=str(e))
+    return {"ingested": len(batch), "total_events": await run_in_threadpool(_event_count)}
+
+def _service_metrics():
+    """Response cache, executor and dataset samples for /metrics"""
+    stats = response_cache.stats()
+    return [
+        ("response_cache_hits_total", "counter", "Analytics responses served from the cache", stats["hits"]),
+        ("response_cache_misses_total", "counter", "Analytics responses computed", stats["misses"]),
+        ("response_cache_not_modified_total", "counter", "304 responses to If-None-Match", stats["not_modified"]),
+        ("analytics_coalesced_total", "counter", "Analytics calls that joined an identical in-flight call",
+         analytics_executor.coalesced),
+        ("dataset_version", "gauge", "Dataset version (bumped by every reload and ingest)", stats["dataset_version"]),
+        ("model_loaded", "gauge", "Whether a model is loaded", int(model is not None)),
+        ("snapshot_generation", "gauge", "Snapshot generation served (multi-worker mode)",
+         snapshot.generation if snapshot is not None else 0),
+    ]
+
+metrics.register_collector(_service_metrics)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Request, stage and process metrics in the Prometheus text format"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+class ProfilerRequest(BaseModel):
+    enabled: bool
+    interval_ms: Optional[float] = Field(None, gt=0)
+
+@app.get("/api/profiler")
+async def get_profile(format: Literal["json", "collapsed"] = "json"):
+    """
+    Sampling profiler status, or its samples as collapsed stacks
+
+    `format=collapsed` returns one "frame;frame;... count" line per distinct
+    stack, ready for flamegraph.pl or speedscope.
+    """
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed())
+    return profiler.status()
+
+@app.post("/api/profiler")
+async def toggle_profiler(request: ProfilerRequest):
+    """Start (discarding earlier samples) or stop the sampling profiler"""
+    if request.enabled:
+        profiler.stop()
+        if request.interval_ms:
+            profiler.interval = request.interval_ms / 1000
+        profiler.start()
+    else:
+        profiler.stop()
+    return profiler.status()
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Response cache hit/miss counters"""
+    return {**response_cache.stats(), "coalesced": analytics_executor.coalesced}
+
+def _analytics_response(request, endpoint, fn, *params, source="queries"):
+    """Serve an analytics payload through the response cache and worker pool"""
+    compute = functools.partial(analytics_executor.run, endpoint, fn, source=source)
+    return response_cache.respond(request, endpoint, compute, *params)
+
+async def _approx_response(request, endpoint, fn, exact_fn, *params, source="queries"):
+    """
+    Serve an approximate analytics payload from the ApproxIndex, answering
+    the groups with too few sampled events with exact_fn on `source`
+    """
+    if APPROX_SAMPLE_SIZE <= 0:
+        raise HTTPException(status_code=400, detail="Approximate analytics are disabled (APPROX_SAMPLE_SIZE=0)")
+
+    async def compute(*params):
+        payload = await analytics_executor.run(f"{endpoint}-approx", fn, APPROX_MIN_SAMPLES, *params, source="approx")
+        if analytics.needs_exact(payload):
+            exact = await analytics_executor.run(endpoint, exact_fn, *params, source=source)
+            payload = analytics.fill_exact(payload, exact)
+        return payload
+
+    return await response_cache.respond(request, f"{endpoint}-approx", compute, *params)
 
 @app.get("/api/kpis")
-async def get_kpis():
-    """Get dashboard KPIs"""
-    if df is None:
-        return {
-            "overall_failure_rate": 0,
-            "highest_risk_district": "N/A",
-            "worst_device": "N/A",
-            "elderly_failure_delta": 0,
-            "seasonal_spike": 0
-        }
-    
-    total = len(df)
-    failures = len(df[df['auth_result'] == 'failure'])
-    failure_rate = (failures / total * 100) if total > 0 else 0
-    
-    # Highest risk district
-    district_failures = df[df['auth_result'] == 'failure'].groupby('district').size()
-    highest_risk_district = district_failures.idxmax() if len(district_failures) > 0 else "N/A"
-    
-    # Worst device
-    device_failures = df[df['auth_result'] == 'failure'].groupby('device_model').size()
-    worst_device = device_failures.idxmax() if len(device_failures) > 0 else "N/A"
-    
-    # Elderly failure delta
-    elderly_df = df[df['age_group'] == 'elderly']
-    non_elderly_df = df[df['age_group'] != 'elderly']
-    elderly_failure_rate = (len(elderly_df[elderly_df['auth_result'] == 'failure']) / len(elderly_df) * 100) if len(elderly_df) > 0 else 0
-    non_elderly_failure_rate = (len(non_elderly_df[non_elderly_df['auth_result'] == 'failure']) / len(non_elderly_df) * 100) if len(non_elderly_df) > 0 else 0
-    elderly_delta = elderly_failure_rate - non_elderly_failure_rate
-    
-    # Seasonal spike
-    df['month'] = df['auth_timestamp'].dt.month
-    monthly_failures = df[df['auth_result'] == 'failure'].groupby('month').size()
-    avg_monthly = monthly_failures.mean() if len(monthly_failures) > 0 else 0
-    peak_month = monthly_failures.max() if len(monthly_failures) > 0 else 0
-    seasonal_spike = ((peak_month - avg_monthly) / avg_monthly * 100) if avg_monthly > 0 else 0
-    
-    return {
-        "overall_failure_rate": round(failure_rate, 2),
-        "highest_risk_district": highest_risk_district,
-        "worst_device": worst_device,
-        "elderly_failure_delta": round(elderly_delta, 2),
-        "seasonal_spike": round(seasonal_spike, 2)
-    }
+async def get_kpis(request: Request, approx: bool = False):
+    """Get dashboard KPIs; `approx` estimates them from samples, with confidence intervals"""
+    if approx:
+        return await _approx_response(request, "kpis", analytics.kpis_approx, analytics.kpis)
+    return await _analytics_response(request, "kpis", analytics.kpis)
 
 @app.get("/api/risk-zones")
-async def get_risk_zones(biometric_type: Optional[str] = None, age_group: Optional[str] = None):
-    """Get risk zone data for map visualization"""
-    if df is None:
-        return {"zones": []}
-    
-    filtered_df = df.copy()
-    
-    if biometric_type:
-        filtered_df = filtered_df[filtered_df['biometric_type'] == biometric_type]
-    if age_group:
-        filtered_df = filtered_df[filtered_df['age_group'] == age_group]
-    
-    # Calculate failure rates by state/district
-    risk_data = []
-    for state in filtered_df['state'].unique():
-        state_df = filtered_df[filtered_df['state'] == state]
-        total = len(state_df)
-        failures = len(state_df[state_df['auth_result'] == 'failure'])
-        failure_rate = (failures / total * 100) if total > 0 else 0
-        
-        risk_data.append({
-            "state": state,
-            "failure_rate": round(failure_rate, 2),
-            "total_attempts": int(total),
-            "failures": int(failures)
-        })
-    
-    return {"zones": risk_data}
+async def get_risk_zones(request: Request, biometric_type: Optional[str] = None, age_group: Optional[str] = None,
+                         device_model: Optional[str] = None, gender: Optional[str] = None,
+                         start_date: Optional[date] = None, end_date: Optional[date] = None,
+                         state: Optional[str] = None, approx: bool = False):
+    """
+    Get risk zone data for map visualization; pass `state` to drill down to
+    its districts, `approx` to estimate rates from samples
+    """
+    params = (biometric_type, age_group, device_model, gender, start_date, end_date, state)
+    if approx:
+        return await _approx_response(request, "risk-zones", analytics.risk_zones_approx, analytics.risk_zones,
+                                      *params, source="zones")
+    return await _analytics_response(request, "risk-zones", analytics.risk_zones, *params, source="zones")
+
+@app.get("/api/trends/timeseries")
+async def get_trends_timeseries(request: Request, granularity: Literal[tuple(GRANULARITIES)] = "day",
+                                start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                by: Optional[Literal[tuple(SERIES_DIMENSIONS)]] = None,
+                                windows: List[int] = Query([], description="Rolling window lengths in days"),
+                                state: Optional[str] = None, device_model: Optional[str] = None,
+                                age_group: Optional[str] = None, biometric_type: Optional[str] = None):
+    """
+    Get failure-rate time series at hour/day/week/month granularity
+
+    Optionally limited to a date range, split by a dimension (`by`), filtered,
+    and with rolling failure rates over `windows` days.
+    """
+    if any(days < 1 for days in windows):
+        raise HTTPException(status_code=422, detail="Rolling windows must be at least 1 day")
+    return await _analytics_response(request, "trends-timeseries", analytics.timeseries, granularity, start_date,
+                                     end_date, by, tuple(windows), state, device_model, age_group, biometric_type,
+                                     source="timeseries")
 
 @app.post("/api/predict")
 async def predict_failure(request: PredictionRequest):
     """Predict biometric failure probability"""
-    if model is None:
+    if engine is None:
         # Return mock prediction if model not loaded
         return {
             "failure_probability": 15.5,
@@ -157,32 +662,25 @@ async def predict_failure(request: PredictionRequest):
                 "state": 0.05
             }
         }
-    
-    # Prepare features for prediction
-    # This is a simplified version - in production, you'd encode categoricals properly
-    features = {
-        'age_group': request.age_group,
-        'biometric_type': request.biometric_type,
-        'device_model': request.device_model,
-        'state': request.state
-    }
-    
-    # For demo, return a calculated prediction based on historical data
-    if df is not None:
-        filtered = df[
-            (df['age_group'] == request.age_group) &
-            (df['biometric_type'] == request.biometric_type) &
-            (df['device_model'] == request.device_model) &
-            (df['state'] == request.state)
-        ]
-        
-        if len(filtered) > 0:
-            failure_rate = len(filtered[filtered['auth_result'] == 'failure']) / len(filtered) * 100
-        else:
-            failure_rate = df[df['auth_result'] == 'failure'].shape[0] / len(df) * 100
-    else:
-        failure_rate = 15.5
-    
+
+    scorer, scorer_explainer = engine, explainer
+    features = request.model_dump()
+    try:
+        key = scorer.resolve(features)
+        with metrics.span("predict"):
+            probability = await scorer.predict(features)
+    except UnknownCategoryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # SHAP values (log-odds) of the request's categorical features
+    with metrics.span("explain"):
+        factors = await scorer_explainer.factors(key, len(scorer.vocab['gender']))
+    return {**_prediction_payload(probability), "factors": factors}
+
+def _prediction_payload(probability):
+    """Failure probability, risk level and confidence for a 0-1 probability"""
+    failure_rate = probability * 100
+
     # Determine risk level
     if failure_rate < 10:
         risk_level = "Low"
@@ -190,158 +688,186 @@ async def predict_failure(request: PredictionRequest):
         risk_level = "Medium"
     else:
         risk_level = "High"
-    
+
     return {
         "failure_probability": round(failure_rate, 2),
         "risk_level": risk_level,
-        "confidence": 0.75,
-        "factors": {
-            "age_group": 0.2,
-            "biometric_type": 0.15,
-            "device_model": 0.1,
-            "state": 0.05
-        }
+        "confidence": round(max(probability, 1 - probability), 2)
     }
 
+_prediction_rows = TypeAdapter(List[PredictionRequest])
+
+def _score_rows(scorer, rows):
+    """Validate request rows and score them with `scorer` in one vectorized pass"""
+    frame = pd.DataFrame(_prediction_rows.dump_python(_prediction_rows.validate_python(rows)))
+    probabilities = scorer.predict_frame(frame) if len(frame) else []
+    return [_prediction_payload(float(p)) for p in probabilities]
+
+def _parse_json(data, line=None):
+    """json.loads() that answers malformed input with a 400 naming the NDJSON `line` (1-based)"""
+    try:
+        return json.loads(data)
+    except ValueError as e:
+        # JSONDecodeError positions are relative to `data`, not the whole body
+        reason = getattr(e, "msg", None) or str(e)
+        raise HTTPException(status_code=400,
+                            detail=f"Invalid JSON on line {line}: {reason}" if line else f"Invalid JSON: {reason}")
+
+def _body_rows(body, key):
+    """The rows of a JSON body, a list or an object with a `key` list, or a 400"""
+    rows = body.get(key) if isinstance(body, dict) else body
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail=f'Expected a JSON list, or an object whose "{key}" is a list')
+    return rows
+
+def _prediction_error(e):
+    """The HTTPException for a ValidationError or UnknownCategoryError raised by _score_rows()"""
+    if isinstance(e, ValidationError):
+        # The context of validator errors holds the exception itself, which is not JSON serializable
+        return HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    return HTTPException(status_code=400, detail=str(e))
+
+async def _score_ndjson(request: Request, scorer):
+    """Score an NDJSON request body chunk by chunk as it is received, yielding NDJSON predictions"""
+    buffer = b""
+    line_count = 0
+    rows = []
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        rows += [_parse_json(line, line_count + i) for i, line in enumerate(lines, start=1) if line.strip()]
+        line_count += len(lines)
+        while len(rows) >= BATCH_CHUNK_ROWS:
+            chunk, rows = rows[:BATCH_CHUNK_ROWS], rows[BATCH_CHUNK_ROWS:]
+            yield "".join(json.dumps(p) + "\n" for p in await run_in_threadpool(_score_rows, scorer, chunk))
+    if buffer.strip():
+        rows.append(_parse_json(buffer, line_count + 1))
+    yield "".join(json.dumps(p) + "\n" for p in await run_in_threadpool(_score_rows, scorer, rows))
+
+async def _stream_predictions(first, chunks):
+    """Yield `first` and the rest of `chunks`; an error ends the stream with an {"error": ...} line"""
+    yield first
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except (HTTPException, ValidationError, UnknownCategoryError) as e:
+        error = e if isinstance(e, HTTPException) else _prediction_error(e)
+        yield json.dumps({"error": error.detail, "status_code": error.status_code}) + "\n"
+    except ClientDisconnect:
+        # Nobody is left to answer
+        return
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body iterator still reads the request body
+
+    StreamingResponse listens for a disconnect on `receive` while streaming,
+    which would take request body messages from the iterator; the iterator
+    sees a disconnect itself, as ClientDisconnect from request.stream().
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+@app.post("/api/predict/batch")
+async def predict_failure_batch(request: Request):
+    """
+    Predict failure probabilities for many rows in one vectorized pass
+
+    Accepts a JSON list of PredictionRequest rows (or {"rows": [...]}) and
+    returns {"predictions": [...]} in the same order. An application/x-ndjson
+    body (one row per line) is scored in chunks while it is being received,
+    and each chunk's predictions are streamed back as NDJSON lines as soon
+    as it is scored. Malformed JSON, or JSON of another shape, is answered
+    with 400 (naming the line for NDJSON); once streaming has started, an
+    error ends the response with an {"error": ..., "status_code": ...} line.
+    """
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    # One model version scores the whole request, even if a new one is swapped in meanwhile
+    scorer = engine
+
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            chunks = _score_ndjson(request, scorer)
+            # Errors in the first chunk still get their status code
+            first = await anext(chunks, "")
+            return _DuplexStreamingResponse(_stream_predictions(first, chunks), media_type="application/x-ndjson")
+
+        body = _parse_json(await request.body())
+        rows = _body_rows(body, "rows")
+        return {"predictions": await run_in_threadpool(_score_rows, scorer, rows)}
+    except (ValidationError, UnknownCategoryError) as e:
+        raise _prediction_error(e)
+
 @app.get("/api/feature-importance")
-async def get_feature_importance():
-    """Get SHAP feature importance"""
-    if df is None:
-        return {"features": []}
-    
-    # Simplified feature importance based on correlation
-    features = []
-    
-    # Age group importance
-    age_groups = df.groupby(['age_group', 'auth_result']).size().unstack(fill_value=0)
-    if 'failure' in age_groups.columns:
-        age_importance = (age_groups['failure'] / age_groups.sum(axis=1)).max()
-        features.append({"name": "Age Group", "importance": float(age_importance * 100)})
-    
-    # Biometric type importance
-    bio_types = df.groupby(['biometric_type', 'auth_result']).size().unstack(fill_value=0)
-    if 'failure' in bio_types.columns:
-        bio_importance = (bio_types['failure'] / bio_types.sum(axis=1)).max()
-        features.append({"name": "Biometric Type", "importance": float(bio_importance * 100)})
-    
-    # Device model importance
-    devices = df.groupby(['device_model', 'auth_result']).size().unstack(fill_value=0)
-    if 'failure' in devices.columns:
-        device_importance = (devices['failure'] / devices.sum(axis=1)).max()
-        features.append({"name": "Device Model", "importance": float(device_importance * 100)})
-    
-    # Sort by importance
-    features.sort(key=lambda x: x['importance'], reverse=True)
-    
-    return {"features": features}
+async def get_feature_importance(request: Request):
+    """Get SHAP feature importance (failure-rate based when the model has no explanations)"""
+    if explainer is not None and explainer.explanations is not None:
+        return explainer.feature_importance()
+    return await _analytics_response(request, "feature-importance", analytics.feature_importance)
 
 @app.get("/api/trends")
-async def get_trends():
-    """Get time-series trends"""
-    if df is None:
-        return {"monthly": [], "age_groups": [], "devices": []}
-    
-    # Monthly trends
-    df['month'] = df['auth_timestamp'].dt.to_period('M')
-    monthly = df.groupby(['month', 'auth_result']).size().unstack(fill_value=0)
-    monthly_data = []
-    for month in monthly.index:
-        total = monthly.loc[month].sum()
-        failures = monthly.loc[month].get('failure', 0)
-        monthly_data.append({
-            "month": str(month),
-            "failure_rate": round((failures / total * 100) if total > 0 else 0, 2)
-        })
-    
-    # Age group trends
-    age_trends = df.groupby(['age_group', 'auth_result']).size().unstack(fill_value=0)
-    age_data = []
-    for age_group in age_trends.index:
-        total = age_trends.loc[age_group].sum()
-        failures = age_trends.loc[age_group].get('failure', 0)
-        age_data.append({
-            "age_group": age_group,
-            "failure_rate": round((failures / total * 100) if total > 0 else 0, 2)
-        })
-    
-    # Device trends
-    device_trends = df.groupby(['device_model', 'auth_result']).size().unstack(fill_value=0)
-    device_data = []
-    for device in device_trends.index:
-        total = device_trends.loc[device].sum()
-        failures = device_trends.loc[device].get('failure', 0)
-        device_data.append({
-            "device": device,
-            "failure_rate": round((failures / total * 100) if total > 0 else 0, 2)
-        })
-    
-    return {
-        "monthly": monthly_data,
-        "age_groups": age_data,
-        "devices": device_data
-    }
+async def get_trends(request: Request, approx: bool = False):
+    """Get time-series trends; `approx` estimates them from samples, with confidence intervals"""
+    if approx:
+        return await _approx_response(request, "trends", analytics.trends_approx, analytics.trends)
+    return await _analytics_response(request, "trends", analytics.trends)
+
+async def _insights():
+    """Live anomaly alerts followed by the insights computed from the aggregates"""
+    alerts = anomaly_detector.alerts()
+    payload = await analytics_executor.run("insights", analytics.insights)
+    # Alerts take the first of the 10 places analytics.insights() fills on its own
+    return {"insights": (alerts + payload["insights"])[:10]}
 
 @app.get("/api/insights")
-async def get_insights():
+async def get_insights(request: Request):
     """Generate actionable insights"""
-    if df is None:
-        return {"insights": []}
-    
-    insights = []
-    
-    # Elderly fingerprint failures in winter
-    df['month'] = df['auth_timestamp'].dt.month
-    winter_months = [11, 12, 1, 2]
-    elderly_winter = df[
-        (df['age_group'] == 'elderly') &
-        (df['biometric_type'] == 'fingerprint') &
-        (df['month'].isin(winter_months))
-    ]
-    if len(elderly_winter) > 0:
-        elderly_winter_failure_rate = len(elderly_winter[elderly_winter['auth_result'] == 'failure']) / len(elderly_winter) * 100
-        if elderly_winter_failure_rate > 20:
-            insights.append({
-                "type": "warning",
-                "title": "Elderly Fingerprint Failures High in Winter",
-                "description": f"Elderly users experience {elderly_winter_failure_rate:.1f}% failure rate during winter months. Consider promoting iris authentication or device upgrades.",
-                "priority": "High"
-            })
-    
-    # Device model analysis
-    device_failures = df.groupby(['device_model', 'auth_result']).size().unstack(fill_value=0)
-    for device in device_failures.index:
-        total = device_failures.loc[device].sum()
-        failures = device_failures.loc[device].get('failure', 0)
-        failure_rate = (failures / total * 100) if total > 0 else 0
-        avg_failure_rate = len(df[df['auth_result'] == 'failure']) / len(df) * 100
-        
-        if failure_rate > avg_failure_rate * 1.5:
-            multiplier = failure_rate / avg_failure_rate if avg_failure_rate > 0 else 0
-            insights.append({
-                "type": "critical",
-                "title": f"Device Model {device} Underperforming",
-                "description": f"Device model {device} shows {multiplier:.1f}x higher failure rate ({failure_rate:.1f}% vs {avg_failure_rate:.1f}%). Recommend replacement or firmware update.",
-                "priority": "High"
-            })
-    
-    # Regional risk
-    state_failures = df.groupby(['state', 'auth_result']).size().unstack(fill_value=0)
-    for state in state_failures.index:
-        total = state_failures.loc[state].sum()
-        failures = state_failures.loc[state].get('failure', 0)
-        failure_rate = (failures / total * 100) if total > 0 else 0
-        
-        if failure_rate > 25:
-            insights.append({
-                "type": "warning",
-                "title": f"High Risk Zone: {state}",
-                "description": f"{state} shows {failure_rate:.1f}% failure rate. Investigate environmental factors, device quality, or user demographics.",
-                "priority": "Medium"
-            })
-    
-    return {"insights": insights[:10]}  # Return top 10 insights
+    return await response_cache.respond(request, "insights", _insights)
+
+def _publish_insights(changes):
+    """Push anomaly detector changes to the clients following /api/insights/stream"""
+    for queue in _insight_subscribers:
+        for change in changes:
+            try:
+                queue.put_nowait(change)
+            except asyncio.QueueFull:
+                # A client this far behind will re-fetch /api/insights on reconnect
+                pass
+
+@app.get("/api/insights/stream")
+async def stream_insights():
+    """
+    Server-sent events for the insights sidebar
+
+    Sends an `anomaly` event with the alert when a failure spike is
+    detected in ingested events, and a `resolved` event when it subsides.
+    """
+    queue = asyncio.Queue(maxsize=1000)
+    _insight_subscribers.add(queue)
+
+    async def stream():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    kind, alert = await asyncio.wait_for(queue.get(), INSIGHTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {kind}\ndata: {json.dumps(alert)}\n\n"
+        finally:
+            _insight_subscribers.discard(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/anomalies")
+async def get_anomalies():
+    """Anomaly detector state: flagged combinations, recent detections and counters"""
+    return {**anomaly_detector.stats(), "active": anomaly_detector.alerts(),
+            "recent": list(reversed(anomaly_detector.history))}
 
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
-
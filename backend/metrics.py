@@ -0,0 +1,346 @@
+"""
+Request metrics, stage spans and an opt-in sampling profiler
+
+MetricsMiddleware records, per route template:
+
+- request latency histograms (by method, route and status);
+- per-stage timings: code wraps a stage in `with span("name"):` and the
+  time spent in it during a request is added to the request's trace;
+- resident memory (RSS) growth per request, and with METRICS_TRACEMALLOC=1
+  the peak Python/numpy allocation above the level at the start of the
+  request. tracemalloc slows allocation-heavy code down noticeably, so it is
+  opt-in; allocation and RSS are process-wide, so with concurrent requests
+  the figures are attributed approximately.
+
+render() writes everything in the Prometheus text exposition format for
+/metrics, so no client library is needed. Spans outside a request (or with
+no middleware installed) cost one context variable lookup.
+
+SamplingProfiler samples the stacks of every thread from a background
+thread and aggregates them as collapsed stacks (the input format of
+flamegraph.pl and speedscope). It only exists while switched on, so it
+costs nothing when disabled.
+"""
+import bisect
+import contextvars
+import functools
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the memory histogram buckets, in bytes
+MEMORY_BUCKETS = tuple(2 ** shift for shift in range(12, 32, 2))
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# (pid, descriptor) of /proc/self/statm, kept open since rss_bytes() runs
+# twice per request; reopened in a forked child, where it would name the parent
+_statm = (None, None)
+
+def rss_bytes():
+    """Current resident set size of this process"""
+    global _statm
+    try:
+        if _statm[0] != os.getpid():
+            _statm = (os.getpid(), os.open(f"/proc/{os.getpid()}/statm", os.O_RDONLY))
+        return int(os.pread(_statm[1], 128, 0).split()[1]) * _PAGE_SIZE
+    except OSError:
+        # No /proc: fall back to the peak, which is all getrusage reports
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """Prometheus histogram with a fixed set of label names"""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self._series.items())
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency",
+                            ["method", "route", "status"])
+STAGE_LATENCY = Histogram("http_request_stage_seconds", "Time spent in a stage of handling a request, per request",
+                          ["route", "stage"])
+RSS_GROWTH = Histogram("http_request_rss_growth_bytes", "Resident memory growth over a request (0 if it shrank)",
+                       ["route"], MEMORY_BUCKETS)
+ALLOCATION_PEAK = Histogram("http_request_allocation_peak_bytes",
+                            "Peak traced allocation above the start of the request (METRICS_TRACEMALLOC=1)",
+                            ["route"], MEMORY_BUCKETS)
+
+HISTOGRAMS = [REQUEST_LATENCY, STAGE_LATENCY, RSS_GROWTH, ALLOCATION_PEAK]
+
+# Callables returning extra (name, type, help, value) samples for /metrics
+_collectors = []
+
+def register_collector(collect):
+    """Add a callable whose (name, type, help, value) samples are rendered with the histograms"""
+    _collectors.append(collect)
+
+_started = time.time()
+
+def _process_samples():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return [
+        ("process_resident_memory_bytes", "gauge", "Resident memory size in bytes", rss_bytes()),
+        ("process_cpu_seconds_total", "counter", "User and system CPU time in seconds",
+         usage.ru_utime + usage.ru_stime),
+        ("process_start_time_seconds", "gauge", "Start time of the process since the epoch in seconds", _started),
+    ]
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    for collect in [_process_samples, *_collectors]:
+        for name, kind, help, value in collect():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {_format_value(value)}"]
+    return "\n".join(lines) + "\n"
+
+# Starlette appends the charset to text/ media types
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+class Trace:
+    """Seconds spent per stage while handling one request"""
+
+    __slots__ = ("stages",)
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def merge(self, stages):
+        for stage, seconds in stages.items():
+            self.add(stage, seconds)
+
+_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+class span:
+    """Time the enclosed block as `stage` of the current request (a no-op outside one)"""
+
+    __slots__ = ("stage", "trace", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.trace = _trace.get()
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.add(self.stage, time.perf_counter() - self.started)
+
+def timed(stage):
+    """Decorator timing every call of a function as span(stage)"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _trace.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                trace.add(stage, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+@contextmanager
+def collect():
+    """
+    Gather the spans of the enclosed block into a dict of stage seconds
+
+    Worker threads and processes do not see the request's trace, so the
+    analytics executor collects the spans of each call and hands them back
+    to be merged into the request with record_stages().
+    """
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace.stages
+    finally:
+        _trace.reset(token)
+
+def record_stages(stages):
+    """Add stage timings collected elsewhere to the current request"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.merge(stages)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, stage timings and memory per route
+
+    Requests are labelled with the route's path template (e.g.
+    /api/risk-zones), never the raw path, so the number of series stays
+    bounded; requests matching no route are labelled "unmatched".
+    """
+
+    def __init__(self, app, trace_allocations=False):
+        self.app = app
+        self.trace_allocations = trace_allocations
+        self._routes = None
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _route(self, scope):
+        if self._routes is None:
+            router = scope.get("router")
+            self._routes = {route.endpoint: route.path for route in getattr(router, "routes", [])
+                            if hasattr(route, "endpoint")}
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        trace = Trace()
+        token = _trace.set(trace)
+        rss = rss_bytes()
+        if self.trace_allocations:
+            allocated = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _trace.reset(token)
+            route = self._route(scope)
+            REQUEST_LATENCY.observe(elapsed, scope["method"], route, str(status))
+            for stage, seconds in trace.stages.items():
+                STAGE_LATENCY.observe(seconds, route, stage)
+            RSS_GROWTH.observe(max(rss_bytes() - rss, 0), route)
+            if self.trace_allocations:
+                ALLOCATION_PEAK.observe(max(tracemalloc.get_traced_memory()[1] - allocated, 0), route)
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling every thread's stack each `interval` seconds
+
+    Samples are kept as collapsed stacks ("frame;frame;frame count" lines,
+    outermost frame first), which flamegraph.pl and speedscope read. Frames
+    are functions, and the innermost one also carries its line number.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self.started_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.samples = Counter()
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = [f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"]
+                frame = frame.f_back
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                with self._lock:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Samples as collapsed stack lines, most frequent first"""
+        with self._lock:
+            samples = self.samples.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in samples)
+
+    def status(self):
+        with self._lock:
+            samples = sum(self.samples.values())
+        return {"running": self.running, "interval_ms": self.interval * 1000, "samples": samples,
+                "started_at": self.started_at}
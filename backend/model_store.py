@@ -0,0 +1,226 @@
+"""
+Versioned model artifact bundles
+
+Every training or update run writes a bundle to models/versions/<version>/:
+
+- model.ubj: the booster in XGBoost's native UBJSON format;
+- vocab.json: the category labels of each categorical feature, in code order;
+- further artifacts such as explanations.npz;
+- manifest.json: version id, feature order and types, the SHA-256 of every
+  file and a content hash of the model and vocabularies, plus run info.
+
+Nothing in a bundle is pickled, so loading one runs no code from the file
+and does not depend on the scikit-learn version that wrote it, nor on the
+XGBoost version beyond its model format compatibility. After the bundle is
+written, models/manifest.json is pointed at it with an atomic rename. A
+version directory is never modified after it is published. Readers such as
+the API and score.py therefore always see one complete version: the pointer
+changes in a single step, so they cannot pair one version's model with
+another's vocabularies.
+
+Compiled decision tables (see inference.DecisionTable) are cached outside
+the bundles, as models/tables/<hash>.npy.
+
+Models pickled before bundles existed (biometric_model.pkl and
+label_encoders.pkl, unversioned or in a version directory) still load, with
+a warning; `python model_store.py import-pickle` republishes the current
+one as a bundle.
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from datetime import datetime, timezone
+
+import xgboost as xgb
+
+from inference import CATEGORICAL_FEATURES, MODEL_FEATURES, DecisionTable
+
+MODELS_DIR = "models"
+MODEL_NAME = "model.ubj"
+VOCAB_NAME = "vocab.json"
+FORMAT = "bundle-v1"
+
+# Pickled artifacts written before bundles existed
+LEGACY_MODEL_NAME = "biometric_model.pkl"
+LEGACY_ENCODERS_NAME = "label_encoders.pkl"
+
+def _atomic_write(path, data):
+    """Write `data` to `path` so readers see either the old or the new file, never a partial one"""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def read_manifest(models_dir=MODELS_DIR):
+    """The current version's manifest, or None before any versioned run"""
+    try:
+        with open(os.path.join(models_dir, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def bundle_dir(manifest, models_dir=MODELS_DIR):
+    """Directory of a manifest's version"""
+    return os.path.join(models_dir, "versions", manifest["version"])
+
+def current_file(name, models_dir=MODELS_DIR):
+    """Path of an artifact (such as explanations.npz) of the current version"""
+    manifest = read_manifest(models_dir)
+    if manifest is not None:
+        return os.path.join(bundle_dir(manifest, models_dir), name)
+    return os.path.join(models_dir, name)
+
+def has_model(models_dir=MODELS_DIR):
+    """Whether there is a current version or a legacy pickled model to load"""
+    return read_manifest(models_dir) is not None or (
+        os.path.exists(os.path.join(models_dir, LEGACY_MODEL_NAME))
+        and os.path.exists(os.path.join(models_dir, LEGACY_ENCODERS_NAME)))
+
+def load_bundle(path, verify=True):
+    """
+    (model, vocab, manifest) of the bundle in directory `path`
+
+    With `verify`, a file whose SHA-256 does not match the manifest raises
+    ValueError instead of being loaded.
+    """
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT:
+        raise ValueError(f"{path} is not a {FORMAT} model bundle")
+    if verify:
+        for name, digest in manifest["files"].items():
+            with open(os.path.join(path, name), 'rb') as f:
+                if _sha256(f.read()) != digest:
+                    raise ValueError(f"{os.path.join(path, name)} does not match its manifest")
+    model = xgb.XGBClassifier()
+    model.load_model(os.path.join(path, MODEL_NAME))
+    with open(os.path.join(path, VOCAB_NAME)) as f:
+        vocab = json.load(f)
+    return model, vocab, manifest
+
+def _load_pickles(models_dir):
+    """(model, vocab) from the pickled files written before bundles existed"""
+    with open(os.path.join(models_dir, LEGACY_MODEL_NAME), 'rb') as f:
+        model = pickle.load(f)
+    with open(os.path.join(models_dir, LEGACY_ENCODERS_NAME), 'rb') as f:
+        label_encoders = pickle.load(f)
+    vocab = {feature: [str(value) for value in label_encoders[feature].classes_] for feature in CATEGORICAL_FEATURES}
+    return model, vocab
+
+def load_current(models_dir=MODELS_DIR, verify=True):
+    """(model, vocab, manifest) of the current version; the manifest is None for an unversioned pickled model"""
+    manifest = read_manifest(models_dir)
+    if manifest is not None and manifest.get("format") == FORMAT:
+        return load_bundle(bundle_dir(manifest, models_dir), verify)
+    path = models_dir if manifest is None else bundle_dir(manifest, models_dir)
+    print(f"Warning: loading a pickled model from {path}; "
+          f"run `python model_store.py import-pickle` to convert it to a bundle")
+    return (*_load_pickles(path), manifest)
+
+def load_model(path, verify=True):
+    """(model, vocab, manifest) from a bundle directory or a models directory's current version"""
+    if os.path.exists(os.path.join(path, MODEL_NAME)):
+        return load_bundle(path, verify)
+    return load_current(path, verify)
+
+def decision_table(model, vocab, manifest, models_dir=MODELS_DIR):
+    """
+    The model compiled into a DecisionTable, memory-mapped from
+    models/tables/<hash>.npy
+
+    The table is compiled and saved by the first process that loads a
+    version, so other workers and restarts map the same file and share its
+    pages. A table that disagrees with the model is recompiled; unversioned
+    models are compiled in memory.
+    """
+    if manifest is None or "hash" not in manifest:
+        return DecisionTable.compile(model, vocab)
+    tables_dir = os.path.join(models_dir, "tables")
+    path = os.path.join(tables_dir, f"{manifest['hash']}.npy")
+    if os.path.exists(path):
+        table = DecisionTable.load(path)
+        if table.max_error(model) <= 1e-6:
+            return table
+        print(f"Warning: {path} does not match the model; recompiling it")
+    os.makedirs(tables_dir, exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        DecisionTable.compile(model, vocab).save(f)
+    os.replace(tmp, path)
+
+    # Drop the tables of versions that have been removed
+    hashes = set()
+    versions_dir = os.path.join(models_dir, "versions")
+    for version in os.listdir(versions_dir) if os.path.isdir(versions_dir) else []:
+        try:
+            with open(os.path.join(versions_dir, version, "manifest.json")) as f:
+                hashes.add(json.load(f).get("hash"))
+        except FileNotFoundError:
+            pass
+    for name in os.listdir(tables_dir):
+        if name.endswith(".npy") and name[:-len(".npy")] not in hashes | {manifest["hash"]}:
+            os.remove(os.path.join(tables_dir, name))
+    return DecisionTable.load(path)
+
+def save_version(model, vocab, info, models_dir=MODELS_DIR, keep=10, files=None):
+    """
+    Publish a new model version and return its manifest
+
+    `info` (training mode, rows, data_end, auc, ...) is recorded in the
+    manifest along with the version id, parent version, creation time,
+    feature order and file hashes. `files` maps the names of further
+    artifacts to their bytes. The `keep` most recent versions are retained;
+    older ones are removed.
+    """
+    booster = model.get_booster()
+    files = {MODEL_NAME: bytes(booster.save_raw("ubj")),
+             VOCAB_NAME: json.dumps({feature: [str(value) for value in vocab[feature]]
+                                     for feature in CATEGORICAL_FEATURES}).encode(),
+             **(files or {})}
+
+    parent = read_manifest(models_dir)
+    created = datetime.now(timezone.utc)
+    version = created.strftime("%Y%m%dT%H%M%S%fZ")
+    manifest = {"version": version, "parent": parent["version"] if parent else None,
+                "created_at": created.isoformat(timespec='seconds'), "format": FORMAT,
+                "hash": _sha256(files[MODEL_NAME] + files[VOCAB_NAME]),
+                "features": MODEL_FEATURES, "feature_types": booster.feature_types,
+                "files": {name: _sha256(data) for name, data in files.items()}, **info}
+
+    version_dir = os.path.join(models_dir, "versions", version)
+    os.makedirs(version_dir)
+    for name, data in {**files, "manifest.json": json.dumps(manifest, indent=2).encode()}.items():
+        with open(os.path.join(version_dir, name), 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    _atomic_write(os.path.join(models_dir, "manifest.json"), json.dumps(manifest, indent=2).encode())
+
+    versions = sorted(os.listdir(os.path.join(models_dir, "versions")))
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(models_dir, "versions", old), ignore_errors=True)
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect, verify or import model bundles")
+    parser.add_argument("command", choices=["show", "verify", "import-pickle"])
+    parser.add_argument("--models", default=MODELS_DIR, help="Models directory")
+    args = parser.parse_args()
+    if args.command == "import-pickle":
+        model, vocab, previous = load_current(args.models)
+        info = {key: value for key, value in (previous or {}).items()
+                if key in ("mode", "rows", "auc", "data_end", "trees")}
+        manifest = save_version(model, vocab, {**info, "imported_from": previous and previous["version"]},
+                                args.models)
+        print(f"Model version {manifest['version']} published")
+    else:
+        model, vocab, manifest = load_current(args.models, verify=args.command == "verify")
+        print(json.dumps(manifest, indent=2))
@@ -0,0 +1,72 @@
+"""
+Versioned cache of rendered dashboard responses
+
+Entries are keyed by endpoint, query parameters and the dataset version, so
+a reload or ingest (which bumps the version) makes every earlier entry
+unreachable; stale entries then age out of the bounded LRU. Each entry keeps
+the rendered JSON body and a content ETag, letting polling clients that
+already hold the current answer get a bodiless 304.
+"""
+import hashlib
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+import metrics
+from inference import LRUCache
+
+def _etag(body):
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+def _matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches `etag`"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+class ResponseCache:
+    """Bounded LRU of rendered JSON responses keyed by endpoint, params and dataset version"""
+
+    def __init__(self, maxsize=512):
+        self.entries = LRUCache(maxsize)
+        self.version = 0
+        self.not_modified = 0
+
+    def bump(self):
+        """Invalidate every cached response after the dataset changes"""
+        self.version += 1
+
+    async def respond(self, request, endpoint, compute, *params):
+        """
+        Return the cached response for endpoint(*params), computing it on a miss
+
+        `compute` is awaited with `params` and must return a JSON-serializable
+        payload. Answers 304 when the request's If-None-Match holds the ETag
+        of the current body.
+        """
+        key = (endpoint, params, self.version)
+        entry = self.entries.get(key)
+        if entry is None:
+            payload = await compute(*params)
+            with metrics.span("render"):
+                body = JSONResponse(jsonable_encoder(payload)).body
+            entry = (body, _etag(body))
+            self.entries.put(key, entry)
+        body, etag = entry
+
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if _matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+    def stats(self):
+        return {
+            "dataset_version": self.version,
+            "entries": len(self.entries),
+            "max_entries": self.entries.maxsize,
+            "hits": self.entries.hits,
+            "misses": self.entries.misses,
+            "not_modified": self.not_modified,
+        }
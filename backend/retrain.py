@@ -0,0 +1,170 @@
+"""
+Incremental model updates and drift-triggered retraining
+
+Instead of retraining from scratch, `python retrain.py` updates the current
+model version on only the events recorded after the data it was trained on
+(the manifest's data_end):
+
+- "boost" (default) continues boosting from the saved trees, adding up to
+  --rounds trees fitted to the new window;
+- "refresh" keeps the tree structure and refits leaf values and cover
+  statistics on the new window.
+
+A fifth of the window is held out, and the update is published as a new
+version only if its AUC there is no worse than the current model's. With
+--watch the command runs as a scheduler: every --interval seconds it scores
+the new window with the current model and updates only once the window is
+large enough and the model has drifted on it.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import roc_auc_score
+
+import model_store
+from explain import EXPLANATIONS_NAME, build_explanations, save_explanations
+from inference import CATEGORICAL_FEATURES
+from storage import read_chunks
+from train_model import _data_file, encode_chunk
+
+# Booster parameters shared with train_model.py
+PARAMS = {"objective": "binary:logistic", "eval_metric": "auc", "tree_method": "hist",
+          "max_depth": 6, "learning_rate": 0.1, "seed": 42}
+
+def load_window(data_file, since, vocab, chunk_rows=1_000_000):
+    """
+    Encoded features, labels and latest timestamp of the events after `since`
+
+    Categories the model has not seen are appended to its vocabularies so
+    existing codes keep their meaning; returns the extended vocabularies too.
+    """
+    columns = CATEGORICAL_FEATURES + ['auth_timestamp', 'auth_result']
+    chunks = list(read_chunks(data_file, chunk_rows, columns, since=since))
+    if not chunks:
+        return None, None, None, vocab
+    window = pd.concat(chunks, ignore_index=True)
+
+    extended = {}
+    for feature in CATEGORICAL_FEATURES:
+        known = list(vocab[feature])
+        new = sorted(set(window[feature].astype(str).unique()) - set(known))
+        if new:
+            print(f"New {feature} values: {', '.join(new)}")
+        extended[feature] = known + new
+    X, y = encode_chunk(window, extended)
+    return X, y, pd.to_datetime(window['auth_timestamp']).max(), extended
+
+def _matrix(booster, X, y=None):
+    """DMatrix with the booster's feature names and types"""
+    types = booster.feature_types
+    return xgb.DMatrix(X, y, feature_names=booster.feature_names, feature_types=types,
+                       enable_categorical=bool(types) and 'c' in types)
+
+def check_drift(booster, X, y, manifest, max_gap=0.02, max_auc_drop=0.02):
+    """
+    Compare the model's predictions on a window with what happened
+
+    The model has drifted if its mean predicted failure probability is more
+    than `max_gap` off the observed failure rate, or its AUC on the window
+    is more than `max_auc_drop` below its validation AUC at training time.
+    """
+    predicted = booster.predict(_matrix(booster, X))
+    gap = abs(float(predicted.mean()) - float(y.mean()))
+    auc = roc_auc_score(y, predicted) if 0 < y.sum() < len(y) else None
+    auc_drop = manifest.get("auc", 0) - auc if auc is not None and manifest.get("auc") else 0.0
+    return {"rows": len(y), "calibration_gap": gap, "auc": auc, "auc_drop": auc_drop,
+            "drifted": gap > max_gap or auc_drop > max_auc_drop}
+
+def update_model(mode="boost", rounds=20, data_file=None, since=None, threads=None, tolerance=0.0,
+                 force=False, window=None):
+    """
+    Update the current model version on the events after `since` (default:
+    its data_end) and publish the result; returns the new manifest, or None
+    if there was nothing to update or the update was rejected
+    """
+    started = time.perf_counter()
+    model, vocab, manifest = model_store.load_current()
+    if not (manifest or {}).get("data_end") and since is None:
+        print("The current model has no training data end; pass --since or retrain with train_model.py")
+        return None
+    since = since or manifest["data_end"]
+    X, y, data_end, vocab = window or load_window(data_file or _data_file(), since, vocab)
+    if X is None or len(X) < 2:
+        print(f"No new events since {since}")
+        return None
+
+    held_out = np.random.default_rng(42).random(len(X)) < 0.2
+    booster = model.get_booster()
+    dtrain = _matrix(booster, X[~held_out], y[~held_out])
+    dvalid = _matrix(booster, X[held_out], y[held_out])
+    before = roc_auc_score(y[held_out], booster.predict(dvalid))
+
+    params = dict(PARAMS)
+    if threads:
+        params["nthread"] = threads
+    if mode == "refresh":
+        params.pop("tree_method")
+        params.update(process_type="update", updater="refresh", refresh_leaf=True)
+        rounds = booster.num_boosted_rounds()
+    elif 'c' in (booster.feature_types or []):
+        params["max_cat_to_onehot"] = 1
+    updated = xgb.train(params, dtrain, num_boost_round=rounds, xgb_model=booster)
+    after = roc_auc_score(y[held_out], updated.predict(dvalid))
+    print(f"{mode}: {len(X):,} new events since {since}, held-out AUC {before:.4f} -> {after:.4f} "
+          f"({time.perf_counter() - started:.1f}s)")
+    if after + tolerance < before and not force:
+        print("Update rejected: held-out AUC got worse (use --force to publish anyway)")
+        return None
+
+    new_model = xgb.XGBClassifier()
+    new_model.load_model(bytearray(updated.save_raw("ubj")))
+    new_manifest = model_store.save_version(new_model, vocab, {
+        "mode": mode, "rows": len(X), "auc": after, "base_auc": before, "window_start": str(since),
+        "data_end": str(data_end), "trees": updated.num_boosted_rounds(),
+    }, files={EXPLANATIONS_NAME: save_explanations(build_explanations(new_model, vocab, X[held_out]))})
+    print(f"Model version {new_manifest['version']} published")
+    return new_manifest
+
+def watch(mode, rounds, data_file, interval, min_rows, max_rows, threads, max_gap, max_auc_drop):
+    """Check for drift every `interval` seconds and update the model when it is found"""
+    while True:
+        model, vocab, manifest = model_store.load_current()
+        if not (manifest or {}).get("data_end"):
+            raise SystemExit("The current model has no training data end; retrain it with train_model.py first")
+        window = load_window(data_file or _data_file(), manifest["data_end"], vocab)
+        X, y = window[0], window[1]
+        if X is None or len(X) < min_rows:
+            print(f"{0 if X is None else len(X):,} new events since {manifest['data_end']}, waiting for {min_rows:,}")
+        else:
+            drift = check_drift(model.get_booster(), X, y, manifest, max_gap, max_auc_drop)
+            print(f"{drift['rows']:,} new events: calibration gap {drift['calibration_gap']:.4f}, "
+                  f"AUC drop {drift['auc_drop']:.4f}")
+            # A window this large is folded in even without drift, so windows stay bounded
+            if drift["drifted"] or len(X) >= max_rows:
+                update_model(mode, rounds, data_file, threads=threads, window=window)
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the current model on newly recorded events")
+    parser.add_argument("--mode", choices=["boost", "refresh"], default="boost")
+    parser.add_argument("--rounds", type=int, default=20, help="Trees added in boost mode")
+    parser.add_argument("--data", default=None, help="Events CSV or Parquet dataset (default: data/)")
+    parser.add_argument("--since", default=None, help="Window start (default: the model's data_end)")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.0, help="Allowed held-out AUC decrease")
+    parser.add_argument("--force", action="store_true", help="Publish even if held-out AUC gets worse")
+    parser.add_argument("--watch", action="store_true", help="Run as a drift-triggered scheduler")
+    parser.add_argument("--interval", type=float, default=3600, help="Seconds between drift checks")
+    parser.add_argument("--min-rows", type=int, default=10_000, help="Smallest window checked for drift")
+    parser.add_argument("--max-rows", type=int, default=5_000_000, help="Window size that triggers an update anyway")
+    parser.add_argument("--max-gap", type=float, default=0.02, help="Calibration gap that counts as drift")
+    parser.add_argument("--max-auc-drop", type=float, default=0.02, help="AUC drop that counts as drift")
+    args = parser.parse_args()
+    if args.watch:
+        watch(args.mode, args.rounds, args.data, args.interval, args.min_rows, args.max_rows, args.threads,
+              args.max_gap, args.max_auc_drop)
+    else:
+        update_model(args.mode, args.rounds, args.data, args.since, args.threads, args.tolerance, args.force)
@@ -0,0 +1,259 @@
+"""
+Prefix-sum index behind the risk zone map
+
+The index holds attempt and failure counts in an array with one axis
+per (state, district) pair, per filterable dimension and per day, cumulated
+along the day axis. Any date range is then the difference of two day slices,
+and any combination of filters is an index selection over a few thousand
+cells, so a state or district breakdown costs the same regardless of how
+many events the dataset holds.
+
+Only days with events get a slice, so memory follows the number of busy
+days rather than the span between the first and last event.
+"""
+import numpy as np
+import pandas as pd
+
+import metrics
+from event_store import EventChunk
+
+# Dimensions the risk zone map can be filtered by, besides state and dates
+FILTER_DIMENSIONS = ['age_group', 'biometric_type', 'device_model', 'gender']
+
+NEVER_SEEN = np.iinfo(np.int64).max
+
+# Merging in a batch may take an index to MAX_CELLS (state, district) ×
+# FILTER_DIMENSIONS label combinations, or to MAX_GROWTH times its own,
+# whichever is more, as for timeseries.MAX_CELLS
+MAX_CELLS = 1 << 17
+MAX_GROWTH = 2
+
+def _count_dtype(n):
+    return np.int32 if n < np.iinfo(np.int32).max else np.int64
+
+def _embed(values, positions, shape, fill=0):
+    """Place `values` into a new array of `shape` at the per-axis `positions`"""
+    result = np.full(shape, fill, dtype=values.dtype)
+    result[np.ix_(*positions)] = values
+    return result
+
+def index_cell_limit(index):
+    """Most label combinations a batch merged into `index` (None before any data) may produce"""
+    cells = int(np.prod(index.first_seen.shape)) if index is not None else 0
+    return max(MAX_CELLS, MAX_GROWTH * cells)
+
+def _check_cells(cell_shape, limit):
+    cells = int(np.prod(cell_shape))
+    if limit is not None and cells > limit:
+        raise ValueError(f"Risk index would hold {cells} label combinations, more than {limit}")
+
+class RiskIndex:
+    """Attempt/failure counts per (state, district), filter dimension and day"""
+
+    def __init__(self, pairs, vocab, first_day, n_days, days, cum_total, cum_failures, first_seen):
+        for array in [days, cum_total, cum_failures, first_seen]:
+            array.setflags(write=False)
+        # (state, district) labels, sorted by state then district
+        self.pairs = pairs
+        self.vocab = vocab
+        self.first_day = first_day
+        self.n_days = n_days
+        # Day-axis positions with events, ascending; slice i + 1 of the
+        # cumulative counts includes days[i] and every day before it
+        self.days = days
+        self.cum_total = cum_total
+        self.cum_failures = cum_failures
+        self.first_seen = first_seen
+        self.states = sorted({state for state, _ in pairs})
+        self.pair_state = np.array([self.states.index(state) for state, _ in pairs], dtype=np.int64)
+
+    def shared_arrays(self):
+        """(arrays, metadata) from which from_shared_arrays() rebuilds the index"""
+        arrays = {"days": self.days, "cum_total": self.cum_total, "cum_failures": self.cum_failures,
+                  "first_seen": self.first_seen}
+        return arrays, (self.pairs, self.vocab, self.first_day, self.n_days)
+
+    @classmethod
+    def from_shared_arrays(cls, arrays, meta):
+        pairs, vocab, first_day, n_days = meta
+        return cls(pairs, vocab, first_day, n_days, arrays["days"], arrays["cum_total"], arrays["cum_failures"],
+                   arrays["first_seen"])
+
+    @classmethod
+    def from_frame(cls, df, offset=0):
+        """
+        Build the index from a frame of raw authentication events
+
+        `offset` is the position of the frame's first row in the full
+        dataset, as for AggregateCube.from_frame.
+        """
+        return cls.from_events(EventChunk.from_frame(df), offset)
+
+    @classmethod
+    def from_events(cls, events, offset=0, max_cells=None):
+        """
+        Build the index from an EventChunk, working on its codes
+
+        `offset` is as for from_frame(). Pass `max_cells` (see index_cell_limit())
+        to refuse a batch with more label combinations before allocating for
+        them.
+        """
+        state_codes, state_labels = events.column('state')
+        district_codes, district_labels = events.column('district')
+        # Both code sets follow label order, so pairs come out sorted by state then district
+        pair_keys, pair_codes = np.unique(state_codes.astype(np.int64) * len(district_labels) + district_codes,
+                                          return_inverse=True)
+        pairs = [(state_labels[key // len(district_labels)], district_labels[key % len(district_labels)])
+                 for key in pair_keys]
+
+        row_codes = [pair_codes]
+        vocab = {}
+        for dim in FILTER_DIMENSIONS:
+            codes, labels = events.column(dim)
+            row_codes.append(codes)
+            vocab[dim] = list(labels)
+
+        days = events.timestamps('D')
+        first_day = days.min() if len(days) else np.datetime64('1970-01-01')
+        day_codes = (days - first_day).astype(np.int64)
+        n_days = int(day_codes.max()) + 1 if len(days) else 0
+        busy_days, day_rows = np.unique(day_codes, return_inverse=True)
+
+        cell_shape = tuple(max(len(labels), 1) for labels in [pairs] + list(vocab.values()))
+        _check_cells(cell_shape, max_cells)
+        cells = np.ravel_multi_index(row_codes, cell_shape)
+        keys = day_rows * int(np.prod(cell_shape)) + cells
+
+        is_failure = events.is_failure()
+        dtype = _count_dtype(len(events))
+        shape = (len(busy_days),) + cell_shape
+        size = int(np.prod(shape))
+        total = np.bincount(keys, minlength=size).astype(dtype).reshape(shape)
+        failures = np.bincount(keys[is_failure], minlength=size).astype(dtype).reshape(shape)
+
+        first_seen = np.full(int(np.prod(cell_shape)), NEVER_SEEN, dtype=np.int64)
+        seen, first_rows = np.unique(cells, return_index=True)
+        first_seen[seen] = first_rows + offset
+        return cls(pairs, vocab, first_day, n_days, busy_days, cls._cumulate(total), cls._cumulate(failures),
+                   first_seen.reshape(cell_shape))
+
+    @staticmethod
+    def _cumulate(counts):
+        """Cumulative counts along the day axis with a leading zero slice"""
+        cum = np.zeros((counts.shape[0] + 1,) + counts.shape[1:], dtype=counts.dtype)
+        np.cumsum(counts, axis=0, out=cum[1:])
+        return cum
+
+    def merge(self, other):
+        """
+        Return a new index combining the counts of this index and `other`
+
+        Raises ValueError if the result would hold more label combinations
+        than index_cell_limit(self) allows.
+        """
+        pairs = sorted(set(self.pairs) | set(other.pairs))
+        vocab = {dim: sorted(set(self.vocab[dim]) | set(other.vocab[dim])) for dim in FILTER_DIMENSIONS}
+        first_day = min(self.first_day, other.first_day)
+        last_day = max(self.first_day + self.n_days, other.first_day + other.n_days)
+        cell_shape = tuple(max(len(labels), 1) for labels in [pairs] + list(vocab.values()))
+        _check_cells(cell_shape, index_cell_limit(self))
+        shifted = [index.days + int((index.first_day - first_day).astype(np.int64)) for index in (self, other)]
+        busy_days = np.union1d(*shifted)
+        shape = (len(busy_days),) + cell_shape
+        dtype = _count_dtype(int(self.cum_total[-1].sum()) + int(other.cum_total[-1].sum()))
+
+        total = np.zeros(shape, dtype=dtype)
+        failures = np.zeros(shape, dtype=dtype)
+        first_seen = np.full(cell_shape, NEVER_SEEN, dtype=np.int64)
+        for index, index_days in zip((self, other), shifted):
+            axes = [[pairs.index(pair) for pair in index.pairs]]
+            axes += [[vocab[dim].index(label) for label in index.vocab[dim]] for dim in FILTER_DIMENSIONS]
+            positions = [np.searchsorted(busy_days, index_days)] + axes
+            total += _embed(np.diff(index.cum_total, axis=0).astype(dtype), positions, shape)
+            failures += _embed(np.diff(index.cum_failures, axis=0).astype(dtype), positions, shape)
+            first_seen = np.minimum(first_seen, _embed(index.first_seen, axes, cell_shape, NEVER_SEEN))
+        return RiskIndex(pairs, vocab, first_day, int((last_day - first_day).astype(np.int64)), busy_days,
+                         self._cumulate(total), self._cumulate(failures), first_seen)
+
+    def _day_range(self, dates):
+        """Slices of the cumulative counts bounding a (start, end) date pair"""
+        start, end = dates
+        lo = 0 if start is None else int((np.datetime64(start, 'D') - self.first_day).astype(np.int64))
+        hi = self.n_days if end is None else int((np.datetime64(end, 'D') - self.first_day).astype(np.int64)) + 1
+        lo = min(max(lo, 0), self.n_days)
+        hi = min(max(hi, lo), self.n_days)
+        # The slice holding every busy day before each bound
+        return int(np.searchsorted(self.days, lo)), int(np.searchsorted(self.days, hi))
+
+    def _positions(self, labels, values):
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        return [labels.index(value) for value in values if value in labels]
+
+    @staticmethod
+    def _select(array, axes):
+        for axis, positions in enumerate(axes):
+            if positions is not None:
+                array = array.take(positions, axis=axis)
+        return array
+
+    @metrics.timed("risk_index.rollup")
+    def rollup(self, by, where=None):
+        """
+        Aggregate by ['state'] or ['state', 'district']
+
+        `where` may filter on state, district, FILTER_DIMENSIONS (a value or
+        list of values) and 'date', a (start, end) pair of dates either of
+        which may be None; both ends are inclusive. Returns the same frame
+        as AggregateCube.rollup(): one row per group with any attempts in
+        range, sorted by label, with total, failures and first_seen. Like
+        DuckDBQueries.rollup(), first_seen ignores the date range: it is the
+        group's first event matching the other filters on any date.
+        """
+        where = dict(where or {})
+        lo, hi = self._day_range(where.pop('date', (None, None)))
+
+        pair_positions = np.arange(len(self.pairs))
+        if 'state' in where:
+            wanted = self._positions(self.states, where.pop('state'))
+            pair_positions = pair_positions[np.isin(self.pair_state, wanted)]
+        if 'district' in where:
+            districts = where.pop('district')
+            wanted = set(districts) if isinstance(districts, (list, tuple, set)) else {districts}
+            pair_positions = pair_positions[[self.pairs[i][1] in wanted for i in pair_positions]]
+        # Positions to keep along each cell axis; None keeps the whole axis
+        axes = [pair_positions if len(pair_positions) < len(self.pairs) else None]
+        axes += [self._positions(self.vocab[dim], where.pop(dim)) if dim in where else None
+                 for dim in FILTER_DIMENSIONS]
+        if where:
+            raise KeyError(f"Unknown risk zone filter: {', '.join(where)}")
+
+        total = self._select(self.cum_total[hi], axes) - self._select(self.cum_total[lo], axes)
+        failures = self._select(self.cum_failures[hi], axes) - self._select(self.cum_failures[lo], axes)
+        first_seen = self._select(self.first_seen, axes)
+        cell_axes = tuple(range(1, total.ndim))
+        total = total.sum(axis=cell_axes, dtype=np.int64)
+        failures = failures.sum(axis=cell_axes, dtype=np.int64)
+        first_seen = first_seen.min(axis=cell_axes, initial=NEVER_SEEN)
+
+        if list(by) == ['state']:
+            groups = self.pair_state[pair_positions]
+            n_groups = len(self.states)
+            total = np.bincount(groups, weights=total, minlength=n_groups).astype(np.int64)
+            failures = np.bincount(groups, weights=failures, minlength=n_groups).astype(np.int64)
+            group_first = np.full(n_groups, NEVER_SEEN, dtype=np.int64)
+            np.minimum.at(group_first, groups, first_seen)
+            observed = np.flatnonzero(total > 0)
+            result = {'state': [self.states[i] for i in observed]}
+            first_seen = group_first
+        elif list(by) == ['state', 'district']:
+            observed = np.flatnonzero(total > 0)
+            result = {'state': [self.pairs[pair_positions[i]][0] for i in observed],
+                      'district': [self.pairs[pair_positions[i]][1] for i in observed]}
+        else:
+            raise ValueError(f"Risk index rolls up by state or state and district, not {by}")
+
+        result['total'] = total[observed]
+        result['failures'] = failures[observed]
+        result['first_seen'] = first_seen[observed]
+        return pd.DataFrame(result)
@@ -0,0 +1,281 @@
+"""
+Shared, versioned snapshots of the dataset and aggregates for multi-worker serving
+
+With several uvicorn workers, each would otherwise load the dataset and
+build its own aggregates, multiplying memory by the worker count and letting
+workers drift apart after an ingest or refresh. A SnapshotStore instead
+holds numbered generations in one directory (ideally on tmpfs, e.g.
+/dev/shm):
+
+    SNAPSHOT_DIR/
+        generation        8-byte counter naming the current generation
+        lock              flock serialising publishers
+        000000000007/
+            manifest.json
+            queries.total.npy ...          aggregate arrays (see shared_arrays()) per source
+            queries.meta.json ...          their class, vocabularies and metadata
+            events.000000000000.arrow ...  the compact event chunks (see event_store), in Arrow IPC
+            anomaly.json                   anomaly detector state
+            changes.json                   detector changes made by this generation
+
+Whichever worker holds the lock builds a generation (at startup, on
+refresh, or by merging an ingested batch into the newest generation),
+writes it to a temporary directory, renames it into place and only then
+bumps the counter. Workers memory-map the arrays and Arrow chunks
+read-only, so every worker shares one copy of the pages, and compare the
+counter (a memory read) before each request, switching to a newer
+generation as a whole. Dataset chunks are hard-linked from the previous
+generation, so an ingest writes only the new batch.
+
+Nothing in a generation is pickled: every worker loads it from a shared
+directory, and loading a pickle runs whatever code it names. Metadata and
+detector state are JSON, and sources are rebuilt only as one of
+SOURCE_CLASSES.
+"""
+import fcntl
+import json
+import mmap
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+
+from anomaly import AnomalyDetector
+from approx import ApproxIndex
+from cube import AggregateCube
+from event_store import EventChunk
+from risk_index import RiskIndex
+from timeseries import TimeSeriesStore
+
+MANIFEST_NAME = "manifest.json"
+GENERATION_NAME = "generation"
+LOCK_NAME = "lock"
+
+# The only classes a generation's sources are rebuilt as, by name
+SOURCE_CLASSES = {cls.__name__: cls for cls in [AggregateCube, ApproxIndex, RiskIndex, TimeSeriesStore]}
+
+def dataset_stamp(path):
+    """(files, bytes, newest mtime) of a dataset file or directory, to tell whether a snapshot is stale"""
+    if os.path.isdir(path):
+        files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+    else:
+        files = [path] if os.path.exists(path) else []
+    stats = [os.stat(file) for file in files]
+    return [len(stats), sum(stat.st_size for stat in stats), max((stat.st_mtime_ns for stat in stats), default=0)]
+
+def _write_arrow(table, path):
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def _encode(value):
+    """JSON form of source metadata, tagging the tuples and datetime64 values that JSON would lose"""
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError("Snapshot metadata keys must be strings")
+        return {"dict": {key: _encode(item) for key, item in value.items()}}
+    if isinstance(value, tuple):
+        return {"tuple": [_encode(item) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, np.datetime64):
+        return {"datetime64": str(value), "unit": np.datetime_data(value.dtype)[0]}
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"Cannot store {type(value).__name__} in snapshot metadata")
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, dict):
+        if "dict" in value:
+            return {key: _decode(item) for key, item in value["dict"].items()}
+        if "tuple" in value:
+            return tuple(_decode(item) for item in value["tuple"])
+        return np.datetime64(value["datetime64"], value["unit"])
+    return value
+
+def _load_source(directory, name):
+    """Rebuild source `name` of a generation over memory-mapped arrays"""
+    with open(os.path.join(directory, f"{name}.meta.json")) as f:
+        meta = json.load(f)
+    cls = SOURCE_CLASSES[meta["class"]]
+    arrays = {key: np.load(os.path.join(directory, f"{name}.{key}.npy"), mmap_mode="r", allow_pickle=False)
+              for key in meta["arrays"]}
+    return cls.from_shared_arrays(arrays, _decode(meta["meta"]))
+
+class SnapshotSource:
+    """
+    Picklable handle to one source of a generation, for process pools
+
+    Like executors.SharedSource, only the path travels to worker processes,
+    which map the same files rather than receiving a copy.
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = f"{directory}:{name}"
+        self.source = name
+
+    def attach(self):
+        return _load_source(self.directory, self.source)
+
+    def release(self, unlink=False):
+        pass
+
+class Snapshot:
+    """One attached generation: its query sources, detector and dataset chunks"""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self.generation = manifest["generation"]
+        self.rows = manifest["rows"]
+        self.sources = {name: _load_source(directory, name) for name in manifest["sources"]}
+        with open(os.path.join(directory, "anomaly.json")) as f:
+            self.detector = AnomalyDetector.from_state(json.load(f))
+        self.chunk_files = [os.path.join(directory, name) for name in manifest["chunks"]]
+
+    def events(self):
+        """The dataset as EventChunks over the memory-mapped files (no rows are copied)"""
+        return [EventChunk.from_arrow(pa.ipc.open_file(pa.memory_map(path)).read_all()) for path in self.chunk_files]
+
+    def handle(self, name):
+        return SnapshotSource(self.directory, name)
+
+class SnapshotStore:
+    """Generations of shared snapshots under `root`"""
+
+    def __init__(self, root, keep=4):
+        self.root = root
+        self.keep = keep
+        os.makedirs(root, exist_ok=True)
+        counter = os.path.join(root, GENERATION_NAME)
+        try:
+            fd = os.open(counter, os.O_RDWR | os.O_CREAT | os.O_EXCL)
+            os.write(fd, bytes(8))
+        except FileExistsError:
+            fd = os.open(counter, os.O_RDWR)
+        self._counter = mmap.mmap(fd, 8)
+        os.close(fd)
+
+    def generation(self):
+        """Current generation number (0 before anything is published)"""
+        return int.from_bytes(self._counter[:8], "little")
+
+    def _directory(self, generation):
+        return os.path.join(self.root, f"{generation:012d}")
+
+    @contextmanager
+    def lock(self):
+        """Exclusive lock held while building and publishing a generation, across processes"""
+        with open(os.path.join(self.root, LOCK_NAME), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def manifest(self, generation=None):
+        """Manifest of a generation (the current one by default), or None"""
+        generation = self.generation() if generation is None else generation
+        try:
+            with open(os.path.join(self._directory(generation), MANIFEST_NAME)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def attach(self, generation=None):
+        """Map a generation (the current one by default); None before anything is published"""
+        generation = self.generation() if generation is None else generation
+        manifest = self.manifest(generation)
+        return None if manifest is None else Snapshot(self._directory(generation), manifest)
+
+    def publish(self, sources, detector, chunks, rows, changes=(), info=None):
+        """
+        Write a new generation and make it current; call with lock() held
+
+        `sources` maps names to instances of SOURCE_CLASSES, which all have
+        shared_arrays(). `chunks` lists the dataset as chunk
+        files of an earlier generation (linked, not copied) and EventChunks
+        (written). `changes` are the anomaly detector changes this
+        generation introduces, replayed by workers as they switch to it.
+        """
+        generation = self.generation() + 1
+        directory = self._directory(generation)
+        tmp = f"{directory}.tmp-{os.getpid()}"
+        os.makedirs(tmp)
+        try:
+            for name, source in sources.items():
+                arrays, meta = source.shared_arrays()
+                for key, array in arrays.items():
+                    np.save(os.path.join(tmp, f"{name}.{key}.npy"), array)
+                with open(os.path.join(tmp, f"{name}.meta.json"), "w") as f:
+                    json.dump({"class": type(source).__name__, "arrays": list(arrays), "meta": _encode(meta)}, f)
+            chunk_names = []
+            for i, chunk in enumerate(chunks):
+                chunk_name = f"events.{i:012d}.arrow"
+                if isinstance(chunk, str):
+                    os.link(chunk, os.path.join(tmp, chunk_name))
+                else:
+                    _write_arrow(chunk.to_arrow(), os.path.join(tmp, chunk_name))
+                chunk_names.append(chunk_name)
+            with open(os.path.join(tmp, "anomaly.json"), "w") as f:
+                json.dump(detector.state(), f)
+            with open(os.path.join(tmp, "changes.json"), "w") as f:
+                json.dump(list(changes), f)
+            manifest = {
+                "generation": generation,
+                "created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                "pid": os.getpid(),
+                "rows": rows,
+                "sources": list(sources),
+                "chunks": chunk_names,
+                **(info or {}),
+            }
+            with open(os.path.join(tmp, MANIFEST_NAME), "w") as f:
+                json.dump(manifest, f, indent=2)
+            # Left by a publisher that died before bumping the counter
+            shutil.rmtree(directory, ignore_errors=True)
+            os.rename(tmp, directory)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self._counter[:8] = generation.to_bytes(8, "little")
+        self._prune(generation)
+        return generation
+
+    def changes(self, after, upto):
+        """Detector changes of generations after `after` up to `upto`, for those still kept"""
+        changes = []
+        for generation in range(max(after + 1, upto - self.keep + 1), upto + 1):
+            try:
+                with open(os.path.join(self._directory(generation), "changes.json")) as f:
+                    changes += [tuple(change) for change in json.load(f)]
+            except FileNotFoundError:
+                pass
+        return changes
+
+    def _prune(self, current):
+        """Remove all but the newest `keep` generations; workers still mapping one keep their pages"""
+        for name in os.listdir(self.root):
+            # Temporary directories are left by publishers that died, as the lock is held
+            if (name.isdigit() and int(name) <= current - self.keep) or ".tmp-" in name:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+class SnapshotMiddleware:
+    """ASGI middleware awaiting `sync()` before each HTTP request, so workers serve the newest generation"""
+
+    def __init__(self, app, sync):
+        self.app = app
+        self.sync = sync
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self.sync()
+        await self.app(scope, receive, send)
@@ -0,0 +1,250 @@
+"""
+Columnar Parquet storage for UIDAI authentication events
+
+Events are stored as a hive-partitioned Parquet dataset (month=YYYY-MM/state=...)
+with dictionary-encoded string columns and native timestamps. Reads can be
+column-pruned and filtered on the partition keys, and come back as pandas
+frames with categorical dtypes.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Arrow buffers are short-lived (they are converted to pandas and dropped), so
+# use the system allocator, which hands freed pages back instead of keeping
+# them in a jemalloc arena for the lifetime of the API process.
+pa.set_memory_pool(pa.system_memory_pool())
+
+# glibc's malloc_trim, or None on other C libraries
+_libc = ctypes.CDLL(ctypes.util.find_library('c')) if ctypes.util.find_library('c') else None
+_malloc_trim = getattr(_libc, 'malloc_trim', None)
+
+EVENT_COLUMNS = ['auth_timestamp', 'state', 'district', 'age_group', 'gender', 'biometric_type',
+                 'device_model', 'auth_result', 'failure_reason', 'attempt_count']
+# auth_timestamp format of events CSV files; appended rows use it too, so a
+# file never mixes formats that read_csv cannot parse as one column
+CSV_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+CATEGORICAL_COLUMNS = ['state', 'district', 'age_group', 'gender', 'biometric_type',
+                       'device_model', 'auth_result', 'failure_reason']
+PARTITION_COLUMNS = ['month', 'state']
+
+_dictionary = pa.dictionary(pa.int32(), pa.string())
+EVENT_SCHEMA = pa.schema([
+    ('auth_timestamp', pa.timestamp('us')),
+    ('state', _dictionary),
+    ('district', _dictionary),
+    ('age_group', _dictionary),
+    ('gender', _dictionary),
+    ('biometric_type', _dictionary),
+    ('device_model', _dictionary),
+    ('auth_result', _dictionary),
+    ('failure_reason', _dictionary),
+    ('attempt_count', pa.int16()),
+    ('month', pa.string()),
+])
+PARTITIONING = ds.partitioning(
+    pa.schema([(column, pa.string()) for column in PARTITION_COLUMNS]), flavor='hive'
+)
+
+def _sorted_categories(df):
+    """Store categorical columns with lexically sorted categories, matching groupby order on strings"""
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            if df[column].dtype != 'category':
+                df[column] = df[column].astype('category')
+            categories = df[column].cat.categories
+            if not categories.is_monotonic_increasing:
+                df[column] = df[column].cat.reorder_categories(sorted(categories))
+    return df
+
+def _dictionary_array(values):
+    """Dictionary-encode a pandas column through its categorical codes"""
+    if values.dtype != 'category':
+        values = values.astype('category')
+    codes = values.cat.codes.to_numpy().astype(np.int32)
+    dictionary = pa.array(values.cat.categories.astype(str), pa.string())
+    return pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0), dictionary)
+
+def to_arrow(df):
+    """
+    Convert a frame of events to an Arrow table with EVENT_SCHEMA
+
+    Rows are ordered by partition (month, state) so each partition is
+    written as a few large row groups rather than many small ones.
+    """
+    df = df.reset_index(drop=True)
+    timestamps = pd.to_datetime(df['auth_timestamp']).to_numpy(dtype='datetime64[us]')
+    months, month_codes = np.unique(timestamps.astype('datetime64[M]'), return_inverse=True)
+
+    columns = {'auth_timestamp': pa.array(timestamps, pa.timestamp('us'))}
+    for column in CATEGORICAL_COLUMNS:
+        values = df[column] if column in df.columns else pd.Series(None, index=df.index, dtype=object)
+        columns[column] = _dictionary_array(values)
+    columns['attempt_count'] = pa.array(df['attempt_count'].to_numpy(dtype=np.int16), pa.int16())
+    columns['month'] = pa.array([str(month) for month in months], pa.string()).take(month_codes)
+
+    order = np.lexsort([columns['state'].indices.to_numpy(zero_copy_only=False), month_codes])
+    return pa.table(columns).cast(EVENT_SCHEMA).take(order)
+
+def write_dataset(df, root):
+    """Append a frame of events to the partitioned Parquet dataset at `root`"""
+    ds.write_dataset(
+        to_arrow(df),
+        root,
+        format='parquet',
+        partitioning=PARTITIONING,
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+def read_dataset(root, columns=None, filters=None, memory_map=True):
+    """
+    Read the partitioned Parquet dataset at `root` into a pandas frame
+
+    `columns` prunes the columns read from disk and `filters` (pyarrow
+    filter tuples, e.g. [('month', '>=', '2024-11')]) prunes partitions.
+    """
+    columns = list(columns) if columns is not None else EVENT_COLUMNS
+    table = pq.read_table(
+        root,
+        columns=columns,
+        filters=filters,
+        memory_map=memory_map,
+        partitioning=PARTITIONING,
+    )
+    if 'state' in columns:
+        table = table.set_column(table.schema.get_field_index('state'), 'state',
+                                 table.column('state').dictionary_encode())
+    table = table.unify_dictionaries()
+    df = table.to_pandas(split_blocks=True, self_destruct=True, coerce_temporal_nanoseconds=True)
+    del table
+    pa.default_memory_pool().release_unused()
+    return _sorted_categories(df[columns])
+
+def read_csv(path, columns=None):
+    """Read an events CSV with categorical dtypes and parsed timestamps"""
+    columns = list(columns) if columns is not None else EVENT_COLUMNS
+    dtype = {column: 'category' for column in CATEGORICAL_COLUMNS if column in columns}
+    df = pd.read_csv(path, usecols=columns, dtype=dtype,
+                     parse_dates=['auth_timestamp'] if 'auth_timestamp' in columns else False)
+    return _sorted_categories(df[columns])
+
+def add_derived_columns(df):
+    """
+    Add the columns derived from auth_timestamp and auth_result, in place
+
+    month (1-12), period ('YYYY-MM' categorical), day_of_week, hour and
+    is_failure (int8) are computed once when events are loaded or ingested
+    so request handlers never recompute or assign columns on shared frames.
+    """
+    timestamps = df['auth_timestamp']
+    months = timestamps.to_numpy().astype('datetime64[M]')
+    periods, period_codes = np.unique(months, return_inverse=True)
+    df['month'] = (months.astype(np.int64) % 12 + 1).astype(np.int8)
+    df['period'] = pd.Categorical.from_codes(period_codes, [str(period) for period in periods])
+    df['day_of_week'] = timestamps.dt.dayofweek.astype(np.int8)
+    df['hour'] = timestamps.dt.hour.astype(np.int8)
+    df['is_failure'] = (df['auth_result'] == 'failure').to_numpy(dtype=np.int8)
+    return df
+
+def release_memory():
+    """
+    Hand memory freed after a load back to the OS
+
+    glibc raises its mmap threshold as large buffers are freed, so later
+    chunk buffers come from the heap and stay resident after they are freed;
+    malloc_trim returns those pages.
+    """
+    pa.default_memory_pool().release_unused()
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+
+def load_events(path, columns=None):
+    """Load events from a Parquet dataset directory or a CSV file"""
+    if os.path.isdir(path):
+        return read_dataset(path, columns)
+    return read_csv(path, columns)
+
+def read_tables(path, chunk_size=1_000_000, columns=None, since=None):
+    """
+    Yield Arrow tables of about `chunk_size` rows from a Parquet file or
+    dataset, without loading the whole dataset
+
+    `since` keeps only events after that timestamp, skipping older month
+    partitions of a dataset without reading them.
+    """
+    partitioning = PARTITIONING if os.path.isdir(path) else None
+    dataset = ds.dataset(path, format='parquet', partitioning=partitioning)
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name != 'month' or partitioning is None]
+    selection = None
+    if since is not None:
+        since = pd.Timestamp(since)
+        selection = ds.field('auth_timestamp') > pa.scalar(since.to_pydatetime(), pa.timestamp('us'))
+        if partitioning is not None:
+            selection &= ds.field('month') >= since.strftime('%Y-%m')
+    # Partition files are small, so coalesce record batches up to chunk_size rows
+    batches = []
+    buffered = 0
+    for batch in dataset.to_batches(columns=list(columns), filter=selection, batch_size=chunk_size):
+        batches.append(batch)
+        buffered += batch.num_rows
+        if buffered >= chunk_size:
+            yield pa.Table.from_batches(batches)
+            batches, buffered = [], 0
+    if batches:
+        yield pa.Table.from_batches(batches)
+
+def read_chunks(path, chunk_size=1_000_000, columns=None, since=None):
+    """
+    Yield DataFrame chunks of about `chunk_size` rows from a CSV file or a
+    Parquet file/dataset, without loading the whole file
+
+    Values come back as stored: CSV timestamps are not parsed unless
+    `since` is given, which keeps only events after that timestamp (and
+    skips older month partitions of a dataset without reading them).
+    """
+    if os.path.isdir(path) or path.endswith('.parquet'):
+        for table in read_tables(path, chunk_size, columns, since):
+            yield table.to_pandas()
+    elif since is not None:
+        since = pd.Timestamp(since)
+        for chunk in pd.read_csv(path, chunksize=chunk_size, usecols=columns, parse_dates=['auth_timestamp']):
+            chunk = chunk[chunk['auth_timestamp'] > since]
+            if len(chunk):
+                yield chunk
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=columns)
+
+def convert_csv(csv_file, root, chunk_size=1_000_000, overwrite=False):
+    """Convert an events CSV to a partitioned Parquet dataset, one chunk at a time"""
+    if os.path.isdir(root) and os.listdir(root):
+        if not overwrite:
+            raise FileExistsError(f"Parquet dataset already exists: {root}")
+        shutil.rmtree(root)
+    rows = 0
+    for chunk in pd.read_csv(csv_file, chunksize=chunk_size, parse_dates=['auth_timestamp']):
+        write_dataset(chunk, root)
+        rows += len(chunk)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert an events CSV to a partitioned Parquet dataset")
+    parser.add_argument("csv_file", nargs="?", default="data/uidai_sample_data.csv")
+    parser.add_argument("root", nargs="?", default="data/uidai_parquet")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    parser.add_argument("--overwrite", action="store_true", help="Replace an existing dataset at root")
+    args = parser.parse_args()
+
+    rows = convert_csv(args.csv_file, args.root, args.chunk_size, args.overwrite)
+    print(f"Converted {rows} records from {args.csv_file} to {args.root}")
@@ -0,0 +1,84 @@
+"""
+The cube and DuckDB query backends serve identical dashboard payloads
+
+The app is started in-process once per backend against the same small
+generated dataset, as a CSV file and as a partitioned Parquet dataset, and
+each response body is compared byte for byte.
+"""
+import os
+
+# Ingested batches stay in memory and the model is only loaded at startup
+os.environ.setdefault("INGEST_PERSIST", "0")
+os.environ.setdefault("MODEL_RELOAD_INTERVAL", "0")
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from generate_data import write_sample_data
+from storage import convert_csv
+
+ROWS = 5000
+
+# First day of the generated year, so the date ranges below fall inside it
+START_DATE = "2025-01-01"
+
+# (path, query parameters) of every payload compared
+REQUESTS = [
+    ("/api/kpis", {}),
+    ("/api/trends", {}),
+    ("/api/insights", {}),
+    ("/api/risk-zones", {}),
+    ("/api/risk-zones", {"biometric_type": "iris", "age_group": "elderly"}),
+    ("/api/risk-zones", {"device_model": "UIDAI_Device_C", "gender": "female"}),
+    ("/api/risk-zones", {"start_date": "2025-03-01", "end_date": "2025-03-31"}),
+    ("/api/risk-zones", {"start_date": "2025-06-10", "end_date": "2025-06-12", "biometric_type": "fingerprint"}),
+    ("/api/risk-zones", {"end_date": "2025-01-05"}),
+    ("/api/risk-zones", {"start_date": "2026-06-01"}),
+    ("/api/risk-zones", {"state": "Bihar"}),
+    ("/api/risk-zones", {"state": "Maharashtra", "age_group": "young", "start_date": "2025-02-01"}),
+    ("/api/risk-zones", {"state": "Unknown"}),
+]
+
+@pytest.fixture(scope="module")
+def datasets(tmp_path_factory):
+    """Directories laid out like backend/, holding the dataset as CSV and as Parquet"""
+    csv_root = tmp_path_factory.mktemp("csv")
+    os.mkdir(csv_root / "data")
+    write_sample_data(str(csv_root / main.DATA_FILE), ROWS, seed=0, start_date=START_DATE)
+    parquet_root = tmp_path_factory.mktemp("parquet")
+    convert_csv(str(csv_root / main.DATA_FILE), str(parquet_root / main.PARQUET_DATA_DIR))
+    return {"csv": csv_root, "parquet": parquet_root}
+
+@pytest.fixture(scope="module")
+def responses(datasets):
+    """Response of every request in REQUESTS by (format, backend)"""
+    result = {}
+    for fmt, root in datasets.items():
+        for backend in ["cube", "duckdb"]:
+            with pytest.MonkeyPatch.context() as patch:
+                patch.chdir(root)
+                patch.setattr(main, "QUERY_BACKEND", backend)
+                with TestClient(main.app) as client:
+                    result[fmt, backend] = [client.get(path, params=params) for path, params in REQUESTS]
+    return result
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+@pytest.mark.parametrize("request_index", range(len(REQUESTS)), ids=[f"{path}{params or ''}"
+                                                                      for path, params in REQUESTS])
+def test_backends_match(responses, fmt, request_index):
+    cube = responses[fmt, "cube"][request_index]
+    duckdb = responses[fmt, "duckdb"][request_index]
+    assert cube.status_code == duckdb.status_code == 200
+    assert cube.json() == duckdb.json()
+    # The bodies also agree on int/float and key order
+    assert cube.content == duckdb.content
+
+def test_payloads_are_not_empty(responses):
+    """Guards the comparisons above against both backends serving nothing"""
+    payloads = [response.json() for response in responses["csv", "cube"]]
+    paths = [path for path, _ in REQUESTS]
+    assert payloads[paths.index("/api/kpis")]["overall_failure_rate"] > 0
+    assert payloads[paths.index("/api/insights")]["insights"]
+    assert len(payloads[REQUESTS.index(("/api/risk-zones", {}))]["zones"]) > 1
+    assert all("district" in zone for zone in payloads[REQUESTS.index(("/api/risk-zones", {"state": "Bihar"}))]["zones"])
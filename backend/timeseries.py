@@ -0,0 +1,239 @@
+"""
+Hourly time-series store behind the trend queries
+
+Attempts and failures are pre-bucketed per hour and per combination of
+SERIES_DIMENSIONS, and cumulated along the hour axis. A bucket at any
+granularity (hour, day, week, month) or a rolling window is then the
+difference of two hour slices, so a query costs O(buckets × cells) however
+many events the buckets hold, and date ranges are just slice bounds.
+
+Only hours with events get a slice, so memory follows the number of busy
+hours rather than the span between the first and last event (one event
+dated decades ahead adds one slice, not decades of empty ones).
+"""
+import numpy as np
+import pandas as pd
+
+import metrics
+from event_store import EventChunk, _factorize_sorted
+from risk_index import _count_dtype, _embed
+
+# Dimensions a series can be split or filtered by
+SERIES_DIMENSIONS = ['state', 'device_model', 'age_group', 'biometric_type']
+
+GRANULARITIES = ['hour', 'day', 'week', 'month']
+
+# Merging in a batch may take a store to MAX_CELLS SERIES_DIMENSIONS label
+# combinations, or to MAX_GROWTH times its own, whichever is more, so a batch
+# of unexpected labels cannot multiply the size of every hour slice unchecked.
+# Stores built from a loaded dataset are not limited.
+MAX_CELLS = 1 << 14
+MAX_GROWTH = 2
+
+def _bucket_starts(hours, granularity):
+    """Start of the enclosing bucket for each datetime64[h] value"""
+    if granularity == 'hour':
+        return hours
+    days = hours.astype('datetime64[D]')
+    if granularity == 'day':
+        return days
+    if granularity == 'week':
+        # Weeks start on Monday; 1970-01-01 was a Thursday
+        return days - (days.astype(np.int64) + 3) % 7
+    if granularity == 'month':
+        return days.astype('datetime64[M]')
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+def _label(start, granularity):
+    if granularity == 'hour':
+        return str(start.astype('datetime64[m]'))
+    return str(start)
+
+def series_cell_limit(store):
+    """Most label combinations a batch merged into `store` (None before any data) may produce"""
+    cells = int(np.prod(store.cum_total.shape[1:])) if store is not None else 0
+    return max(MAX_CELLS, MAX_GROWTH * cells)
+
+def _check_cells(cell_shape, limit):
+    cells = int(np.prod(cell_shape))
+    if limit is not None and cells > limit:
+        raise ValueError(f"Time series would hold {cells} label combinations, more than {limit}")
+
+class TimeSeriesStore:
+    """Cumulative hourly attempt/failure counts per SERIES_DIMENSIONS cell"""
+
+    def __init__(self, vocab, first_hour, n_hours, hours, cum_total, cum_failures):
+        for array in [hours, cum_total, cum_failures]:
+            array.setflags(write=False)
+        self.vocab = vocab
+        # Midnight of the first day with events; the hour axis covers whole days
+        self.first_hour = first_hour
+        self.n_hours = n_hours
+        # Hour-axis positions with events, ascending; slice i + 1 of the
+        # cumulative counts includes hours[i] and every hour before it
+        self.hours = hours
+        self.cum_total = cum_total
+        self.cum_failures = cum_failures
+
+    def shared_arrays(self):
+        """(arrays, metadata) from which from_shared_arrays() rebuilds the store"""
+        arrays = {"hours": self.hours, "cum_total": self.cum_total, "cum_failures": self.cum_failures}
+        return arrays, (self.vocab, self.first_hour, self.n_hours)
+
+    @classmethod
+    def from_shared_arrays(cls, arrays, meta):
+        vocab, first_hour, n_hours = meta
+        return cls(vocab, first_hour, n_hours, arrays["hours"], arrays["cum_total"], arrays["cum_failures"])
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build the store from a frame of raw authentication events"""
+        return cls.from_events(EventChunk.from_frame(df))
+
+    @classmethod
+    def from_events(cls, events, max_cells=None):
+        """
+        Build the store from an EventChunk, working on its codes
+
+        Pass `max_cells` (see series_cell_limit()) to refuse a batch with more label
+        combinations before allocating for them.
+        """
+        return cls._build({dim: events.column(dim) for dim in SERIES_DIMENSIONS}, events.timestamps('h'), None,
+                          events.is_failure(), max_cells)
+
+    @classmethod
+    def from_hourly_counts(cls, counts):
+        """
+        Build the store from pre-aggregated counts
+
+        `counts` has an `hour` timestamp column, the SERIES_DIMENSIONS
+        columns and `total`/`failures` counts, as returned by
+        DuckDBQueries.hourly_counts().
+        """
+        return cls._build({dim: _factorize_sorted(counts[dim]) for dim in SERIES_DIMENSIONS},
+                          counts['hour'].to_numpy().astype('datetime64[h]'),
+                          counts['total'].to_numpy(), counts['failures'].to_numpy())
+
+    @classmethod
+    def _build(cls, columns, hours, total, failures, max_cells=None):
+        """
+        Bucket rows by hour and cell; `columns` maps each dimension to its
+        (codes, sorted labels) and `total` None counts one attempt per row
+        """
+        row_codes = [columns[dim][0] for dim in SERIES_DIMENSIONS]
+        vocab = {dim: list(columns[dim][1]) for dim in SERIES_DIMENSIONS}
+
+        if len(hours):
+            first_hour = hours.min().astype('datetime64[D]').astype('datetime64[h]')
+        else:
+            first_hour = np.datetime64('1970-01-01T00', 'h')
+        hour_codes = (hours - first_hour).astype(np.int64)
+        # Whole days, so the last day's bucket and rolling windows end at midnight too
+        n_hours = (int(hour_codes.max()) // 24 + 1) * 24 if len(hours) else 0
+        busy_hours, hour_rows = np.unique(hour_codes, return_inverse=True)
+
+        cell_shape = tuple(max(len(labels), 1) for labels in vocab.values())
+        _check_cells(cell_shape, max_cells)
+        keys = hour_rows * int(np.prod(cell_shape)) + np.ravel_multi_index(row_codes, cell_shape)
+        shape = (len(busy_hours),) + cell_shape
+        size = int(np.prod(shape))
+        dtype = _count_dtype(len(hours) if total is None else int(total.sum()))
+        total = np.bincount(keys, weights=total, minlength=size).astype(dtype).reshape(shape)
+        failures = np.bincount(keys, weights=failures, minlength=size).astype(dtype).reshape(shape)
+        return cls(vocab, first_hour, n_hours, busy_hours, cls._cumulate(total), cls._cumulate(failures))
+
+    @staticmethod
+    def _cumulate(counts):
+        """Cumulative counts along the hour axis with a leading zero slice"""
+        cum = np.zeros((counts.shape[0] + 1,) + counts.shape[1:], dtype=counts.dtype)
+        np.cumsum(counts, axis=0, out=cum[1:])
+        return cum
+
+    def merge(self, other):
+        """
+        Return a new store combining the counts of this store and `other`
+
+        Raises ValueError if the result would hold more label combinations
+        than series_cell_limit(self) allows.
+        """
+        vocab = {dim: sorted(set(self.vocab[dim]) | set(other.vocab[dim])) for dim in SERIES_DIMENSIONS}
+        first_hour = min(self.first_hour, other.first_hour)
+        last_hour = max(self.first_hour + self.n_hours, other.first_hour + other.n_hours)
+        cell_shape = tuple(max(len(labels), 1) for labels in vocab.values())
+        _check_cells(cell_shape, series_cell_limit(self))
+        shifted = [store.hours + int((store.first_hour - first_hour).astype(np.int64)) for store in (self, other)]
+        busy_hours = np.union1d(*shifted)
+        shape = (len(busy_hours),) + cell_shape
+        dtype = _count_dtype(int(self.cum_total[-1].sum()) + int(other.cum_total[-1].sum()))
+
+        total = np.zeros(shape, dtype=dtype)
+        failures = np.zeros(shape, dtype=dtype)
+        for store, store_hours in zip((self, other), shifted):
+            positions = [np.searchsorted(busy_hours, store_hours)]
+            positions += [[vocab[dim].index(label) for label in store.vocab[dim]] for dim in SERIES_DIMENSIONS]
+            total += _embed(np.diff(store.cum_total, axis=0).astype(dtype), positions, shape)
+            failures += _embed(np.diff(store.cum_failures, axis=0).astype(dtype), positions, shape)
+        return TimeSeriesStore(vocab, first_hour, int((last_hour - first_hour).astype(np.int64)), busy_hours,
+                               self._cumulate(total), self._cumulate(failures))
+
+    def buckets(self, granularity, start=None, end=None):
+        """
+        Bucket labels and hour-axis edges covering [start, end]
+
+        `start` and `end` are inclusive dates (None for the data's extent).
+        Returns (labels, edges) where bucket i spans hours edges[i] to
+        edges[i + 1]; buckets cut by the range are clipped to it.
+        """
+        lo = 0 if start is None else int((np.datetime64(start, 'D') - self.first_hour).astype(np.int64))
+        hi = self.n_hours if end is None else int((np.datetime64(end, 'D') - self.first_hour).astype(np.int64)) + 24
+        lo = min(max(lo, 0), self.n_hours)
+        hi = min(max(hi, lo), self.n_hours)
+
+        keys = _bucket_starts(self.first_hour + np.arange(lo, hi), granularity)
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) if hi > lo else np.empty(0, np.int64)
+        labels = [_label(keys[i], granularity) for i in starts]
+        return labels, np.append(starts + lo, hi)
+
+    def _positions(self, dim, values):
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        return [self.vocab[dim].index(value) for value in values if value in self.vocab[dim]]
+
+    def _at(self, cum, hours, by, where):
+        """Cumulative counts at hour-axis positions `hours`, filtered by `where` and summed to groups of `by`"""
+        # The slice holding every busy hour before each position
+        hours = np.searchsorted(self.hours, hours)
+        # Gathering the hours first is cheaper unless they cover much of the axis
+        gather_first = len(hours) * 8 < cum.shape[0]
+        counts = cum[hours] if gather_first else cum
+        for axis, dim in enumerate(SERIES_DIMENSIONS, start=1):
+            if dim in (where or {}):
+                counts = counts.take(self._positions(dim, where[dim]), axis=axis)
+        keep = SERIES_DIMENSIONS.index(by) + 1 if by else None
+        other_axes = tuple(axis for axis in range(1, counts.ndim) if axis != keep)
+        counts = counts.sum(axis=other_axes, dtype=np.int64)
+        if not gather_first:
+            counts = counts[hours]
+        return counts if by else counts[:, None]
+
+    def groups(self, by, where=None):
+        """Labels of the groups _at() sums to"""
+        if not by:
+            return ['all']
+        if by in (where or {}):
+            return [self.vocab[by][i] for i in self._positions(by, where[by])]
+        return list(self.vocab[by])
+
+    @metrics.timed("timeseries.counts")
+    def counts(self, edges, by=None, where=None):
+        """(total, failures) per bucket and group, shaped (buckets, groups)"""
+        return (np.diff(self._at(self.cum_total, edges, by, where), axis=0),
+                np.diff(self._at(self.cum_failures, edges, by, where), axis=0))
+
+    @metrics.timed("timeseries.rolling")
+    def rolling(self, ends, hours, by=None, where=None):
+        """(total, failures) over the `hours` before each hour-axis position in `ends`"""
+        positions = np.concatenate([ends, np.maximum(ends - hours, 0)])
+        total = self._at(self.cum_total, positions, by, where)
+        failures = self._at(self.cum_failures, positions, by, where)
+        return total[:len(ends)] - total[len(ends):], failures[:len(ends)] - failures[len(ends):]
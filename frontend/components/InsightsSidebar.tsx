@@ -11,14 +11,35 @@ interface Insight {
   title: string
   description: string
   priority: string
+  device_model?: string
+  district?: string
+  biometric_type?: string
 }
 
+// Anomaly alerts are identified by the combination they were raised for
+const alertKey = (insight: Insight) =>
+  `${insight.device_model}|${insight.district}|${insight.biometric_type}`
+
 export default function InsightsSidebar() {
   const [insights, setInsights] = useState<Insight[]>([])
   const [loading, setLoading] = useState(true)
 
   useEffect(() => {
     fetchInsights()
+
+    // Live failure-spike alerts pushed by the anomaly detector
+    const source = new EventSource(`${API_BASE}/api/insights/stream`)
+    source.addEventListener('anomaly', (event) => {
+      const alert: Insight = JSON.parse((event as MessageEvent).data)
+      setInsights((current) => [alert, ...current.filter((insight) => !insight.device_model || alertKey(insight) !== alertKey(alert))])
+    })
+    source.addEventListener('resolved', (event) => {
+      const alert: Insight = JSON.parse((event as MessageEvent).data)
+      setInsights((current) => current.filter((insight) => !insight.device_model || alertKey(insight) !== alertKey(alert)))
+    })
+    // The browser reconnects on its own; re-fetch so alerts missed meanwhile show up
+    source.onopen = () => fetchInsights()
+    return () => source.close()
   }, [])
 
   const fetchInsights = async () => {